@@ -0,0 +1,153 @@
+'''
+Batch simulator benchmark
+
+Checks Project 4/BatchSimulator.py against the one robot World it copies, measures how
+many robot steps it does per millisecond, and evaluates a random walk in bulk:
+
+    agreement    ROBOTS robots get the same random wheel commands in a BatchWorld and in
+                 a World each, the poses and sensors are compared every few steps
+    throughput   step() and sensors() times for a range of robot counts
+    random walk  the bump and cliff random walk of Project 2 (random_walk()) on every
+                 robot at once, coverage and wheel drops after --seconds
+
+    python batch_simulator.py
+    python batch_simulator.py --robots 10000 --seconds 120
+'''
+import argparse
+import os
+import random
+import sys
+import time
+
+ROBOTICS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROBOTICS, 'Project 4'))
+from Interface import *
+from BatchSimulator import BatchWorld, BATCH_PACKETS
+from Simulator import World, TICK
+
+ROBOTS = 20
+AGREEMENT_STEPS = 3000
+COUNTS = (100, 1000, 10000, 100000)
+TARGET = 10000  # robot steps per millisecond
+
+# Project 2 random walk
+SPEED = 150
+DEFAULT_ANGLE = 180
+RANDOM_ANGLE = 45
+
+
+# Random poses inside the default room, clear of the walls
+def start_poses(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(300, 2700, count), rng.uniform(500, 2700, count),
+                            rng.uniform(-np.pi, np.pi, count)])
+
+
+# Largest pose difference (mm) and number of sensor values that differ
+def agreement(robots=ROBOTS, steps=AGREEMENT_STEPS, seed=1):
+    rng = random.Random(seed)
+    poses = start_poses(robots, seed)
+    worlds = [World(pose=tuple(pose)) for pose in poses]
+    batch = BatchWorld(robots, poses=poses)
+    packets = [packet for packet in BATCH_PACKETS if packet not in (DISTANCE, ANGLE)]
+    worst = 0.0
+    different = 0
+    for step in range(steps):
+        if step % 50 == 0:
+            commands = np.array([(rng.randint(MIN_VEL, MAX_VEL), rng.randint(MIN_VEL, MAX_VEL))
+                                 for _ in range(robots)])
+            for world, (left, right) in zip(worlds, commands):
+                world.set_wheels(left, right)
+            batch.set_wheels(commands[:, 0], commands[:, 1])
+        for world in worlds:
+            world.step(TICK)
+        batch.step(TICK)
+        if step % 10 == 0:
+            values = batch.sensors(*packets)
+            for index, world in enumerate(worlds):
+                worst = max(worst, abs(world.x - batch.x[index]), abs(world.y - batch.y[index]))
+                expected = world.sensors()
+                different += sum(1 for packet in packets if expected[packet] != values[packet][index])
+    return worst, different
+
+
+# Milliseconds per step() and per sensors() for count robots driving around
+def throughput(count, steps=200):
+    rng = np.random.default_rng(0)
+    batch = BatchWorld(count, poses=start_poses(count))
+    batch.set_wheels(rng.uniform(-300, 300, count), rng.uniform(-300, 300, count))
+    for _ in range(10):
+        batch.step(TICK)
+    start = time.perf_counter()
+    for _ in range(steps):
+        batch.step(TICK)
+    step = (time.perf_counter() - start) * 1000 / steps
+    reads = max(1, steps // 10)
+    start = time.perf_counter()
+    for _ in range(reads):
+        batch.sensors()
+    sensors = (time.perf_counter() - start) * 1000 / reads
+    return step, sensors
+
+
+# random_walk() of Project 2 for every robot: straight at SPEED until a bump or a cliff,
+# then turn on the spot (DEFAULT_ANGLE plus or minus RANDOM_ANGLE after a bump, DEFAULT_ANGLE
+# after a cliff) and go on. A wheel drop ends the walk of that robot
+def random_walk(count, seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    batch = BatchWorld(count, poses=start_poses(count, seed), coverage=True)
+    remaining = np.zeros(count)  # degrees still to turn, counter clockwise positive
+    for _ in range(int(seconds / TICK)):
+        values = batch.sensors(BUMPERS_PACKET_ID, ANGLE, *CLIFF_PACKETS)
+        remaining -= values[ANGLE]
+        bumps = values[BUMPERS_PACKET_ID]
+        left_bump = bumps & LEFT_BUMPER != 0
+        right_bump = bumps & RIGHT_BUMPER != 0
+        cliff = np.zeros(count, dtype=bool)
+        for packet in CLIFF_PACKETS:
+            cliff |= values[packet] != 0
+
+        # A new turn for the robots that are not turning and bumped or see a cliff
+        idle = np.abs(remaining) < 1
+        clockwise = rng.integers(0, 3, count) != 0
+        angle = DEFAULT_ANGLE + rng.integers(-RANDOM_ANGLE, RANDOM_ANGLE + 1, count)
+        bump_angle = np.where(left_bump & right_bump, np.where(clockwise, angle, -angle),
+                              np.where(left_bump, angle, -angle))
+        turn = np.where(cliff, np.where(clockwise, DEFAULT_ANGLE, -DEFAULT_ANGLE), bump_angle)
+        start = idle & (cliff | left_bump | right_bump)
+        remaining = np.where(start, turn, np.where(idle, 0, remaining))
+
+        # Turning robots spin towards the angle left, the others drive straight
+        spin = np.sign(remaining) * SPEED
+        turning = remaining != 0
+        batch.drive_direct(np.where(turning, spin, SPEED), np.where(turning, -spin, SPEED))
+        batch.step(TICK)
+    return batch.covered_area(), batch.wheel_drop
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--robots', type=int, default=1000, help='robots in the random walk')
+    parser.add_argument('--seconds', type=float, default=60.0, help='simulated time of the random walk')
+    args = parser.parse_args()
+
+    worst, different = agreement()
+    print("agreement with World: %d robots, %d steps, poses within %.6f mm, %d sensor values differ" % (
+        ROBOTS, AGREEMENT_STEPS, worst, different))
+
+    print("%8s %10s %16s %12s" % ('robots', 'step ms', 'robot steps/ms', 'sensors ms'))
+    for count in COUNTS:
+        step, sensors = throughput(count)
+        print("%8d %10.3f %16.0f %12.3f%s" % (count, step, count / step, sensors,
+                                               '' if count < TARGET or count / step >= TARGET else '  below target'))
+
+    start = time.perf_counter()
+    covered, dropped = random_walk(args.robots, args.seconds)
+    elapsed = time.perf_counter() - start
+    print("random walk: %d robots for %.0f s simulated in %.2f s, covered %.2f m2 on average "
+          "(%.2f to %.2f), %d dropped a wheel" % (args.robots, args.seconds, elapsed, covered.mean(),
+                                                  covered.min(), covered.max(), dropped.sum()))
+
+
+if __name__ == '__main__':
+    main()
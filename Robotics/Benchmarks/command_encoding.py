@@ -0,0 +1,135 @@
+'''
+Commands per second of the old and the new command encoding
+
+Old: the commands as they used to be built, chr() strings sent through Interface.write
+(encoded to latin-1 there), ints2str() growing a string one character at a time, and
+struct.pack() making new bytes for every drive command.
+New: the prebuilt commands and the CommandEncoder buffers in Interface.py.
+
+Only the encoding is timed, nothing is written to a port. pyserial still copies a
+bytearray into bytes when it writes it.
+
+Usage: python command_encoding.py [--number N]
+'''
+import argparse
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Project 4'))
+from Interface import *
+
+NUMBER = 200000
+LONG_SONG = 255  # bytes in the longest song the old ints2str was asked for
+
+
+# ******************************* OLD ENCODING **************************************#
+
+def old_ints2str(lst):
+    s = ""
+    for i in lst:
+        if i < 0 or i > 255:
+            raise Exception
+        s = s + str(chr(i))
+    return s
+
+
+def old_mode():
+    return chr(SAFE).encode('latin-1')
+
+
+def old_sensor():
+    return bytes(bytearray([SENSORS_OP, LIGHT_RIGHT]))
+
+
+def old_query():
+    packet_ids = (INFRARED_RIGHT, INFRARED_LEFT)
+    return bytes(bytearray([QUERY_LIST, len(packet_ids)] + list(packet_ids)))
+
+
+def old_drive_direct():
+    return struct.pack('>B2h', DRIVE_DIRECT, 100, -100)
+
+
+def old_song():
+    return old_ints2str([SONG, SONG_ZERO, SONG_LEN_ONE] + IMPERIAL_MARCH).encode('latin-1')
+
+
+def old_play():
+    return old_ints2str([PLAY_SONG, SONG_ZERO]).encode('latin-1')
+
+
+def old_long_list():
+    return old_ints2str(LONG_LIST).encode('latin-1')
+
+
+# ******************************* NEW ENCODING **************************************#
+
+encoder = CommandEncoder()
+QUERY = (INFRARED_RIGHT, INFRARED_LEFT)
+
+
+def new_mode():
+    return MODE_COMMANDS['safe']
+
+
+def new_sensor():
+    return SENSOR_COMMANDS[LIGHT_RIGHT]
+
+
+def new_query():
+    return query_command(QUERY)
+
+
+def new_drive_direct():
+    return encoder.drive_direct(100, -100)
+
+
+def new_song():
+    return encoder.song(SONG_ZERO, IMPERIAL_MARCH)
+
+
+def new_play():
+    return PLAY_COMMANDS[SONG_ZERO]
+
+
+def new_long_list():
+    return bytes(LONG_LIST)
+
+
+LONG_LIST = [i % 256 for i in range(LONG_SONG)]
+
+COMMANDS = [
+    ('mode (safe)', old_mode, new_mode),
+    ('sensor (142)', old_sensor, new_sensor),
+    ('query list (149)', old_query, new_query),
+    ('drive direct (145)', old_drive_direct, new_drive_direct),
+    ('song upload (140)', old_song, new_song),
+    ('play song (141)', old_play, new_play),
+    ('%d byte list' % LONG_SONG, old_long_list, new_long_list),
+]
+
+
+def rate(function, number):
+    seconds = min(timeit.repeat(function, number=number, repeat=3))
+    return number / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--number', type=int, default=NUMBER, help='commands per measurement')
+    args = parser.parse_args()
+
+    print("%-20s %14s %14s %8s" % ('command', 'old cmd/s', 'new cmd/s', 'speedup'))
+    for name, old, new in COMMANDS:
+        if bytes(old()) != bytes(new()):
+            raise AssertionError(name + ": the old and new encodings differ")
+        number = args.number if 'list' not in name else args.number // 20
+        old_rate = rate(old, number)
+        new_rate = rate(new, number)
+        print("%-20s %14.0f %14.0f %7.1fx" % (name, old_rate, new_rate, new_rate / old_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+'''
+Control loop benchmarks for the Roomba behaviors
+
+Runs each behavior against the Roomba simulator (Project 4/Simulator.py) and measures
+one tick of its control loop:
+
+    wall         Project 3  wall()         one call is a tick
+    random_walk  Project 2  random_walk()  a tick starts at every safety() check
+    hug_wall     Project 4  hug_wall()     one call is a tick
+    dock         Project 4  dock()         a tick starts at every dock_sensors() read
+    polygon      Project 1  polygon()      a tick is one side (drive_straight + turn)
+
+For every behavior it reports the loop frequency, p50/p99 tick latency, serial bytes and
+round trips (requests that wait for an answer) per tick, and the time per tick spent
+sleeping and waiting on the serial port. Results are written as JSON.
+
+    python control_loops.py --output results.json
+    python control_loops.py --baseline results.json --tolerance 0.2
+
+With --baseline the run fails (exit code 1) if any behavior got slower than the
+baseline by more than the tolerance, or does more round trips per tick.
+'''
+import argparse
+import contextlib
+import importlib.util
+import json
+import math
+import os
+import platform
+import random
+import sys
+import threading
+import time
+
+ROBOTICS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROBOTICS, 'Project 4'))
+import Interface
+from Motion import Motion
+from SerialWorker import SerialWorker
+from Simulator import RoombaSimulator, World
+
+TOLERANCE = 0.2
+
+# Keep the real sleep, the benchmark swaps time.sleep for a timed one
+real_sleep = time.sleep
+
+
+class StopBenchmark(Exception):
+    pass
+
+
+# ************************************ RECORDER *******************************************#
+#
+#  mark() is called at the start of every tick. It saves the time, the serial counters and
+#  the time slept so far, and stops the behavior (StopBenchmark) once we have enough ticks.
+#  Only sleeps on the behavior thread are counted, not the simulator's
+#
+# ******************************************************************************************#
+class Recorder:
+    def __init__(self, roomba, ticks):
+        self.roomba = roomba
+        self.ticks = ticks
+        self.thread = threading.current_thread()
+        self.slept = 0.0
+        self.marks = []
+
+    def sleep(self, seconds):
+        if threading.current_thread() is self.thread:
+            self.slept += seconds
+        real_sleep(seconds)
+
+    def mark(self):
+        inter = self.roomba.inter
+        self.marks.append((time.perf_counter(), inter.bytes_written + inter.bytes_read,
+                           inter.reads, inter.io_time, self.slept))
+        if len(self.marks) > self.ticks:
+            raise StopBenchmark()
+
+    # Wrap a function of the behavior's module so every call marks a tick
+    def wrap(self, module, name):
+        function = getattr(module, name)
+
+        def marked(*args):
+            self.mark()
+            return function(*args)
+        setattr(module, name, marked)
+
+    def results(self):
+        ticks = len(self.marks) - 1
+        if ticks < 1:
+            return {'ticks': 0}
+        first, last = self.marks[0], self.marks[-1]
+        latencies = sorted((b[0] - a[0]) * 1000 for a, b in zip(self.marks, self.marks[1:]))
+        elapsed = last[0] - first[0]
+        return {
+            'ticks': ticks,
+            'loop_hz': ticks / elapsed,
+            'p50_ms': percentile(latencies, 50),
+            'p99_ms': percentile(latencies, 99),
+            'bytes_per_tick': float(last[1] - first[1]) / ticks,
+            'round_trips_per_tick': float(last[2] - first[2]) / ticks,
+            'io_ms_per_tick': (last[3] - first[3]) * 1000 / ticks,
+            'sleep_ms_per_tick': (last[4] - first[4]) * 1000 / ticks,
+        }
+
+
+def percentile(samples, p):
+    index = int(math.ceil(p / 100.0 * len(samples))) - 1
+    return samples[max(0, min(len(samples) - 1, index))]
+
+
+# Load a project script as a module (the folders have spaces so they can't be imported)
+def load(project, script):
+    path = os.path.join(ROBOTICS, project, script + '.py')
+    spec = importlib.util.spec_from_file_location(script, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ************************************ BEHAVIORS *******************************************#
+#
+#  Each behavior sets the robot somewhere useful in the world and returns the function to
+#  run and the name of the module function that marks a tick
+#
+# ******************************************************************************************#
+def start_robot(roomba):
+    roomba.control('start')
+    roomba.control('safe')
+    roomba.control('full')
+
+
+# Wall on the right, about 90 mm away from the right light bumper
+def wall(module, world):
+    world.x, world.y, world.theta = 800.0, 260.0, 0.0
+    start_robot(module.roomba)
+
+    def run():
+        while True:
+            module.wall()
+    return run, 'wall'
+
+
+def random_walk(module, world):
+    random.seed(0)
+    world.x, world.y, world.theta = 1500.0, 1500.0, 0.3
+    start_robot(module.roomba)
+    module.isMoving = True
+    return module.random_walk, 'safety'
+
+
+def hug_wall(module, world):
+    world.x, world.y, world.theta = 800.0, 260.0, 0.0
+    start_robot(module.roomba)
+
+    def run():
+        while True:
+            module.hug_wall()
+    return run, 'hug_wall'
+
+
+# Facing the dock from a meter away
+def dock(module, world):
+    world.x, world.y, world.theta = 1450.0, 1800.0, math.pi / 2
+    start_robot(module.roomba)
+    module.charging_state_v = 0
+    return module.dock, 'dock_sensors'
+
+
+# A square, the N the script asks for is typed in for it
+def polygon(module, world):
+    world.x, world.y, world.theta = 1000.0, 1000.0, 0.0
+    module.CLEAN_STATE = True
+    module.input = lambda prompt: '4'
+    return module.polygon, 'drive_straight'
+
+
+BEHAVIORS = [
+    ('wall', 'Project 3', 'proj3v7', wall, 40),
+    ('random_walk', 'Project 2', 'proj2v4', random_walk, 100),
+    ('hug_wall', 'Project 4', 'proj4v6', hug_wall, 40),
+    ('dock', 'Project 4', 'proj4v6', dock, 20),
+    ('polygon', 'Project 1', 'proj1', polygon, 4),
+]
+
+
+# Run one behavior on a fresh simulator and connection
+# What the behavior prints goes to devnull unless verbose is set
+def benchmark(name, project, script, setup, ticks, verbose=False):
+    module = load(project, script)
+    with RoombaSimulator(World()) as sim, open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+        module.roomba = Interface.RoombaClient(sim.port)
+        if hasattr(module, 'bus'):
+            module.bus = SerialWorker(module.roomba)
+        if hasattr(module, 'motion'):
+            module.motion = Motion(module.roomba, module.motion.lock)
+        run, marker = setup(module, sim.world)
+        recorder = Recorder(module.roomba, ticks)
+        recorder.wrap(module, marker)
+        time.sleep = recorder.sleep
+        try:
+            run()
+            recorder.mark()
+        except StopBenchmark:
+            pass
+        finally:
+            time.sleep = real_sleep
+            if hasattr(module, 'bus'):
+                module.bus.close()
+            if hasattr(module, 'motion'):
+                module.motion.cancel()
+            module.roomba.close()
+    results = recorder.results()
+    results['behavior'] = name
+    return results
+
+
+# Names of the measurements that got worse than the baseline
+def regressions(results, baseline, tolerance):
+    worse = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or not result.get('ticks'):
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            if result[key] > base[key] * (1 + tolerance):
+                worse.append('%s %s %.2f > %.2f' % (name, key, result[key], base[key]))
+        if result['loop_hz'] < base['loop_hz'] * (1 - tolerance):
+            worse.append('%s loop_hz %.2f < %.2f' % (name, result['loop_hz'], base['loop_hz']))
+        if result['round_trips_per_tick'] > base['round_trips_per_tick'] + 1e-9:
+            worse.append('%s round_trips_per_tick %.2f > %.2f'
+                         % (name, result['round_trips_per_tick'], base['round_trips_per_tick']))
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('behaviors', nargs='*', help='behaviors to run (default: all)')
+    parser.add_argument('--ticks', type=int, help='ticks per behavior')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--verbose', action='store_true', help="show what the behaviors print")
+    args = parser.parse_args()
+
+    results = {}
+    print("%-12s %6s %9s %9s %9s %11s %9s %9s %9s" % ('behavior', 'ticks', 'loop Hz', 'p50 ms',
+          'p99 ms', 'bytes/tick', 'rt/tick', 'io ms', 'sleep ms'))
+    for name, project, script, setup, ticks in BEHAVIORS:
+        if args.behaviors and name not in args.behaviors:
+            continue
+        result = benchmark(name, project, script, setup, args.ticks or ticks, args.verbose)
+        results[name] = result
+        if result['ticks']:
+            print("%-12s %6d %9.2f %9.2f %9.2f %11.1f %9.2f %9.2f %9.2f" % (
+                name, result['ticks'], result['loop_hz'], result['p50_ms'], result['p99_ms'],
+                result['bytes_per_tick'], result['round_trips_per_tick'],
+                result['io_ms_per_tick'], result['sleep_ms_per_tick']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'time': time.time(),
+                       'results': results}, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        worse = regressions(results, baseline, args.tolerance)
+        for line in worse:
+            print("REGRESSION " + line)
+        if worse:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
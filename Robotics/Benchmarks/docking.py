@@ -0,0 +1,108 @@
+'''
+Docking benchmark: time to dock and steering reversals
+
+Runs the DockingEngine (Project 4/Docking.py) two ways:
+
+    engine   straight on a World stepped 15 ms at a time, one tick per step, from ROBOTS
+             random poses where the robot sees the dock (the dock is at the middle of the
+             north wall of the default 3m x 3m room)
+    dock     proj4v6.dock() on the pty simulator in real time, facing the dock from a
+             meter away, the way control_loops.py starts it
+
+and reports how many docked, the time to dock (mean and worst) and the steering reversals.
+
+    python docking.py
+    python docking.py --robots 200 --seed 3
+'''
+import argparse
+import contextlib
+import math
+import os
+import random
+import sys
+
+ROBOTICS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROBOTICS, 'Project 4'))
+import Interface
+from control_loops import load, start_robot
+from Docking import DockingEngine, DOCKED, DOCK_PACKETS
+from SerialWorker import SerialWorker
+from Simulator import RoombaSimulator, World, TICK, BEAM_RANGE
+
+ROBOTS = 50
+LIMIT = 120  # seconds before a run counts as failed
+START = (1450.0, 1800.0, math.pi / 2)
+
+
+# Random poses from which the omni receiver sees the dock
+def start_poses(count, seed):
+    rng = random.Random(seed)
+    poses = []
+    while len(poses) < count:
+        pose = (rng.uniform(400, 2600), rng.uniform(400, 2600), rng.uniform(-math.pi, math.pi))
+        world = World(cliffs=[], pose=pose)
+        if world.sensors()[Interface.INFRARED_PACK] and math.hypot(
+                pose[0] - world.dock[0], pose[1] - world.dock[1]) < BEAM_RANGE:
+            poses.append(pose)
+    return poses
+
+
+# Dock from pose on a stepped World, the stats of the engine
+def engine(pose, limit=LIMIT):
+    world = World(cliffs=[], pose=pose)
+    docking = DockingEngine()
+    docking.start(world.time)
+    while docking.active() and world.time < limit:
+        values = world.sensors()
+        right, left = docking.update(dict((packet, values[packet]) for packet in DOCK_PACKETS), world.time)
+        world.set_wheels(left, right)
+        world.step(TICK)
+    return docking.stats()
+
+
+# proj4v6.dock() on the pty simulator
+def dock(verbose=False):
+    module = load('Project 4', 'proj4v6')
+    world = World(cliffs=[], pose=START)
+    with RoombaSimulator(world) as sim, open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+        module.roomba = Interface.RoombaClient(sim.port)
+        module.bus = SerialWorker(module.roomba)
+        start_robot(module.roomba)
+        try:
+            stats = module.dock()
+        finally:
+            module.bus.close()
+            module.roomba.close()
+    return stats
+
+
+def summary(name, results):
+    docked = [result for result in results if result['state'] == DOCKED]
+    times = [result['time_to_dock'] for result in docked]
+    reversals = [result['reversals'] for result in docked]
+    if not docked:
+        print("%-8s %4d/%-4d docked" % (name, 0, len(results)))
+        return
+    print("%-8s %4d/%-4d docked  time to dock %.1f s (worst %.1f)  reversals %.1f (worst %d)" % (
+        name, len(docked), len(results), sum(times) / len(times), max(times),
+        float(sum(reversals)) / len(reversals), max(reversals)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--robots', type=int, default=ROBOTS, help='start poses for the engine runs')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the start poses')
+    parser.add_argument('--verbose', action='store_true', help="show what dock() prints")
+    args = parser.parse_args()
+
+    summary('engine', [engine(pose) for pose in start_poses(args.robots, args.seed)])
+    result = dock(args.verbose)
+    summary('dock', [result])
+    if result['time_to_dock']:
+        print("dock() ran %d ticks in %.1f s, %.0f ticks per second" % (
+            result['ticks'], result['time_to_dock'], result['ticks'] / result['time_to_dock']))
+
+
+if __name__ == '__main__':
+    main()
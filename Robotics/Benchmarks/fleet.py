@@ -0,0 +1,62 @@
+'''
+Fleet benchmark: one broken robot must not slow the others down
+
+Runs a Fleet (Project 4/Fleet.py) on ROBOTS simulated robots twice for --seconds each:
+
+    healthy   every simulator runs to the end
+    broken    the first simulator is switched off a third of the way in, its session
+              keeps trying to connect again until the end
+
+and prints the loop rate and errors of every robot. The rates of the other robots should
+be the same in both runs.
+
+    python fleet.py
+    python fleet.py --robots 8 --behavior hug_wall --processes 2
+'''
+import argparse
+import os
+import sys
+import threading
+
+ROBOTICS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROBOTICS, 'Project 4'))
+from Fleet import Fleet, Session, BEHAVIORS, print_results
+from Simulator import RoombaSimulator, World
+
+ROBOTS = 4
+SECONDS = 9.0
+
+
+def run(robots, behavior, seconds, processes, broken):
+    simulators = [RoombaSimulator(World(cliffs=[], pose=(600.0 + 400 * i, 1000.0, 0.0))).start()
+                  for i in range(robots)]
+    sessions = [Session('robot%d' % i, simulator.port, behavior) for i, simulator in enumerate(simulators)]
+    if broken:
+        timer = threading.Timer(seconds / 3.0, simulators[0].stop)
+        timer.start()
+    try:
+        return Fleet(sessions, processes).run(seconds)
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--robots', type=int, default=ROBOTS)
+    parser.add_argument('--behavior', default='random_walk', choices=sorted(BEHAVIORS))
+    parser.add_argument('--seconds', type=float, default=SECONDS)
+    parser.add_argument('--processes', type=int, default=0, help='worker processes (0: one event loop)')
+    args = parser.parse_args()
+
+    for name, broken in (('healthy', False), ('broken', True)):
+        print("%s:" % name)
+        results = run(args.robots, args.behavior, args.seconds, args.processes, broken)
+        print_results(results)
+        others = results[1:]
+        if others:
+            print("other robots: %.1f Hz on average\n" % (sum(stats['rate'] for stats in others) / len(others)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+Frames per second of the stream frame decoders
+
+    per packet  the old decoder, one unpack_from per packet of the frame
+    parse       StreamDecoder.parse with the frame struct from the packet registry
+    columns     StreamDecoder.columns, every frame of the buffer at once with NumPy
+
+The frames come from the simulator (random light and distance values) with a few bytes
+of junk in between, like a stream that lost sync now and then.
+
+    python frame_decoding.py
+    python frame_decoding.py 100000
+'''
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Project 4'))
+from Interface import *
+from Simulator import RoombaSimulator, World
+
+FRAMES = 20000
+PACKETS_USED = STREAM_PACKETS + [DISTANCE, ANGLE]
+
+
+def recording(frames):
+    random.seed(0)
+    sim = RoombaSimulator(World())
+    sim.stream_packets = PACKETS_USED
+    buf = bytearray()
+    for i in range(frames):
+        sim.values = sim.world.sensors()
+        sim.values[LIGHT_RIGHT] = random.randint(0, 4095)
+        sim.world.distance = random.randint(-300, 300)
+        buf += sim.frame()
+        if i % 1000 == 7:
+            buf += bytes(bytearray([STREAM_HEADER, 5, 1, 2]))
+    return bytes(buf)
+
+
+# The decoder as it was before the registry: one unpack per packet
+def per_packet(decoder, buf):
+    def decode(frame):
+        values = {}
+        offset = 2
+        for packet in decoder.packet_ids:
+            if frame[offset] != packet:
+                return None
+            unpacker = PACKET_STRUCTS[packet]
+            values[packet] = unpacker.unpack_from(frame, offset + 1)[0]
+            offset += 1 + unpacker.size
+        return values
+    decoder.decode = decode
+    return decoder.parse(bytearray(buf))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('frames', nargs='?', type=int, default=FRAMES, help='frames to decode')
+    frames = parser.parse_args().frames
+    buf = recording(frames)
+    print("%d frames, %d bytes" % (frames, len(buf)))
+    runs = [
+        ('per packet', lambda: per_packet(StreamDecoder(PACKETS_USED), buf)),
+        ('parse', lambda: StreamDecoder(PACKETS_USED).parse(bytearray(buf))),
+        ('columns', lambda: StreamDecoder(PACKETS_USED).columns(buf)),
+    ]
+    for name, run in runs:
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            result = run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        decoded = len(result) if isinstance(result, list) else len(result[BUMPERS_PACKET_ID])
+        print("%-12s %8d frames %10.1f ms %12.0f frames/s" % (name, decoded, best * 1000, decoded / best))
+
+
+if __name__ == '__main__':
+    main()
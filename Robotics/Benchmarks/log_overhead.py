@@ -0,0 +1,81 @@
+'''
+Cost of the control loop messages (Project 4/Log.py)
+
+One tick of the Project 2 main loop used to print five lines. This times the messages of
+one tick to a console that writes at CONSOLE_BAUD (a Raspberry Pi serial console), three
+ways:
+
+    print     the five print() calls of the old loop
+    log       one log.debug() with the writer thread writing to the same console
+    off       the same log.debug() with the module at INFO
+
+    python log_overhead.py
+'''
+import os
+import sys
+import time
+
+ROBOTICS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROBOTICS, 'Project 4'))
+import Log
+
+CONSOLE_BAUD = 115200
+TICKS = 200
+OFF_TICKS = 200000
+
+
+# A console that takes as long as the serial line to write, 10 bits a character
+class SlowConsole:
+    def __init__(self, baud=CONSOLE_BAUD):
+        self.byte_time = 10.0 / baud
+
+    def write(self, text):
+        time.sleep(len(text) * self.byte_time)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def prints(console, ticks=TICKS):
+    clean, wheel_drop, cliff, left_bump, right_bump = False, False, False, True, False
+    saved, sys.stdout = sys.stdout, console
+    try:
+        start = time.perf_counter()
+        for _ in range(ticks):
+            print("CLEAN: " + str(clean))
+            print("WHEEL DROP: " + str(wheel_drop))
+            print("CLIFF: " + str(cliff))
+            print("LEFT BUMP: " + str(left_bump))
+            print("RIGHT BUMP: " + str(right_bump))
+        return (time.perf_counter() - start) / ticks * 1e6
+    finally:
+        sys.stdout = saved
+
+
+def logs(log, ticks):
+    clean, wheel_drop, cliff, left_bump, right_bump = False, False, False, True, False
+    start = time.perf_counter()
+    for _ in range(ticks):
+        log.debug("CLEAN: %s WHEEL DROP: %s CLIFF: %s LEFT BUMP: %s RIGHT BUMP: %s",
+                  clean, wheel_drop, cliff, left_bump, right_bump)
+    return (time.perf_counter() - start) / ticks * 1e6
+
+
+def main():
+    console = SlowConsole()
+    print("print: %.1f us per tick" % prints(console))
+
+    writer = Log.Writer()
+    writer.output = lambda: console
+    log = Log.Logger('proj2v4', Log.DEBUG, writer)
+    on = logs(log, TICKS)
+    writer.close()
+    print("log:   %.1f us per tick (%d lines written by the writer thread)" % (on, writer.written))
+
+    log.level = Log.INFO
+    print("off:   %.3f us per tick" % logs(log, OFF_TICKS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+'''
+Cost of the serial and lock metrics (Project 4/Metrics.py)
+
+    lock      acquire and release of a threading.Lock and of a MeteredLock, with a with
+              block and with acquire()/release(), in ns
+    record    what Interface adds to one request when metrics are on: wrote() and
+              answered(), in ns
+    requests  Query List round trips to the simulator with metrics on and off, in us
+
+    python metrics_overhead.py
+'''
+import os
+import sys
+import threading
+import time
+
+ROBOTICS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROBOTICS, 'Project 4'))
+from Interface import *
+from Metrics import MeteredLock, Registry
+from Simulator import RoombaSimulator
+
+LOOPS = 200000
+REQUESTS = 1000
+
+
+def with_block(lock, loops):
+    start = time.perf_counter()
+    for _ in range(loops):
+        with lock:
+            pass
+    return (time.perf_counter() - start) / loops * 1e9
+
+
+def acquire_release(lock, loops):
+    start = time.perf_counter()
+    for _ in range(loops):
+        lock.acquire()
+        lock.release()
+    return (time.perf_counter() - start) / loops * 1e9
+
+
+def record(loops):
+    registry = Registry()
+    command = query_command((BUMPERS_PACKET_ID, CLIFF_LEFT, CLIFF_RIGHT))
+    start = time.perf_counter()
+    for _ in range(loops):
+        registry.wrote(command, 0.0001)
+        registry.answered(command, 0.002, 3, False)
+    return (time.perf_counter() - start) / loops * 1e9
+
+
+# Mean round trip in us of a Query List request, with the connection reporting to registry
+def requests(port, registry, count=REQUESTS):
+    roomba = RoombaClient(port)
+    roomba.metrics = registry
+    roomba.control('start')
+    packets = (BUMPERS_PACKET_ID, CLIFF_LEFT, CLIFF_RIGHT)
+    for _ in range(50):
+        roomba.query(*packets)
+    start = time.perf_counter()
+    for _ in range(count):
+        roomba.query(*packets)
+    elapsed = time.perf_counter() - start
+    roomba.close()
+    return elapsed / count * 1e6
+
+
+def main():
+    plain = threading.Lock()
+    metered = MeteredLock(Registry())
+    print("lock       with: Lock %.0f ns, MeteredLock %.0f ns" % (with_block(plain, LOOPS), with_block(metered, LOOPS)))
+    print("lock    acquire: Lock %.0f ns, MeteredLock %.0f ns" % (
+        acquire_release(plain, LOOPS), acquire_release(metered, LOOPS)))
+    print("record  request: %.0f ns" % record(LOOPS))
+    with RoombaSimulator() as sim:
+        # Alternate so drift in the simulator hits both the same
+        off = on = 0.0
+        for _ in range(3):
+            off += requests(sim.port, None) / 3
+            on += requests(sim.port, Registry()) / 3
+    print("requests round trip: metrics off %.1f us, on %.1f us" % (off, on))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+'''
+Per tick latency of the Roomba helpers, before and after the shared connection
+
+Before every call opens a new connection, after they all use one RoombaClient.
+
+A tick is what one pass of hug_wall() in Project 4 does on the wire:
+read both bumpers, read the right light bumper and send a drive direct command.
+
+The Roomba is faked with a pseudo-terminal that answers every sensor request straight
+away, so the numbers only show the cost of the connection handling, not the Roomba.
+The 15 ms settle sleeps are the same before and after and are turned off unless
+--sleep is given.
+
+    python session_latency.py
+    python session_latency.py 1000 --sleep
+'''
+import argparse
+import os
+import sys
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Project 4'))
+import Interface
+from Interface import Interface2, RoombaClient, LIGHT_RIGHT, PACKET_STRUCTS
+
+TICKS = 200
+
+# Length of every command the helpers send, not counting the opcode
+COMMAND_ARGS = {128: 0, 131: 0, 132: 0, 173: 0, 7: 0, 137: 4, 145: 4, 141: 1, 142: 1, 150: 1}
+
+
+# Answers sensor requests with zeros and swallows every other command
+def fake_roomba(master):
+    buf = bytearray()
+    while True:
+        try:
+            buf += os.read(master, 256)
+        except OSError:
+            return
+        while buf:
+            opcode = buf[0]
+            if opcode in (148, 149):
+                if len(buf) < 2 or len(buf) < 2 + buf[1]:
+                    break
+                size = 2 + buf[1]
+            elif opcode == 140:
+                if len(buf) < 3 or len(buf) < 3 + 2 * buf[2]:
+                    break
+                size = 3 + 2 * buf[2]
+            else:
+                size = 1 + COMMAND_ARGS.get(opcode, 0)
+                if len(buf) < size:
+                    break
+            if opcode == 142:
+                os.write(master, bytes(PACKET_STRUCTS[buf[1]].size))
+            elif opcode == 149:
+                os.write(master, bytes(sum(PACKET_STRUCTS[p].size for p in buf[2:size])))
+            del buf[:size]
+
+
+# One tick the old way, every call opens the port again
+def tick_before():
+    Interface2().bump_wheels('left')
+    Interface2().bump_wheels('right')
+    Interface2().light_bump(LIGHT_RIGHT)
+    Interface2().drive_direct(40, 40)
+
+
+# One tick on the shared connection
+def tick_after(roomba):
+    roomba.bump_wheels('left')
+    roomba.bump_wheels('right')
+    roomba.light_bump(LIGHT_RIGHT)
+    roomba.drive_direct(40, 40)
+
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p / 100.0 * len(samples)))]
+
+
+# Count how many times a serial port gets opened
+opens = [0]
+open_port = Interface.Interface.open
+
+
+def counting_open(self):
+    opens[0] += 1
+    open_port(self)
+
+
+# Run the ticks, then finish() to close whatever should be closed before counting leaks
+def measure(name, tick, ticks, finish=None):
+    fds = open_fds()
+    opens[0] = 0
+    samples = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        tick()
+        samples.append((time.perf_counter() - start) * 1000)
+    if finish is not None:
+        finish()
+    print("%-8s p50 %7.3f ms   p99 %7.3f ms   ports opened %4d   descriptors leaked %d"
+          % (name, percentile(samples, 50), percentile(samples, 99), opens[0], open_fds() - fds))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('ticks', nargs='?', type=int, default=TICKS, help='ticks to time each way')
+    parser.add_argument('--sleep', action='store_true', help='keep the 15 ms settle sleeps')
+    args = parser.parse_args()
+    if not args.sleep:
+        Interface.SLEEP = 0
+    Interface.Interface.open = counting_open
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    Interface.PORT = os.ttyname(slave)
+    responder = threading.Thread(target=fake_roomba, args=(master,))
+    responder.daemon = True
+    responder.start()
+
+    measure('before', tick_before, args.ticks)
+    roomba = RoombaClient()
+    measure('after', lambda: tick_after(roomba), args.ticks, roomba.close)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+Cost of the trace hooks (Project 4/Trace.py)
+
+    hooks     tick() and a with span() block with tracing off and on, in ns
+    requests  Query List round trips to the simulator with the connection tracing and
+              not, in us
+
+    python trace_overhead.py
+
+For a trace of every behavior of control_loops.py:
+
+    ROOMBA_TRACE=trace.json python control_loops.py
+'''
+import os
+import sys
+import time
+
+ROBOTICS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROBOTICS, 'Project 4'))
+from Interface import *
+import Trace
+from Simulator import RoombaSimulator
+
+LOOPS = 200000
+REQUESTS = 1000
+
+
+def ticks(loops):
+    start = time.perf_counter()
+    for _ in range(loops):
+        Trace.tick('loop')
+    return (time.perf_counter() - start) / loops * 1e9
+
+
+def spans(loops):
+    start = time.perf_counter()
+    for _ in range(loops):
+        with Trace.span('sleep', 'sleep'):
+            pass
+    return (time.perf_counter() - start) / loops * 1e9
+
+
+# Both hooks with Trace.TRACER set to tracer (None is off)
+def hooks(tracer, loops=LOOPS):
+    saved, Trace.TRACER = Trace.TRACER, tracer
+    try:
+        return ticks(loops), spans(loops)
+    finally:
+        Trace.TRACER = saved
+
+
+# Mean round trip in us of a Query List request, with the connection tracing to tracer
+def requests(port, tracer, count=REQUESTS):
+    roomba = RoombaClient(port)
+    roomba.metrics = None
+    roomba.tracer = tracer
+    roomba.control('start')
+    packets = (BUMPERS_PACKET_ID, CLIFF_LEFT, CLIFF_RIGHT)
+    for _ in range(50):
+        roomba.query(*packets)
+    start = time.perf_counter()
+    for _ in range(count):
+        roomba.query(*packets)
+    elapsed = time.perf_counter() - start
+    roomba.close()
+    return elapsed / count * 1e6
+
+
+def main():
+    off = hooks(None)
+    on = hooks(Trace.Tracer())
+    print("tick():      off %.0f ns, on %.0f ns" % (off[0], on[0]))
+    print("with span(): off %.0f ns, on %.0f ns" % (off[1], on[1]))
+    with RoombaSimulator() as sim:
+        # Alternate so drift in the simulator hits both the same
+        off = on = 0.0
+        for _ in range(3):
+            off += requests(sim.port, None) / 3
+            on += requests(sim.port, Trace.Tracer()) / 3
+    print("requests round trip: tracing off %.1f us, on %.1f us" % (off, on))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+'''
+Wall following benchmark: area covered per minute
+
+Runs the wall followers against the Roomba simulator (Project 4/Simulator.py) for a fixed
+time each, starting beside the south wall of a 3m x 3m room with no drop off:
+
+    pd           Project 3  wall()      PD on the right light bumper at 40 mm/s
+    pid SPEED    Project 4  hug_wall()  WallFollower at SPEED mm/s
+
+Every SAMPLE seconds it looks at the simulated world and reports the floor area covered
+per minute, how far the gap to the nearest wall was from the set point (mean and worst),
+the bumps and, for the WallFollower, the ticks it had lost the wall.
+
+    python wall_following.py --seconds 30
+    python wall_following.py pd "pid 200"
+'''
+import argparse
+import contextlib
+import math
+import os
+import sys
+import threading
+import time
+
+ROBOTICS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROBOTICS, 'Project 4'))
+import Interface
+from control_loops import load, start_robot
+from Motion import Motion
+from SerialWorker import SerialWorker
+from Simulator import RoombaSimulator, World, closest_point
+
+SAMPLE = 0.05
+SECONDS = 30
+SPEEDS = (100, 200, 300)
+START = (800.0, 260.0, 0.0)
+
+
+# Gap (mm) between the side of the robot and the nearest wall
+def wall_gap(world):
+    gaps = []
+    for a, b in world.walls:
+        px, py = closest_point((world.x, world.y), a, b)
+        gaps.append(math.hypot(px - world.x, py - world.y))
+    return min(gaps) - Interface.ROBOT_RADIUS
+
+
+# Samples the world on its own thread while the behavior runs
+class Monitor:
+    def __init__(self, world):
+        self.world = world
+        self.gaps = []
+        self.bumps = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def run(self):
+        bumped = False
+        while self.running:
+            self.gaps.append(wall_gap(self.world))
+            bump = self.world.bump_left or self.world.bump_right
+            if bump and not bumped:
+                self.bumps += 1
+            bumped = bump
+            time.sleep(SAMPLE)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+# Run a wall follower for seconds on a fresh simulator
+def benchmark(name, project, script, behavior, settings, seconds, verbose=False):
+    module = load(project, script)
+    for key, value in settings.items():
+        setattr(module, key, value)
+    # Gap the follower should keep, in mm. The old controller keeps a light reading instead
+    if hasattr(module, 'follower'):
+        set_point = module.set_point
+    else:
+        set_point = light_gap(module.set_point)
+    world = World(cliffs=[], pose=START)
+    with RoombaSimulator(world) as sim, open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+        module.roomba = Interface.RoombaClient(sim.port)
+        if hasattr(module, 'bus'):
+            module.bus = SerialWorker(module.roomba)
+        if hasattr(module, 'motion'):
+            module.motion = Motion(module.roomba, module.motion.lock)
+        start_robot(module.roomba)
+        monitor = Monitor(world)
+        monitor.thread.start()
+        function = getattr(module, behavior)
+        end = time.time() + seconds
+        try:
+            while time.time() < end:
+                function()
+        finally:
+            monitor.stop()
+            module.roomba.drive_direct(0, 0)
+            if hasattr(module, 'bus'):
+                module.bus.close()
+            if hasattr(module, 'motion'):
+                module.motion.cancel()
+            module.roomba.close()
+    errors = [abs(gap - set_point) for gap in monitor.gaps]
+    follower = getattr(module, 'follower', None)
+    return {
+        'behavior': name,
+        'area_per_minute': world.covered_area() * 60.0 / seconds,
+        'gap_error_mean': sum(errors) / len(errors) if errors else 0.0,
+        'gap_error_max': max(errors) if errors else 0.0,
+        'bumps': monitor.bumps,
+        'lost': follower.lost if follower is not None else None,
+    }
+
+
+# Gap (mm) at which a light bumper reads signal
+def light_gap(signal):
+    return Interface.LIGHT_FALLOFF * math.log(float(Interface.LIGHT_MAX) / signal)
+
+
+def behaviors(speeds):
+    found = [('pd', 'Project 3', 'proj3v7', 'wall', {})]
+    for speed in speeds:
+        found.append(('pid %d' % speed, 'Project 4', 'proj4v6', 'hug_wall', {'speed': speed}))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('behaviors', nargs='*', help='behaviors to run (default: all)')
+    parser.add_argument('--seconds', type=float, default=SECONDS, help='run time per behavior')
+    parser.add_argument('--speeds', type=int, nargs='+', default=SPEEDS, help='WallFollower speeds')
+    parser.add_argument('--verbose', action='store_true', help="show what the behaviors print")
+    args = parser.parse_args()
+
+    print("%-10s %10s %12s %12s %7s %6s" % ('behavior', 'm2/min', 'gap err mm', 'worst mm', 'bumps', 'lost'))
+    for name, project, script, behavior, settings in behaviors(args.speeds):
+        if args.behaviors and name not in args.behaviors:
+            continue
+        result = benchmark(name, project, script, behavior, settings, args.seconds, args.verbose)
+        print("%-10s %10.2f %12.1f %12.1f %7d %6s" % (
+            name, result['area_per_minute'], result['gap_error_mean'], result['gap_error_max'],
+            result['bumps'], '-' if result['lost'] is None else result['lost']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,427 @@
+'''
+asyncio version of Interface2
+
+The same methods as Interface2 (control, drive_direct, sensor reads, query, songs) as
+coroutines on a non-blocking serial port, so behaviors can run as coroutines that
+await sensor frames instead of sleeping, next to each other on one event loop:
+
+    async def main():
+        async with AsyncInterface2() as roomba:
+            await roomba.control('start')
+            await roomba.control('safe')
+            roomba.start_stream()
+            await asyncio.gather(wall(roomba), telemetry(roomba))
+
+    asyncio.run(main())
+
+Works with anything pyserial can open that has a file descriptor (Linux/Mac), including
+the simulator pseudo-terminal.
+'''
+import asyncio
+import serial
+import time
+
+from Interface import *
+from Docking import DockingEngine, DOCKED
+from Motion import Maneuver, TURN, FAST_SPEED
+from RandomWalk import decide, STOP, CLIFF, STRAIGHT
+from WallFollower import WallFollower, LightPD, light_speeds
+
+# How long to wait for an answer from the Roomba before giving up
+READ_TIMEOUT = 1.0
+
+
+class AsyncInterface2:
+    def __init__(self, port=None):
+        self.port = port
+        self.ser = None
+        self.loop = None
+        self.buffer = bytearray()
+        self.arrived = None
+        self.lock = None
+        self.stream = None
+        self.latest = None
+        self.frame_count = 0
+        self.next_frame = None
+        self.error = None
+        self.modes = ModeTracker()
+        self.encoder = CommandEncoder()
+        self.odometry = Odometry()
+        self.songs = SongSlots(port)
+        self.recorder = None
+
+    # Open the port and start listening for bytes on the event loop
+    async def open(self):
+        self.loop = asyncio.get_running_loop()
+        self.ser = serial.Serial()
+        self.ser.baudrate = BAUDRATE
+        self.ser.port = self.port or PORT
+        self.ser.timeout = 0  # reads never block, they return what is there
+        # Writes never block either: a port that stops taking bytes raises an error
+        # instead of holding up every other coroutine on the loop
+        self.ser.write_timeout = 0
+        self.ser.open()
+        self.error = None
+        self.arrived = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.next_frame = self.loop.create_future()
+        self.loop.add_reader(self.ser.fileno(), self.on_readable)
+        return self
+
+    async def close(self):
+        if self.ser is None:
+            return
+        try:
+            if self.stream is not None and self.error is None:
+                self.stop_stream()
+        finally:
+            self.stream = None
+            self.loop.remove_reader(self.ser.fileno())
+            self.ser.close()
+            self.ser = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        return False
+
+    # ******************************* SERIAL ***************************************#
+
+    # Called by the event loop when the port has bytes for us
+    def on_readable(self):
+        try:
+            data = self.ser.read(max(1, self.ser.in_waiting))
+        except (OSError, serial.SerialException) as error:
+            self.fail(error)
+            return
+        if not data:
+            return
+        if self.recorder is not None:
+            self.recorder.read(data)
+        self.buffer += data
+        if self.stream is None:
+            self.arrived.set()
+            return
+        frames = self.stream.parse(self.buffer)
+        if frames:
+            self.frame_count += len(frames)
+            self.latest = Snapshot(frames[-1], time.monotonic())
+            self.modes.observe(self.latest.values, self.latest.timestamp)
+            for values in frames:
+                self.odometry.observe(values, self.latest.timestamp)
+            if self.recorder is not None:
+                for values in frames:
+                    self.recorder.frame(values)
+            waiter, self.next_frame = self.next_frame, self.loop.create_future()
+            waiter.set_result(self.latest)
+
+    # The port broke: stop listening and hand the error to whoever waits for bytes or frames
+    def fail(self, error):
+        self.error = error
+        self.loop.remove_reader(self.ser.fileno())
+        self.arrived.set()
+        if not self.next_frame.done():
+            self.next_frame.set_exception(error)
+            self.next_frame.exception()  # retrieved here, frame() raises it again
+
+    def write(self, instr):
+        self.ser.write(instr)
+        if self.recorder is not None:
+            self.recorder.command(instr)
+
+    # Record every command, read and stream frame from now on (see Telemetry.py)
+    def record(self, recorder):
+        self.recorder = recorder
+        return recorder
+
+    async def read(self, num, timeout=READ_TIMEOUT):
+        while len(self.buffer) < num:
+            if self.error is not None:
+                raise self.error
+            self.arrived.clear()
+            await asyncio.wait_for(self.arrived.wait(), timeout)
+        x = bytes(self.buffer[:num])
+        del self.buffer[:num]
+        return x
+
+    # Send a request and wait for its answer. The lock keeps answers in order
+    async def request(self, instr, num):
+        async with self.lock:
+            self.write(instr)
+            return await self.read(num)
+
+    # ******************************* STREAM ***************************************#
+
+    # Start streaming. Sensor reads come from the latest frame from now on
+    def start_stream(self, packet_ids=STREAM_PACKETS):
+        self.stream = StreamDecoder(packet_ids)
+        del self.buffer[:]
+        self.write(self.stream.command())
+
+    def stop_stream(self):
+        self.write(PAUSE_STREAM)
+        self.stream = None
+        self.latest = None
+        del self.buffer[:]
+
+    # Wait for the next stream frame and return it as a Snapshot
+    async def frame(self, timeout=READ_TIMEOUT):
+        if self.error is not None:
+            raise self.error
+        return await asyncio.wait_for(asyncio.shield(self.next_frame), timeout)
+
+    # ******************************* STATE ****************************************#
+
+    async def control(self, state):
+        state = state.lower()
+        command = MODE_COMMANDS.get(state)
+        if command is not None:
+            self.write(command)
+            self.modes.set(state)
+            if state in ('reset', 'stop'):
+                self.songs.forget()
+        await asyncio.sleep(SLEEP)
+
+    # Send the mode opcodes only if the robot is not in at least the required mode
+    async def require_mode(self, required, replaces=1):
+        for state in self.modes.needed(required, replaces):
+            await self.control(state)
+
+    # ******************************* SENSORS **************************************#
+
+    # While streaming every byte goes to the frame parser, so a packet that is not in the
+    # stream cannot be requested (ValueError), as with Interface2
+    async def sensor(self, packet):
+        if self.stream is not None:
+            if packet not in self.stream.packet_ids:
+                raise ValueError("Packet " + str(packet) + " is not in the stream")
+            if self.latest is None:
+                await self.frame()
+            return self.latest[packet]
+        unpacker = PACKET_STRUCTS[packet]
+        data = await self.request(SENSOR_COMMANDS[packet], unpacker.size)
+        x = unpacker.unpack(data)[0]
+        self.modes.observe({packet: x}, time.monotonic())
+        return x
+
+    async def query(self, *packet_ids):
+        if self.stream is not None:
+            for packet in packet_ids:
+                if packet not in self.stream.packet_ids:
+                    raise ValueError("Packet " + str(packet) + " is not in the stream")
+            if self.latest is None:
+                await self.frame()
+            latest = self.latest
+            return Snapshot(dict((packet, latest[packet]) for packet in packet_ids), latest.timestamp)
+        unpacker = query_struct(packet_ids)
+        data = await self.request(query_command(packet_ids), unpacker.size)
+        snapshot = Snapshot(dict(zip(packet_ids, unpacker.unpack(data))), time.monotonic())
+        self.modes.observe(snapshot.values, snapshot.timestamp)
+        self.odometry.observe(snapshot.values, snapshot.timestamp)
+        return snapshot
+
+    # (x, y, theta) from odometry, see Interface2.pose
+    async def pose(self):
+        if self.stream is None or LEFT_ENCODER not in self.stream.packet_ids:
+            await self.query(*ODOMETRY_PACKETS)
+        return self.odometry.pose
+
+    async def button(self, buttons):
+        return bool(await self.sensor(BUTTONS_PACKET_ID) & BUTTON_BITS[buttons.lower()])
+
+    async def bump_wheels(self, bumper):
+        return bool(await self.sensor(BUMPERS_PACKET_ID) & BUMPER_BITS[bumper.lower()])
+
+    async def cliff(self, cliff_packet):
+        return await self.sensor(cliff_packet)
+
+    async def light_bump(self, light_packet):
+        return await self.sensor(light_packet)
+
+    async def distance(self):
+        return await self.sensor(DISTANCE)
+
+    async def angle(self):
+        return await self.sensor(ANGLE)
+
+    async def charging_state(self):
+        return await self.sensor(CHARGING_STATE)
+
+    async def charge_source_available(self):
+        return await self.sensor(CHARGING_SOURCE_AVAILABLE)
+
+    async def ir_omni(self):
+        return await self.sensor(INFRARED_PACK)
+
+    async def ir_left(self):
+        return await self.sensor(INFRARED_LEFT)
+
+    async def ir_right(self):
+        return await self.sensor(INFRARED_RIGHT)
+
+    # ******************************* DRIVING **************************************#
+
+    async def drive(self, velocity, radius):
+        await self.require_mode(MODE_SAFE, 2)
+        self.write(self.encoder.drive(velocity, radius))
+
+    async def drive_direct(self, lvelocity, rvelocity):
+        await self.require_mode(MODE_SAFE)
+        self.write(self.encoder.drive_direct(lvelocity, rvelocity))
+
+    # ******************************* SONGS ****************************************#
+
+    # Songs go through the same slot cache as Interface2 (see SongSlots)
+    async def song(self, song=IMPERIAL_MARCH):
+        slots, uploads = self.songs.load(song)
+        for slot, part in uploads:
+            self.write(self.encoder.song(slot, part))
+        return slots
+
+    async def play_song(self, song=IMPERIAL_MARCH):
+        slots = await self.song(song)
+        self.write(self.songs.play(slots, time.time()))
+
+    async def continue_song(self):
+        now = time.time()
+        if self.songs.due(now):
+            if self.stream is None or SONG_PLAYING in self.stream.packet_ids:
+                playing = await self.sensor(SONG_PLAYING)
+            else:
+                playing = 0
+            command = self.songs.next(playing, now)
+            if command is not None:
+                self.write(command)
+        return self.songs.busy()
+
+
+# ************************************ COROUTINE BEHAVIORS **********************************#
+#
+#  The Project 2, 3 and 4 behaviors written as coroutines. They need a running stream and
+#  wait for the next sensor frame (every 15 ms) instead of sleeping, so any number of them
+#  share the event loop without locks. They run until the running() check returns False.
+#  What to do on each frame comes from the same code the project scripts run, the
+#  coroutines only read the frames and send the commands:
+#
+#  random_walk: drive straight, turn away from bumps and cliffs, stop on a wheel drop
+#               (RandomWalk.decide, as random_walk() in Project 2)
+#  wall: PD wall following on the right light bumper (LightPD, as wall() in Project 3)
+#  hug_wall: wall following on all six light bumpers with a WallFollower (Project 4)
+#  dock: dock on the infrared beams with a DockingEngine (Project 4)
+#  turn: a Motion turn on the odometry, the turns of random_walk and wall
+#  telemetry: print a line of sensor data every interval seconds
+#
+#  WALK_SPEED: random_walk speed, straight and turning (mm/s), as in Project 2
+#
+# ********************************************************************************************#
+WALK_SPEED = 150
+
+
+def forever():
+    return True
+
+
+# Turn angle degrees on the odometry, counter clockwise is positive. The maneuver is the
+# one Motion runs on its thread: it stops there, or on a new bump, wheel drop or cliff
+# Returns the maneuver, reason says why it stopped early
+async def turn(roomba, angle, speed=FAST_SPEED):
+    maneuver = Maneuver(TURN, angle, speed)
+    snapshot = await roomba.frame()
+    maneuver.begin(roomba.odometry.pose, snapshot.values, snapshot.timestamp)
+    wheels = None
+    while True:
+        speeds = maneuver.step(roomba.odometry.pose, snapshot.values, snapshot.timestamp)
+        if speeds is None:
+            break
+        if speeds != wheels:
+            await roomba.drive_direct(*speeds)
+            wheels = speeds
+        snapshot = await roomba.frame()
+    await roomba.drive_direct(0, 0)
+    return maneuver
+
+
+async def random_walk(roomba, running=forever, speed=WALK_SPEED):
+    wheels = None
+    while running():
+        snapshot = await roomba.frame()
+        action, angle = decide(snapshot)
+        if action == STOP:
+            await roomba.control('full')
+            await roomba.play_song()
+            await roomba.drive_direct(0, 0)
+            break
+        if action == CLIFF:
+            await roomba.control('full')
+            await roomba.play_song()
+            await roomba.drive_direct(0, 0)
+        if action != STRAIGHT:
+            await turn(roomba, angle, speed)
+            wheels = None
+        elif wheels != (speed, speed):
+            await roomba.drive_direct(speed, speed)
+            wheels = (speed, speed)
+
+
+async def wall(roomba, running=forever, controller=None):
+    controller = controller or LightPD()
+    last = None
+    while running():
+        snapshot = await roomba.frame()
+        # A bump turns the robot away from it, the right bumper clockwise as in wall()
+        if snapshot.bumper('right') or snapshot.bumper('left'):
+            await turn(roomba, -DEFAULT_ANGLE if snapshot.bumper('right') else DEFAULT_ANGLE)
+            last = None
+            continue
+
+        dt = snapshot.timestamp - last if last is not None else SLEEP
+        last = snapshot.timestamp
+        u = int(controller.update(snapshot[LIGHT_RIGHT], dt))
+        right, left = light_speeds(u)
+        await roomba.drive_direct(right, left)
+
+
+async def hug_wall(roomba, running=forever, follower=None):
+    follower = follower or WallFollower()
+    last = None
+    while running():
+        snapshot = await roomba.frame()
+        dt = snapshot.timestamp - last if last is not None else SLEEP
+        last = snapshot.timestamp
+        right, left = follower.update(snapshot.values, dt)
+        await roomba.drive_direct(right, left)
+
+
+# Returns True when it docked
+async def dock(roomba, running=forever, docking=None):
+    docking = docking or DockingEngine()
+    docking.start(time.monotonic())
+    while running() and docking.active():
+        snapshot = await roomba.frame()
+        right, left = docking.update(snapshot.values, snapshot.timestamp)
+        await roomba.drive_direct(right, left)
+    await roomba.drive_direct(0, 0)
+    return docking.state == DOCKED
+
+
+async def telemetry(roomba, running=forever, interval=SLEEP_EXTENDED):
+    while running():
+        snapshot = await roomba.frame()
+        print("frames %d  bumps %d  light right %d  omni %d  charging %d" % (
+            roomba.frame_count, snapshot[BUMPERS_PACKET_ID], snapshot[LIGHT_RIGHT],
+            snapshot[INFRARED_PACK], snapshot[CHARGING_STATE]))
+        await asyncio.sleep(interval)
+
+
+async def main():
+    async with AsyncInterface2() as roomba:
+        await roomba.control('start')
+        await roomba.control('safe')
+        roomba.start_stream()
+        await asyncio.gather(wall(roomba), telemetry(roomba))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,287 @@
+'''
+Many simulated Roombas at once
+
+Simulator.World moves one robot with Python floats, which is fine for one robot behind a
+serial port but far too slow to try a behavior on thousands of episodes. BatchWorld has
+the same room, body and sensor models (bumpers, wheel drops on cliffs, cliff sensors,
+light bumpers, encoders, distance and angle) for N robots in the same room, as NumPy
+arrays. Each step moves every robot with one set of array operations.
+
+It takes commands and answers requests like Interface2, with an array per value:
+
+    batch = BatchWorld(1000, poses=start_poses)
+    batch.drive_direct(right, left)         # arrays of N wheel speeds, right first
+    for _ in range(steps):
+        batch.step(TICK)
+    values = batch.query(BUMPERS_PACKET_ID, LIGHT_RIGHT).values
+    bumped = values[BUMPERS_PACKET_ID] & (LEFT_BUMPER | RIGHT_BUMPER) != 0
+
+Robots do not see or bump into each other. Each robot only moves with its own wheels.
+The dock, infrared receivers and buttons are not simulated.
+Move robots with place(), so the clearance to the walls kept from the last step stays right.
+'''
+import math
+
+from Interface import *
+from Simulator import World, BUMP_TRAVEL, CLIFF_SENSORS, LIGHT_RANGE, WALL_RANGE, COVER_CELL, COVER_DISK
+
+# Packets BatchWorld can answer
+LIGHT_BEARINGS = np.radians([LIGHT_SENSORS[packet] for packet in LIGHT_PACKETS])
+CLIFF_POINTS = [(packet, math.radians(CLIFF_SENSORS[packet][0]), CLIFF_SENSORS[packet][1])
+                for packet in CLIFF_PACKETS]
+BATCH_PACKETS = ((BUMPERS_PACKET_ID, WALL, DISTANCE, ANGLE, LEFT_ENCODER, RIGHT_ENCODER)
+                 + tuple(CLIFF_PACKETS) + LIGHT_PACKETS)
+WALL_SIGNAL = LIGHT_MAX * math.exp(-WALL_RANGE / LIGHT_FALLOFF)
+
+# Robots with less clearance (a lower bound of the distance to the nearest wall, mm) are
+# checked against the walls every step. The margin above the bumper reach saves checking
+# a robot again right after it was found clear
+NEAR = ROBOT_RADIUS + BUMP_TRAVEL + 50
+# A wall within 15 degrees of straight ahead presses both bumpers (World.update_bumpers)
+BUMP_SLOPE = math.tan(math.radians(15))
+
+
+# ********************************** BATCH WORLD *************************************#
+#
+#  Same geometry and rules as World: a robot stops where it would get closer than its
+#  radius to a wall, a wall within BUMP_TRAVEL of the front half presses the bumpers,
+#  and a robot over a cliff drops its wheels and stays there.
+#
+#  walls and cliffs are the same lists World takes (the World defaults when None), poses
+#  is an N x 3 array of x, y, theta (every robot at the World start when None).
+#  coverage=True keeps a grid of the floor each robot has been over (covered_area()),
+#  which costs about as much as the rest of a step.
+#
+# ***********************************************************************************#
+class BatchWorld:
+    def __init__(self, count, walls=None, cliffs=None, poses=None, coverage=False):
+        template = World(walls, cliffs)
+        self.count = count
+        self.walls = template.walls
+        self.cliffs = template.cliffs
+        # Arrays of walls x robots keep the robots on the last axis, NumPy is slow on short rows
+        segments = np.array(self.walls, dtype=float).reshape(-1, 4)
+        self.ax, self.ay = segments[:, 0:1], segments[:, 1:2]
+        self.dx, self.dy = segments[:, 2:3] - self.ax, segments[:, 3:4] - self.ay
+        length = self.dx ** 2 + self.dy ** 2
+        self.inverse_length = np.where(length > 0, 1.0 / np.where(length > 0, length, 1.0), 0.0)
+        self.cliff_boxes = np.array(self.cliffs, dtype=float).reshape(-1, 4, 1)
+
+        if poses is None:
+            poses = np.tile([template.x, template.y, template.theta], (count, 1))
+        poses = np.asarray(poses, dtype=float)
+        self.x = poses[:, 0].copy()
+        self.y = poses[:, 1].copy()
+        self.theta = poses[:, 2].copy()
+        self.left_velocity = np.zeros(count)
+        self.right_velocity = np.zeros(count)
+        self.wheel_drop = np.zeros(count, dtype=bool)
+        self.clearance = np.zeros(count)
+        self.bump_left = np.zeros(count, dtype=bool)
+        self.bump_right = np.zeros(count, dtype=bool)
+        self.distance = np.zeros(count)
+        self.angle = np.zeros(count)
+        self.left_counts = np.zeros(count)
+        self.right_counts = np.zeros(count)
+        self.time = 0.0
+        self.steps = 0
+
+        self.coverage = coverage
+        if coverage:
+            xs = [x for a, b in self.walls for x in (a[0], b[0])]
+            ys = [y for a, b in self.walls for y in (a[1], b[1])]
+            self.cover_origin = (min(xs), min(ys))
+            self.cover_shape = (int((max(xs) - min(xs)) // COVER_CELL) + 1,
+                                int((max(ys) - min(ys)) // COVER_CELL) + 1)
+            self.covered = np.zeros((count,) + self.cover_shape, dtype=bool)
+            self.covered_x = np.full(count, np.inf)
+            self.covered_y = np.full(count, np.inf)
+            self.disk = np.array(COVER_DISK)
+        self.update_bumpers(np.arange(count))
+        if coverage:
+            self.cover()
+
+    # Put robots (an index, a slice or a mask) somewhere else
+    def place(self, robots, x, y, theta):
+        self.x[robots] = x
+        self.y[robots] = y
+        self.theta[robots] = theta
+        self.update_bumpers(np.arange(self.count))
+
+    # Wheel speeds in mm/s, one per robot (or one for all), clamped like World.set_wheels
+    # Robots with their wheels dropped do not move
+    def set_wheels(self, left_velocity, right_velocity):
+        left = np.clip(np.broadcast_to(left_velocity, (self.count,)), MIN_VEL, MAX_VEL).astype(float)
+        right = np.clip(np.broadcast_to(right_velocity, (self.count,)), MIN_VEL, MAX_VEL).astype(float)
+        left[self.wheel_drop] = 0.0
+        right[self.wheel_drop] = 0.0
+        self.left_velocity = left
+        self.right_velocity = right
+
+    # Interface2.drive_direct, right wheel first like on the wire
+    def drive_direct(self, rvelocity, lvelocity):
+        self.set_wheels(lvelocity, rvelocity)
+
+    # Wall point minus robot, and distance, for every wall: walls x len(x) arrays
+    def closest(self, x, y):
+        rx = x - self.ax
+        ry = y - self.ay
+        t = np.clip((rx * self.dx + ry * self.dy) * self.inverse_length, 0.0, 1.0)
+        px = t * self.dx - rx
+        py = t * self.dy - ry
+        return px, py, np.sqrt(px * px + py * py)
+
+    # Move every robot for dt seconds
+    # Only robots whose clearance says they may be close to a wall are checked against the
+    # walls, the rest can't be blocked or bumped this step
+    def step(self, dt):
+        self.time += dt
+        self.steps += 1
+        left = self.left_velocity * dt
+        right = self.right_velocity * dt
+        forward = (left + right) * 0.5
+        turn = (right - left) / DIAMETER
+
+        # float32 sines and cosines are many times faster, and far more precise than the model
+        middle = (self.theta + turn * 0.5).astype(np.float32)
+        x = self.x + forward * np.cos(middle)
+        y = self.y + forward * np.sin(middle)
+        self.clearance -= np.abs(forward)
+        near = np.nonzero(self.clearance < NEAR)[0]
+        travelled = forward
+        if len(near):
+            old_x, old_y, old = self.closest(self.x[near], self.y[near])
+            px, py, distance = self.closest(x[near], y[near])
+            stuck = ((distance < ROBOT_RADIUS) & (distance < old)).any(axis=0)
+            if stuck.any():
+                blocked = near[stuck]
+                x[blocked] = self.x[blocked]
+                y[blocked] = self.y[blocked]
+                travelled = forward.copy()
+                travelled[blocked] = 0.0
+                px[:, stuck], py[:, stuck], distance[:, stuck] = old_x[:, stuck], old_y[:, stuck], old[:, stuck]
+        self.x = x
+        self.y = y
+        self.distance += travelled
+        theta = self.theta + turn
+        self.theta = np.where(theta > np.pi, theta - 2 * np.pi, np.where(theta <= -np.pi, theta + 2 * np.pi, theta))
+        self.angle += turn * (180 / np.pi)
+        self.left_counts += left / MM_PER_COUNT
+        self.right_counts += right / MM_PER_COUNT
+        if len(near):
+            self.update_bumpers(near, (px, py, distance))
+        if self.coverage:
+            self.cover()
+        if len(self.cliff_boxes):
+            dropped = self.in_cliff(self.x, self.y) & ~self.wheel_drop
+            if dropped.any():
+                self.wheel_drop |= dropped
+                self.left_velocity[dropped] = 0.0
+                self.right_velocity[dropped] = 0.0
+
+    # Distance to the nearest wall and bumpers of the robots (index array) from the walls
+    # around the front half of each. walls is what closest() gives for them, when known
+    def update_bumpers(self, robots, walls=None):
+        px, py, distance = walls if walls is not None else self.closest(self.x[robots], self.y[robots])
+        self.clearance[robots] = distance.min(axis=0)
+        theta = self.theta[robots].astype(np.float32)
+        cos, sin = np.cos(theta).astype(float), np.sin(theta).astype(float)
+        # The wall point ahead and to the left of the heading. Ahead is a bearing under 90
+        # degrees, and a bearing over -15 degrees is to the left of ahead * tan(-15)
+        ahead = px * cos + py * sin
+        left = py * cos - px * sin
+        front = (distance <= ROBOT_RADIUS + BUMP_TRAVEL) & (ahead > 0)
+        self.bump_left[robots] = (front & (left > -BUMP_SLOPE * ahead)).any(axis=0)
+        self.bump_right[robots] = (front & (left < BUMP_SLOPE * ahead)).any(axis=0)
+
+    def in_cliff(self, x, y):
+        boxes = self.cliff_boxes
+        inside = (x >= boxes[:, 0]) & (x <= boxes[:, 2]) & (y >= boxes[:, 1]) & (y <= boxes[:, 3])
+        return inside.any(axis=0)
+
+    # Light bumper signals, N x 6 in the order of LIGHT_PACKETS
+    # Robots further than LIGHT_RANGE from every wall see nothing and are left out
+    def lights(self):
+        signals = np.zeros((self.count, len(LIGHT_PACKETS)), dtype=int)
+        robots = np.nonzero(self.clearance < ROBOT_RADIUS + LIGHT_RANGE)[0]
+        if not len(robots):
+            return signals
+        angle = (self.theta[robots] + LIGHT_BEARINGS[:, None]).astype(np.float32)
+        rx, ry = np.cos(angle).astype(float), np.sin(angle).astype(float)
+        # Ray from each sensor against each wall: walls x 6 x robots
+        ax, ay = self.ax[:, :, None], self.ay[:, :, None]
+        dx, dy = self.dx[:, :, None], self.dy[:, :, None]
+        qx = ax - (self.x[robots] + ROBOT_RADIUS * rx)
+        qy = ay - (self.y[robots] + ROBOT_RADIUS * ry)
+        denom = rx * dy - ry * dx
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (qx * dy - qy * dx) / denom
+            u = (qx * ry - qy * rx) / denom
+        hit = (np.abs(denom) >= 1e-9) & (t >= 0) & (u >= 0) & (u <= 1)
+        nearest = np.where(hit, t, LIGHT_RANGE).min(axis=0)
+        signals[robots] = np.where(nearest < LIGHT_RANGE, LIGHT_MAX * np.exp(-nearest / LIGHT_FALLOFF), 0).T
+        return signals
+
+    # Cliff sensor under the body point at bearing (radians) and distance
+    def cliff_sensor(self, bearing, distance):
+        if not len(self.cliff_boxes):
+            return np.zeros(self.count, dtype=int)
+        angle = (self.theta + bearing).astype(np.float32)
+        return self.in_cliff(self.x + distance * np.cos(angle), self.y + distance * np.sin(angle)).astype(int)
+
+    # Mark the floor under the robots that moved half a cell since they were last marked
+    def cover(self):
+        moved = np.hypot(self.x - self.covered_x, self.y - self.covered_y) >= COVER_CELL / 2.0
+        robots = np.nonzero(moved)[0]
+        if not len(robots):
+            return
+        self.covered_x[robots] = self.x[robots]
+        self.covered_y[robots] = self.y[robots]
+        cx = ((self.x[robots] - self.cover_origin[0]) // COVER_CELL).astype(int)
+        cy = ((self.y[robots] - self.cover_origin[1]) // COVER_CELL).astype(int)
+        i = np.clip(cx[:, None] + self.disk[:, 0], 0, self.cover_shape[0] - 1)
+        j = np.clip(cy[:, None] + self.disk[:, 1], 0, self.cover_shape[1] - 1)
+        self.covered[robots[:, None], i, j] = True
+
+    # Floor area (m^2) each robot has been over
+    def covered_area(self):
+        return self.covered.sum(axis=(1, 2)) * COVER_CELL ** 2 / 1e6
+
+    # Value of the packets (all of BATCH_PACKETS when none are given), an array per packet
+    # Distance and angle are reset every time they are read, like the real Roomba
+    def sensors(self, *packet_ids):
+        wanted = set(packet_ids or BATCH_PACKETS)
+        values = {}
+        if BUMPERS_PACKET_ID in wanted:
+            bumps = np.where(self.bump_right, RIGHT_BUMPER, 0) | np.where(self.bump_left, LEFT_BUMPER, 0)
+            values[BUMPERS_PACKET_ID] = bumps | np.where(self.wheel_drop, RIGHT_WHEEL | LEFT_WHEEL, 0)
+        if wanted & set(LIGHT_PACKETS) or WALL in wanted:
+            signals = self.lights()
+            for index, packet in enumerate(LIGHT_PACKETS):
+                values[packet] = signals[:, index]
+            values[WALL] = (values[LIGHT_RIGHT] > WALL_SIGNAL).astype(int)
+        for packet, bearing, distance in CLIFF_POINTS:
+            if packet in wanted:
+                values[packet] = self.cliff_sensor(bearing, distance)
+        if DISTANCE in wanted or ANGLE in wanted:
+            values[DISTANCE], values[ANGLE] = self.take_odometry()
+        if LEFT_ENCODER in wanted:
+            values[LEFT_ENCODER] = self.left_counts.astype(int) % ENCODER_RANGE
+        if RIGHT_ENCODER in wanted:
+            values[RIGHT_ENCODER] = self.right_counts.astype(int) % ENCODER_RANGE
+        unknown = wanted - set(values)
+        if unknown:
+            raise ValueError("BatchWorld does not simulate packets %s" % sorted(unknown))
+        return dict((packet, values[packet]) for packet in wanted)
+
+    # Interface2.query: one Snapshot with an array per packet
+    def query(self, *packet_ids):
+        return Snapshot(self.sensors(*packet_ids), self.time)
+
+    # Take the distance and angle travelled since they were last read, like World
+    def take_odometry(self):
+        distance = np.clip(self.distance.astype(int), -32768, 32767)
+        angle = np.clip(self.angle.astype(int), -32768, 32767)
+        self.distance -= distance
+        self.angle -= angle
+        return distance, angle
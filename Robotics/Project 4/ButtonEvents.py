@@ -0,0 +1,165 @@
+'''
+Press, release and long press events for the Roomba buttons
+
+The buttons packet (18) is sampled on its own thread at the sensor rate (every 15 ms) and
+debounced in software, so a press is never missed while another thread has the port and a
+long press does not count twice. Nothing has to sleep after reading a button any more:
+
+    def on_clean(event):
+        if event.kind == PRESS:
+            print("clean pressed at " + str(event.timestamp))
+
+    buttons = ButtonEvents(lambda: roomba.sensor(BUTTONS_PACKET_ID))
+    buttons.subscribe(on_clean)         # called on the button thread
+    presses = buttons.subscribe()       # or get the events from a queue
+    buttons.start()
+
+read is any function that returns the raw value of packet 18, so the samples can go
+through a lock, the serial worker or the sensor stream. A read that fails is logged and
+skipped, the thread keeps sampling.
+'''
+import queue
+import threading
+import time
+
+from Interface import *
+import Log
+
+# ********************************** BUTTON EVENTS ***********************************#
+#
+#  PRESS: the button went down and stayed down for DEBOUNCE seconds
+#  LONG_PRESS: the button is still down LONG_PRESS_TIME seconds after the press
+#  RELEASE: the button came up and stayed up for DEBOUNCE seconds
+#
+#  The timestamp of an event is when the button changed (the first sample in the new
+#  state), not when the debounce finished, in time.monotonic() seconds so setting the
+#  clock does not make a long press. duration is how long it was held down
+#
+#  ERROR_LOG_INTERVAL: failed reads are logged at most once every ERROR_LOG_INTERVAL
+#                      seconds, a robot that stopped answering fails every sample
+#
+# ***********************************************************************************#
+PRESS = 'press'
+RELEASE = 'release'
+LONG_PRESS = 'long_press'
+DEBOUNCE = 0.04
+LONG_PRESS_TIME = 1.0
+ERROR_LOG_INTERVAL = 1.0
+
+log = Log.get('ButtonEvents')
+
+
+class ButtonEvent:
+    def __init__(self, button, kind, timestamp, duration=0.0):
+        self.button = button
+        self.kind = kind
+        self.timestamp = timestamp
+        self.duration = duration
+
+    def __repr__(self):
+        return "ButtonEvent(%s, %s, %.3f, %.3f)" % (self.button, self.kind, self.timestamp, self.duration)
+
+
+# Debounced state of one button
+class Button:
+    def __init__(self, name):
+        self.name = name
+        self.bit = BUTTON_BITS[name]
+        self.down = False
+        self.pressed_at = None
+        self.long_sent = False
+        self.changed_at = None  # first sample that disagreed with the debounced state
+
+    # Feed one sample, return the events it produced
+    def sample(self, value, now, debounce, long_press):
+        events = []
+        down = bool(value & self.bit)
+        if down == self.down:
+            self.changed_at = None
+        elif self.changed_at is None:
+            self.changed_at = now
+        if self.changed_at is not None and now - self.changed_at >= debounce:
+            self.down = down
+            if down:
+                self.pressed_at = self.changed_at
+                self.long_sent = False
+                events.append(ButtonEvent(self.name, PRESS, self.changed_at))
+            else:
+                events.append(ButtonEvent(self.name, RELEASE, self.changed_at,
+                                          self.changed_at - self.pressed_at))
+            self.changed_at = None
+        if self.down and not self.long_sent and now - self.pressed_at >= long_press:
+            self.long_sent = True
+            events.append(ButtonEvent(self.name, LONG_PRESS, now, now - self.pressed_at))
+        return events
+
+
+class ButtonEvents:
+    def __init__(self, read, buttons=('clean',), period=SLEEP, debounce=DEBOUNCE,
+                 long_press=LONG_PRESS_TIME):
+        self.read = read
+        self.buttons = [Button(name.lower()) for name in buttons]
+        self.period = period
+        self.debounce = debounce
+        self.long_press = long_press
+        self.subscribers = []
+        self.running = False
+        self.thread = None
+        self.samples = 0
+        self.errors = 0
+        self.last_error = None
+        self.error_log = log.limit(ERROR_LOG_INTERVAL)
+
+    # Call callback(event) for every event, or put them in a queue if there is no callback
+    # The queue is returned so it can be read with get()
+    def subscribe(self, callback=None):
+        if callback is None:
+            events = queue.Queue()
+            callback = events.put
+        else:
+            events = callback
+        self.subscribers.append(callback)
+        return events
+
+    def start(self):
+        if self.running:
+            return self
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='buttons')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    # Sample on absolute deadlines so a slow read does not push the next sample back
+    # A read that fails is skipped, the button keeps its debounced state. That goes for
+    # any error, a read the serial worker cancelled on a stop as much as a broken port
+    def run(self):
+        deadline = time.monotonic()
+        while self.running:
+            try:
+                value = self.read()
+            except Exception as error:
+                self.errors += 1
+                self.last_error = error
+                self.error_log.warning("reading the buttons failed: %r", error)
+            else:
+                self.update(value, time.monotonic())
+            deadline += self.period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+
+    # Feed one value of packet 18 taken at time now
+    def update(self, value, now):
+        self.samples += 1
+        for button in self.buttons:
+            for event in button.sample(value, now, self.debounce, self.long_press):
+                for callback in self.subscribers:
+                    callback(event)
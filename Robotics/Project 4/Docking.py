@@ -0,0 +1,217 @@
+'''
+Docking on the dock's infrared beams
+
+dock() in proj4v6 used to make four or five requests per step (red, green, the bumpers
+twice, the omni receiver), sleep half a second after each one and turn until red and
+green were within 10 of each other, so it was slow and swung from side to side. The
+DockingEngine takes one snapshot of DOCK_PACKETS per tick, the Roomba updates them every
+15 ms, and turns it into wheel speeds with a table worked out once at import time:
+
+    docking = DockingEngine()
+    docking.start(time.monotonic())
+    while docking.active():
+        snapshot = roomba.query(*DOCK_PACKETS)
+        right, left = docking.update(snapshot.values, snapshot.timestamp)
+        roomba.drive_direct(right, left)
+
+The dock sends a red beam to its right and a green beam to its left (looking out of the
+dock), both where they overlap in the middle (RED_GREEN) and a short force field in front
+(FIELD). Every receiver reports the beams where the robot is, so the code says which side
+of the dock the robot is on, and which of the two front receivers see it says where the
+dock is ahead. On the red side the robot keeps the dock on its left, which takes it across
+to the middle. In the middle it drives at the dock, on the green side it keeps the dock
+on its right. Nothing seen: it drives in a circle until it finds the beams again.
+
+A bump that does not start charging is waited out for SETTLE_TIME, then the robot backs
+up, turns a little towards the side it came in crooked to and tries again. stats() gives
+the time it took to dock and the steering reversals.
+
+The engine keeps no clock of its own, every time comes in with the snapshot. Take them from
+time.monotonic(), like the Snapshot timestamps, so a replay (Replay.py) runs the same timers.
+'''
+from Interface import *
+
+# ************************************ DOCKING ***************************************#
+#
+#  DOCK_PACKETS: everything a tick needs, read with one Query List request
+#  DOCK_PERIOD: time between ticks, the Roomba updates its sensors every 15 ms
+#  DOCK_SPEED: forward speed towards the dock (mm/s)
+#  DOCK_TURN: wheel speed change for an arc, added to one wheel and taken from the other
+#  SPIN_SPEED: wheel speed when turning on the spot to find the dock
+#  SEARCH_SPEED: forward speed of the circle driven when no beam is seen
+#  FIELD_SLOW: speed factor inside the force field, close to the dock
+#  SETTLE_TIME: time to wait after a bump for the charging to start (s)
+#  BACKUP_SPEED, BACKUP_TIME: backing up after a bump that did not start charging
+#  ALIGN_TIME: then it turns on the spot for this long towards the side the dock was last
+#              seen on by one front receiver alone, which is the side it came in crooked to
+#  LOST_TIME: the robot gives up after this long without seeing a beam (s)
+#  CHARGING_STATES: charging states (21) that mean the robot is on the dock
+#
+#  reversals: times the steering changed from left to right or back
+#  backups: bumps that did not end on the dock
+#
+# ***********************************************************************************#
+DOCK_PACKETS = (INFRARED_PACK, INFRARED_LEFT, INFRARED_RIGHT, BUMPERS_PACKET_ID,
+                CHARGING_STATE, CHARGING_SOURCE_AVAILABLE)
+DOCK_PERIOD = SLEEP
+DOCK_SPEED = 200
+DOCK_TURN = 40
+SPIN_SPEED = 60
+SEARCH_SPEED = 60
+FIELD_SLOW = 0.5
+SETTLE_TIME = 1.0
+BACKUP_SPEED = -100
+BACKUP_TIME = 0.6
+ALIGN_TIME = 0.7
+LOST_TIME = 5.0
+CHARGING_STATES = (1, 2, 3)
+
+# Bits of the dock codes: FIELD = 161, GREEN = 164, RED = 168, RED_GREEN = 172
+BEACON_BASE = 0xA0
+FIELD_BIT = FIELD & 0x0F
+GREEN_BIT = GREEN & 0x0F
+RED_BIT = RED & 0x0F
+
+# States
+APPROACH = 'approach'
+SETTLE = 'settle'
+BACK_UP = 'back up'
+ALIGN = 'align'
+DOCKED = 'docked'
+LOST = 'lost'
+
+# Actions: name, forward speed and turn (counter clockwise positive), in mm/s
+FORWARD = ('forward', DOCK_SPEED, 0)
+ARC_LEFT = ('arc left', DOCK_SPEED, DOCK_TURN)
+ARC_RIGHT = ('arc right', DOCK_SPEED, -DOCK_TURN)
+SPIN_LEFT = ('spin left', 0, SPIN_SPEED)
+SPIN_RIGHT = ('spin right', 0, -SPIN_SPEED)
+SEARCH = ('search', SEARCH_SPEED, SEARCH_SPEED)
+
+# What to do on each side of the dock, for where the dock is:
+# (seen by both front receivers, left one only, right one only, neither)
+SIDE_ACTIONS = {
+    RED_BIT: (ARC_RIGHT, FORWARD, SPIN_RIGHT, SPIN_LEFT),
+    GREEN_BIT: (ARC_LEFT, SPIN_LEFT, FORWARD, SPIN_RIGHT),
+    RED_BIT | GREEN_BIT: (FORWARD, ARC_LEFT, ARC_RIGHT, SPIN_LEFT),
+}
+
+
+# The dock bits of an infrared code, 0 for no code or one that is not from the dock
+def beacon(code):
+    return code & 0x0F if code & 0xF0 == BEACON_BASE else 0
+
+
+# Action for the dock bits the robot is in and the bits the two front receivers see
+def decide(beacons, left, right):
+    side = beacons & (RED_BIT | GREEN_BIT)
+    if not side:
+        return SEARCH
+    seen = (left and right, left and not right, right and not left, not left and not right)
+    name, forward, turn = SIDE_ACTIONS[side][seen.index(True)]
+    if beacons & FIELD_BIT:
+        forward *= FIELD_SLOW
+    return name, forward, turn
+
+
+# Every combination worked out once: DECISIONS[beacons * 4 + left * 2 + right]
+DECISIONS = tuple(decide(beacons, left, right)
+                  for beacons in range(16) for left in (0, 1) for right in (0, 1))
+
+
+class DockingEngine:
+    def __init__(self):
+        self.start()
+
+    def start(self, now=None):
+        self.state = APPROACH
+        self.started = now
+        self.docked_at = None
+        self.seen_at = now
+        self.since = now
+        self.action = None
+        self.turning = 0
+        self.side = 0
+        self.reversals = 0
+        self.backups = 0
+        self.ticks = 0
+
+    # Still trying to dock
+    def active(self):
+        return self.state not in (DOCKED, LOST)
+
+    def charging(self, values):
+        return bool(values.get(CHARGING_SOURCE_AVAILABLE, 0) & CHARGING_SOURCE_BITS['home_base']) \
+            or values.get(CHARGING_STATE, 0) in CHARGING_STATES
+
+    def change(self, state, now):
+        self.state = state
+        self.since = now
+
+    # One tick: the DOCK_PACKETS values and the time they were read
+    # Returns the right and left wheel speeds, in the order drive_direct takes them
+    def update(self, values, now):
+        self.ticks += 1
+        if self.started is None:
+            self.started = self.seen_at = self.since = now
+        if self.charging(values):
+            if self.docked_at is None:
+                self.docked_at = now
+            self.change(DOCKED, now)
+            return 0, 0
+        if not self.active():
+            return 0, 0
+
+        bumped = values.get(BUMPERS_PACKET_ID, 0) & (LEFT_BUMPER | RIGHT_BUMPER)
+        if self.state == APPROACH and bumped:
+            self.change(SETTLE, now)
+        if self.state == SETTLE:
+            if now - self.since < SETTLE_TIME:
+                return 0, 0
+            self.backups += 1
+            self.change(BACK_UP, now)
+        if self.state == BACK_UP:
+            if now - self.since < BACKUP_TIME:
+                return BACKUP_SPEED, BACKUP_SPEED
+            self.change(ALIGN, now)
+        if self.state == ALIGN:
+            if self.side and now - self.since < ALIGN_TIME:
+                turn = self.side * SPIN_SPEED
+                self.steer(turn)
+                return turn, -turn
+            self.change(APPROACH, now)
+
+        beacons = beacon(values.get(INFRARED_PACK, 0))
+        left = beacon(values.get(INFRARED_LEFT, 0))
+        right = beacon(values.get(INFRARED_RIGHT, 0))
+        beacons |= left | right
+        if beacons:
+            self.seen_at = now
+        elif now - self.seen_at > LOST_TIME:
+            self.change(LOST, now)
+            return 0, 0
+        if (left != 0) != (right != 0):
+            self.side = 1 if left else -1
+        self.action = DECISIONS[beacons * 4 + (left != 0) * 2 + (right != 0)]
+        name, forward, turn = self.action
+        self.steer(turn)
+        return int(forward + turn), int(forward - turn)
+
+    # Count the times the steering changes direction
+    def steer(self, turn):
+        if not turn:
+            return
+        direction = 1 if turn > 0 else -1
+        if self.turning and direction != self.turning:
+            self.reversals += 1
+        self.turning = direction
+
+    # Seconds from start to docked, None while not docked
+    def time_to_dock(self):
+        if self.docked_at is None or self.started is None:
+            return None
+        return self.docked_at - self.started
+
+    def stats(self):
+        return {'state': self.state, 'time_to_dock': self.time_to_dock(), 'reversals': self.reversals,
+                'backups': self.backups, 'ticks': self.ticks}
@@ -0,0 +1,269 @@
+'''
+Run several Roombas from one program
+
+Every project script talks to one robot through module globals (the port, the lock,
+isMOVING), so a floor of robots needed a copy of the script per robot. A Fleet runs one
+Session per robot instead. Each session has its own connection (AsyncInterface2), its
+own behavior and, if asked, its own telemetry log. The sessions are coroutines on one
+event loop. The ports never block, so a slow or dead port only holds up its own session.
+With processes=N the sessions are dealt out to N worker processes, each with its own loop,
+for behaviors that need more CPU than one core has.
+
+A session that loses its robot (no frames for READ_TIMEOUT, a port that breaks) counts
+the error, waits RETRY_DELAY and connects again until the run is over. Any other error in
+a session fails that session only, the other robots keep running and report as usual.
+
+    python Fleet.py /dev/ttyUSB0 /dev/ttyUSB1=hug_wall --behavior random_walk --seconds 60
+    python Fleet.py --simulate 4 --seconds 10                # four simulated robots
+    python Fleet.py --simulate 8 --processes 2 --telemetry logs
+
+    fleet = Fleet([Session('left', '/dev/ttyUSB0', 'wall'), Session('right', '/dev/ttyUSB1', 'dock')])
+    for stats in fleet.run(seconds=60):
+        print(stats['name'], stats['rate'], stats['errors'])
+'''
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import os
+import time
+
+from AsyncInterface import AsyncInterface2, random_walk, wall, hug_wall, dock
+from Scheduler import percentile
+
+# ************************************* FLEET *****************************************#
+#
+#  BEHAVIORS: the coroutine behaviors a session can run (AsyncInterface.py)
+#  RETRY_DELAY: wait before connecting again after an error (s)
+#  HISTORY: ticks kept for the tick time statistics
+#
+#  Every session reports:
+#    ticks, rate: behavior loop iterations and iterations per second
+#    dt_p50, dt_p99: time between iterations (ms)
+#    frames: sensor frames received
+#    errors: errors by kind, connects: connections opened, the first one included
+#    state: 'done' when the behavior ended by itself (docked, wheel drop), 'stopped' when
+#           the time ran out, 'failed' when the last connection attempt failed
+#
+# *************************************************************************************#
+BEHAVIORS = {'random_walk': random_walk, 'wall': wall, 'hug_wall': hug_wall, 'dock': dock}
+DEFAULT_BEHAVIOR = 'random_walk'
+RETRY_DELAY = 0.5
+HISTORY = 1000
+
+
+class Session:
+    def __init__(self, name, port, behavior=DEFAULT_BEHAVIOR, telemetry=None):
+        if behavior not in BEHAVIORS:
+            raise ValueError("Unknown behavior %r, one of %s" % (behavior, ', '.join(sorted(BEHAVIORS))))
+        self.name = name
+        self.port = port
+        self.behavior = behavior
+        self.telemetry = telemetry
+        self.recorder = None
+        self.roomba = None
+        self.end = None
+        self.stopping = False
+        self.state = 'idle'
+        self.ticks = 0
+        self.last_tick = None
+        self.dts = collections.deque(maxlen=HISTORY)
+        self.frames = 0
+        self.connects = 0
+        self.errors = collections.Counter()
+        self.last_error = None
+        self.started = None
+        self.finished = None
+
+    # The behavior's loop check: one call is one tick
+    def running(self):
+        now = time.monotonic()
+        if self.last_tick is not None:
+            self.dts.append(now - self.last_tick)
+        self.last_tick = now
+        self.ticks += 1
+        return not self.stopping and now < self.end
+
+    def stop(self):
+        self.stopping = True
+
+    async def connect(self):
+        self.connects += 1
+        self.roomba = AsyncInterface2(self.port)
+        await self.roomba.open()
+        if self.telemetry is not None:
+            if self.recorder is None:
+                from Telemetry import TelemetryRecorder
+                self.recorder = TelemetryRecorder(self.telemetry)
+            self.roomba.record(self.recorder)
+        await self.roomba.control('start')
+        await self.roomba.control('safe')
+        self.roomba.start_stream()
+
+    # Stop the wheels if the port still works and close it
+    async def disconnect(self):
+        roomba, self.roomba = self.roomba, None
+        if roomba is None or roomba.ser is None:
+            return
+        self.frames += roomba.frame_count
+        try:
+            if roomba.error is None:
+                await roomba.drive_direct(0, 0)
+        except Exception:
+            pass
+        try:
+            await roomba.close()
+        except Exception:
+            pass
+
+    # Run the behavior until it ends or seconds have passed, connecting again after errors
+    async def run(self, seconds):
+        self.started = time.monotonic()
+        self.end = self.started + seconds
+        self.state = 'running'
+        while not self.stopping and time.monotonic() < self.end:
+            try:
+                await self.connect()
+                await BEHAVIORS[self.behavior](self.roomba, self.running)
+                self.state = 'done' if time.monotonic() < self.end and not self.stopping else 'stopped'
+                break
+            except (asyncio.TimeoutError, OSError) as error:
+                self.failed(error)
+            except Exception as error:
+                # Not the robot or the port, connecting again would run into it again
+                self.failed(error)
+                break
+            finally:
+                await self.disconnect()
+            await asyncio.sleep(min(RETRY_DELAY, max(0.0, self.end - time.monotonic())))
+        else:
+            if self.state == 'running':
+                self.state = 'stopped'
+        self.finished = time.monotonic()
+        if self.recorder is not None:
+            self.recorder.close()
+        return self.stats()
+
+    def failed(self, error):
+        self.errors[type(error).__name__] += 1
+        self.last_error = str(error) or type(error).__name__
+        self.state = 'failed'
+
+    def stats(self):
+        elapsed = (self.finished or time.monotonic()) - (self.started or time.monotonic())
+        dts = sorted(self.dts)
+        return {
+            'name': self.name, 'port': self.port, 'behavior': self.behavior, 'state': self.state,
+            'seconds': elapsed, 'ticks': self.ticks, 'rate': self.ticks / elapsed if elapsed > 0 else 0.0,
+            'dt_p50': percentile(dts, 50) * 1000 if dts else None,
+            'dt_p99': percentile(dts, 99) * 1000 if dts else None,
+            'frames': self.frames, 'connects': self.connects,
+            'errors': dict(self.errors), 'error_count': sum(self.errors.values()),
+            'last_error': self.last_error,
+        }
+
+
+# Run sessions on one event loop, the stats of each in order
+async def run_sessions(sessions, seconds):
+    return await asyncio.gather(*[session.run(seconds) for session in sessions])
+
+
+# Worker process entry: sessions as (name, port, behavior, telemetry) tuples
+def run_group(specs, seconds):
+    sessions = [Session(*spec) for spec in specs]
+    return asyncio.run(run_sessions(sessions, seconds))
+
+
+class Fleet:
+    def __init__(self, sessions, processes=0):
+        self.sessions = list(sessions)
+        self.processes = processes
+        names = [session.name for session in self.sessions]
+        if len(set(names)) != len(names):
+            raise ValueError("Session names must be different")
+
+    # Run every session for seconds, returns their stats in the order they were given
+    def run(self, seconds):
+        if not self.processes or len(self.sessions) < 2:
+            return asyncio.run(run_sessions(self.sessions, seconds))
+        # Deal the sessions out to the processes and put the results back in order
+        count = min(self.processes, len(self.sessions))
+        groups = [self.sessions[i::count] for i in range(count)]
+        results = {}
+        with concurrent.futures.ProcessPoolExecutor(count) as pool:
+            futures = [pool.submit(run_group, [(s.name, s.port, s.behavior, s.telemetry) for s in group], seconds)
+                       for group in groups]
+            for future in futures:
+                for stats in future.result():
+                    results[stats['name']] = stats
+        return [results[session.name] for session in self.sessions]
+
+
+# Fleet totals: ticks per second over all robots and errors of each kind
+def totals(results):
+    errors = collections.Counter()
+    for stats in results:
+        errors.update(stats['errors'])
+    return {'robots': len(results), 'rate': sum(stats['rate'] for stats in results),
+            'errors': dict(errors), 'failed': sum(1 for stats in results if stats['state'] == 'failed')}
+
+
+def print_results(results):
+    print("%-8s %-14s %-12s %8s %7s %8s %8s %7s %7s %8s" % (
+        'robot', 'port', 'behavior', 'state', 'ticks', 'Hz', 'p99 ms', 'frames', 'errors', 'connects'))
+    for stats in results:
+        print("%-8s %-14s %-12s %8s %7d %8.1f %8s %7d %7d %8d" % (
+            stats['name'], stats['port'], stats['behavior'], stats['state'], stats['ticks'], stats['rate'],
+            '-' if stats['dt_p99'] is None else '%.1f' % stats['dt_p99'], stats['frames'],
+            stats['error_count'], stats['connects']))
+        if stats['last_error']:
+            print("         last error: " + stats['last_error'])
+    total = totals(results)
+    print("fleet: %d robots, %.1f ticks per second in all, %d failed, errors %s" % (
+        total['robots'], total['rate'], total['failed'], total['errors'] or 'none'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('ports', nargs='*', help='serial ports, PORT=BEHAVIOR for another behavior')
+    parser.add_argument('--behavior', default=DEFAULT_BEHAVIOR, choices=sorted(BEHAVIORS))
+    parser.add_argument('--seconds', type=float, default=30.0, help='how long to run')
+    parser.add_argument('--simulate', type=int, default=0, help='add this many simulated robots')
+    parser.add_argument('--processes', type=int, default=0, help='worker processes (0: one event loop)')
+    parser.add_argument('--telemetry', help='directory for a telemetry log per robot')
+    parser.add_argument('--output', help='write the stats to this JSON file')
+    args = parser.parse_args()
+
+    simulators = []
+    ports = list(args.ports)
+    if args.simulate:
+        from Simulator import RoombaSimulator, World
+        for i in range(args.simulate):
+            simulator = RoombaSimulator(World(pose=(600.0 + 400 * (i % 5), 600.0 + 400 * (i // 5 % 5), 0.0)))
+            simulators.append(simulator.start())
+            ports.append(simulator.port)
+    if not ports:
+        parser.error("no ports, give some or --simulate N")
+    if args.telemetry and not os.path.isdir(args.telemetry):
+        os.makedirs(args.telemetry)
+
+    sessions = []
+    for index, port in enumerate(ports):
+        port, _, behavior = port.partition('=')
+        name = 'robot%d' % index
+        telemetry = os.path.join(args.telemetry, name + '.log') if args.telemetry else None
+        sessions.append(Session(name, port, behavior or args.behavior, telemetry))
+    try:
+        results = Fleet(sessions, args.processes).run(args.seconds)
+    finally:
+        for simulator in simulators:
+            simulator.stop()
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'sessions': results, 'totals': totals(results)}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
+import json
+import math
+import os
 import serial
 import struct
+import threading
 import time
 import numpy as np
 
@@ -9,12 +13,17 @@ import numpy as np
 #  These variables set the port configuration of the Roomba
 #  Sleep is set to 15 ms as the Roomba's sensors update every 15 ms
 #  Sleep Extended basically sleeps the Roomba for an extended period of time
+#  The port can be changed with the ROOMBA_PORT environment variable,
+#  for example to run against the simulator (Simulator.py)
+#  READ_TIMEOUT is how long a sensor request waits for its answer. A robot that is not
+#  in the OI (after stop) never answers, the request raises IOError instead of hanging
 #
 # ******************************************************************************#
 BAUDRATE = 115200
-PORT = '/dev/ttyUSB0'
+PORT = os.environ.get('ROOMBA_PORT', '/dev/ttyUSB0')
 SLEEP = 0.0150
 SLEEP_EXTENDED = 1
+READ_TIMEOUT = 1.0
 
 # The following OP codes are obtained from Roomba Documentation
 # ********************************** STATE *************************************#
@@ -31,6 +40,22 @@ FULL = 132
 PASSIVE = 128
 SAFE = 131
 
+# ********************************** OI MODES ****************************************#
+#
+#  Mode the robot is in, same numbers as the OI Mode packet (35)
+#  Sensors can be read from PASSIVE up, driving needs SAFE or FULL. In SAFE the robot
+#  drops back to PASSIVE by itself on a cliff, a wheel drop or a charger
+#  MODE_STATES is the mode each control() state leaves the robot in (None: we don't know)
+#
+# *************************************************************************************#
+OI_MODE = 35
+MODE_OFF = 0
+MODE_PASSIVE = 1
+MODE_SAFE = 2
+MODE_FULL = 3
+MODE_STATES = {'start': MODE_PASSIVE, 'passive': MODE_PASSIVE, 'safe': MODE_SAFE,
+               'full': MODE_FULL, 'stop': MODE_OFF, 'reset': None}
+
 # ********************************** READING DATA  *******************************#
 #
 #  Various opcodes and packet id to read button press, wheel drop, bump and cliff
@@ -116,6 +141,19 @@ LIGHT_FRONT_RIGHT = 50
 LIGHT_RIGHT = 51
 LIGHT_BYTES = 2
 
+# Where the light bumpers look, in degrees from the heading (counter clockwise is positive).
+# They sit on the front of the body, ROBOT_RADIUS mm from the center
+# The signal falls off about as LIGHT_MAX * e^(-d / LIGHT_FALLOFF), d is the distance from
+# the bumper to the wall in mm: 300 is about 90 mm away. Worth checking on each robot,
+# the signal also depends on the color of the wall
+ROBOT_RADIUS = 170
+LIGHT_SENSORS = {LIGHT_LEFT: 72, LIGHT_FRONT_LEFT: 42, LIGHT_CENTER_LEFT: 12,
+                 LIGHT_CENTER_RIGHT: -12, LIGHT_FRONT_RIGHT: -42, LIGHT_RIGHT: -72}
+LIGHT_PACKETS = (LIGHT_LEFT, LIGHT_FRONT_LEFT, LIGHT_CENTER_LEFT,
+                 LIGHT_CENTER_RIGHT, LIGHT_FRONT_RIGHT, LIGHT_RIGHT)
+LIGHT_MAX = 3000
+LIGHT_FALLOFF = 40.0
+
 # *********************************** Charging Sensor *************************************#
 
 CHARGING_STATE = 21
@@ -180,6 +218,168 @@ DEFAULT_ANGLE = 90
 UPPER_RAND_BOUND = 46
 LOWER_RAND_BOUND = -45
 
+# ********************************** ODOMETRY **************************************#
+#
+#  Each wheel encoder (packets 43 and 44) counts COUNTS_PER_REV ticks per turn of a
+#  WHEEL_DIAMETER mm wheel, so one count is MM_PER_COUNT mm. The counts are unsigned
+#  16 bit and roll over from 65535 to 0 (and back when the wheel turns backwards)
+#
+# *********************************************************************************#
+WHEEL_DIAMETER = 72
+COUNTS_PER_REV = 508.8
+MM_PER_COUNT = math.pi * WHEEL_DIAMETER / COUNTS_PER_REV
+ENCODER_RANGE = 1 << 16
+
+# ********************************** STREAMING *************************************#
+#
+#  Stream asks the Roomba to send a list of packets every 15 ms without being asked.
+#  Every frame it sends looks like:
+#
+#  | 19 (HEADER) | N-BYTES | PACKET ID 1 | PACKET 1 DATA | ... | PACKET ID n | ... | CHECKSUM |
+#
+#  N-BYTES counts the packet ids and their data. Adding up every byte of the frame,
+#  header and checksum included, gives 0 (only the low byte is kept).
+#  Pause/Resume stops and restarts the stream without forgetting the packet list.
+#
+#  Query List asks once for a list of packets. The Roomba answers with the data of
+#  every packet back to back, in the order they were asked for (no ids, no checksum).
+#
+#  STREAM_TIMEOUT is how long the reader waits on the port before checking if it should stop
+#  STREAM_WAIT is how long an accessor waits for the first frame before giving up
+#
+# **********************************************************************************#
+
+STREAM = 148
+QUERY_LIST = 149
+PAUSE_RESUME = 150
+STREAM_HEADER = 19
+STREAM_PAUSE = 0
+STREAM_RESUME = 1
+STREAM_TIMEOUT = 0.05
+STREAM_WAIT = 1
+
+# ********************************* PACKET REGISTRY ***************************************#
+#
+#  Every sensor packet of the Open Interface (7 to 58) with its size in bytes, whether it
+#  is signed and the names of its bits. Two byte packets are big endian (high byte first).
+#  Everything that reads packets is built from this table: the struct of each packet,
+#  the sensor and query requests, the stream frame decoder and the NumPy frame decoder.
+#
+#  PACKETS: packet id -> Packet
+#  PACKET_FORMATS / PACKET_STRUCTS: struct format and Struct of every packet
+#
+# ******************************************************************************************#
+WHEEL_OVERCURRENTS = 14
+SONG_NUMBER = 36
+SONG_PLAYING = 37
+LEFT_ENCODER = 43
+RIGHT_ENCODER = 44
+LIGHT_BUMPER = 45
+
+# Bits of the packets that are bit fields, by the name the accessors use
+BUTTON_BITS = {'clean': CLEAN, 'spot': SPOT, 'dock': DOCK, 'minute': MINUTE,
+               'hour': HOUR, 'day': DAY, 'schedule': SCHEDULE, 'clock': CLOCK}
+BUMPER_BITS = {'left': LEFT_BUMPER, 'right': RIGHT_BUMPER,
+               'lwheel': LEFT_WHEEL, 'rwheel': RIGHT_WHEEL}
+OVERCURRENT_BITS = {'side_brush': 0x01, 'main_brush': 0x04, 'right_wheel': 0x08, 'left_wheel': 0x10}
+CHARGING_SOURCE_BITS = {'internal': 0x01, 'home_base': 0x02}
+LIGHT_BUMPER_BITS = {'left': 0x01, 'front_left': 0x02, 'center_left': 0x04,
+                     'center_right': 0x08, 'front_right': 0x10, 'right': 0x20}
+STASIS_BITS = {'toggling': 0x01, 'disabled': 0x02}
+
+
+class Packet:
+    def __init__(self, packet_id, name, size=1, signed=False, bits=None):
+        self.id = packet_id
+        self.name = name
+        self.size = size
+        self.signed = signed
+        self.bits = bits or {}
+        self.code = {(1, False): 'B', (1, True): 'b', (2, False): 'H', (2, True): 'h'}[(size, signed)]
+        self.format = '>' + self.code
+        self.struct = struct.Struct(self.format)
+        self.dtype = ('>i' if signed else '>u') + str(size)
+
+    def unpack(self, buf, offset=0):
+        return self.struct.unpack_from(buf, offset)[0]
+
+    # State of one named bit of the value, None if the packet has no bit by that name
+    def flag(self, value, name):
+        bit = self.bits.get(name.lower())
+        if bit is None:
+            return None
+        return bool(value & bit)
+
+    # Every named bit of the value
+    def flags(self, value):
+        return dict((name, bool(value & bit)) for name, bit in self.bits.items())
+
+
+PACKETS = dict((packet.id, packet) for packet in [
+    Packet(BUMPERS_PACKET_ID, 'bumps_wheel_drops', bits=BUMPER_BITS),
+    Packet(WALL, 'wall'),
+    Packet(CLIFF_LEFT, 'cliff_left'),
+    Packet(CLIFF_FLEFT, 'cliff_front_left'),
+    Packet(CLIFF_FRIGHT, 'cliff_front_right'),
+    Packet(CLIFF_RIGHT, 'cliff_right'),
+    Packet(V_WALL, 'virtual_wall'),
+    Packet(WHEEL_OVERCURRENTS, 'wheel_overcurrents', bits=OVERCURRENT_BITS),
+    Packet(15, 'dirt_detect'),
+    Packet(16, 'unused_16'),
+    Packet(INFRARED_PACK, 'ir_omni'),
+    Packet(BUTTONS_PACKET_ID, 'buttons', bits=BUTTON_BITS),
+    Packet(DISTANCE, 'distance', 2, signed=True),
+    Packet(ANGLE, 'angle', 2, signed=True),
+    Packet(CHARGING_STATE, 'charging_state'),
+    Packet(22, 'voltage', 2),
+    Packet(23, 'current', 2, signed=True),
+    Packet(24, 'temperature', signed=True),
+    Packet(25, 'battery_charge', 2),
+    Packet(26, 'battery_capacity', 2),
+    Packet(27, 'wall_signal', 2),
+    Packet(28, 'cliff_left_signal', 2),
+    Packet(29, 'cliff_front_left_signal', 2),
+    Packet(30, 'cliff_front_right_signal', 2),
+    Packet(31, 'cliff_right_signal', 2),
+    Packet(32, 'unused_32'),
+    Packet(33, 'unused_33', 2),
+    Packet(CHARGING_SOURCE_AVAILABLE, 'charging_sources', bits=CHARGING_SOURCE_BITS),
+    Packet(OI_MODE, 'oi_mode'),
+    Packet(SONG_NUMBER, 'song_number'),
+    Packet(SONG_PLAYING, 'song_playing'),
+    Packet(38, 'stream_packets'),
+    Packet(39, 'requested_velocity', 2, signed=True),
+    Packet(40, 'requested_radius', 2, signed=True),
+    Packet(VEL_ID, 'requested_right_velocity', 2, signed=True),
+    Packet(42, 'requested_left_velocity', 2, signed=True),
+    Packet(LEFT_ENCODER, 'left_encoder', 2),
+    Packet(RIGHT_ENCODER, 'right_encoder', 2),
+    Packet(LIGHT_BUMPER, 'light_bumper', bits=LIGHT_BUMPER_BITS),
+    Packet(LIGHT_LEFT, 'light_left', 2),
+    Packet(LIGHT_FRONT_LEFT, 'light_front_left', 2),
+    Packet(LIGHT_CENTER_LEFT, 'light_center_left', 2),
+    Packet(LIGHT_CENTER_RIGHT, 'light_center_right', 2),
+    Packet(LIGHT_FRONT_RIGHT, 'light_front_right', 2),
+    Packet(LIGHT_RIGHT, 'light_right', 2),
+    Packet(INFRARED_LEFT, 'ir_left'),
+    Packet(INFRARED_RIGHT, 'ir_right'),
+    Packet(54, 'left_motor_current', 2, signed=True),
+    Packet(55, 'right_motor_current', 2, signed=True),
+    Packet(56, 'main_brush_current', 2, signed=True),
+    Packet(57, 'side_brush_current', 2, signed=True),
+    Packet(58, 'stasis', bits=STASIS_BITS),
+])
+PACKET_FORMATS = dict((packet.id, packet.format) for packet in PACKETS.values())
+PACKET_STRUCTS = dict((packet.id, packet.struct) for packet in PACKETS.values())
+CLIFF_PACKETS = [CLIFF_LEFT, CLIFF_FLEFT, CLIFF_FRIGHT, CLIFF_RIGHT]
+
+# Every packet the Interface2 accessors use, streamed by default
+STREAM_PACKETS = [BUMPERS_PACKET_ID, CLIFF_LEFT, CLIFF_FLEFT, CLIFF_FRIGHT, CLIFF_RIGHT,
+                  INFRARED_PACK, BUTTONS_PACKET_ID, CHARGING_STATE, CHARGING_SOURCE_AVAILABLE,
+                  LIGHT_LEFT, LIGHT_FRONT_LEFT, LIGHT_CENTER_LEFT, LIGHT_CENTER_RIGHT,
+                  LIGHT_FRONT_RIGHT, LIGHT_RIGHT, INFRARED_LEFT, INFRARED_RIGHT, OI_MODE,
+                  LEFT_ENCODER, RIGHT_ENCODER]
+
 # These variables represent the necessary parameters for the roomba to play a song
 SONG = 140
 PLAY_SONG = 141
@@ -235,13 +435,17 @@ fis6 = ges6 = 90
 # define some note lengths
 # change the top MEASURE (4/4 time) to get faster/slower speeds
 MEASURE = 160
-HALF = MEASURE / 2
-Q = MEASURE / 4
-E = MEASURE / 8
-Ed = MEASURE * 3 / 16
-S = MEASURE / 16
+HALF = MEASURE // 2
+Q = MEASURE // 4
+E = MEASURE // 8
+Ed = MEASURE * 3 // 16
+S = MEASURE // 16
 MEASURE_TIME = MEASURE / 64
 
+# The opening of the Imperial March, note and length pairs (SONG_LEN_ONE notes)
+IMPERIAL_MARCH = [a4, Q, a4, Q, a4, Q, f4, Ed, c5, S,
+                  a4, Q, f4, Ed, c5, S, a4, Q]
+
 
 # **************************** INTERFACE CLASS *****************************************#
 #
@@ -274,28 +478,134 @@ MEASURE_TIME = MEASURE / 64
 #
 #   drive_direct: Specifies the left wheel and the right wheel's velocity
 #
-#   ints2str: Converts a list to a string to write to the Roomba
+#   ints2str: Converts a list to a string (the commands themselves are encoded as bytes)
 #
 #   song_upload: Uploads a song to the roomba to be played late
 #
 #   plat_song: Plays the uploaded song
+#
+#   sensor: reads a single sensor packet, from the stream if one is running
+#
+#   start_stream / stop_stream: start and stop streaming sensor data in the background
+#       While streaming every sensor accessor returns the latest frame without
+#       touching the serial port
+#
+#   query: reads several sensor packets with one Query List request
+#       returns a Snapshot with the value of every packet asked for
+#
+#  RoombaClient - Interface 2 on one long lived connection shared by every helper
 # ******************************************************************************#
 class Interface:
-    def __init__(self):
+    def __init__(self, port=None, reconnect=False):
         # Connect to the serial interface
+        # If reconnect is set a broken connection is reopened instead of staying broken
+        self.port = port or PORT
+        self.reconnect = reconnect
+        self.reconnects = 0
+        self.timeout = READ_TIMEOUT
+        # Traffic counters, used by the benchmarks
+        self.writes = 0
+        self.reads = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.io_time = 0.0
+        # Telemetry recorder (see Telemetry.py), every write and read is appended to it
+        self.recorder = None
+        # Metrics registry (see Metrics.py), times every request, write and read
+        self.metrics = None
+        # Tracer (see Trace.py), every write, read and request is a span of the trace
+        self.tracer = None
+        self.pending = None
+        self.sent_at = 0.0
+        self.open()
+
+    # Open the serial port
+    def open(self):
         self.ser = serial.Serial()
         self.ser.baudrate = BAUDRATE  # From Roomba documentation notes
-        self.ser.port = PORT
+        self.ser.port = self.port
+        self.ser.timeout = self.timeout
         self.ser.open()
 
+    # Close the broken port and open it again
+    def reopen(self):
+        try:
+            self.ser.close()
+        except serial.SerialException:
+            pass
+        self.reconnects += 1
+        self.open()
+
+    # Change how long a read waits for data (None waits forever, the default is READ_TIMEOUT)
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+        self.ser.timeout = timeout
+
     # Send a command to the roomba
+    # pyserial on Python 3 only takes bytes, so the chr() commands are sent as latin-1
+    # A command that failed is sent again once on the new connection
     def write(self, instr):
-        self.ser.write(instr)
+        if isinstance(instr, str):
+            instr = instr.encode('latin-1')
+        start = time.perf_counter()
+        try:
+            self.ser.write(instr)
+        except serial.SerialException:
+            if not self.reconnect:
+                raise
+            self.reopen()
+            self.ser.write(instr)
+        finally:
+            end = time.perf_counter()
+            self.io_time += end - start
+        self.writes += 1
+        self.bytes_written += len(instr)
+        if self.recorder is not None:
+            self.recorder.command(instr)
+        if self.metrics is not None:
+            self.metrics.wrote(instr, end - start)
+        if self.tracer is not None:
+            self.tracer.complete(self.tracer.command(instr), 'write', start, end)
+        # The next read answers a Sensors or Query List request
+        if instr[0] == SENSORS_OP or instr[0] == QUERY_LIST:
+            self.pending = instr
+            self.sent_at = start
 
     # Read the data from the roomba
     # Specify which bits we need to read
+    # The request this read answers is lost with the connection, so after reconnecting
+    # the error is still raised and the caller asks again
     def read(self, num):
-        x = self.ser.read(num)
+        start = time.perf_counter()
+        try:
+            x = self.ser.read(num)
+        except serial.SerialException:
+            self.pending = None
+            if self.reconnect:
+                self.reopen()
+            raise
+        finally:
+            end = time.perf_counter()
+            self.io_time += end - start
+        self.reads += 1
+        self.bytes_read += len(x)
+        if self.recorder is not None:
+            self.recorder.read(x)
+        request, self.pending = self.pending, None
+        if self.metrics is not None:
+            if request is not None:
+                self.metrics.answered(request, end - self.sent_at, len(x), len(x) < num)
+            else:
+                self.metrics.streamed(len(x), end - start)
+        if self.tracer is not None:
+            self.tracer.complete('read', 'read', start, end, {'bytes': len(x)})
+            if request is not None:
+                self.tracer.complete(self.tracer.command(request), 'query', self.sent_at, end)
+        # A late answer would be taken for the answer to the next request, drop it
+        if request is not None and len(x) < num:
+            self.ser.reset_input_buffer()
+            raise IOError("No answer from the Roomba within %s s (%d of %d bytes)"
+                          % (self.timeout, len(x), num))
         return x
 
     # Close the connection
@@ -303,105 +613,883 @@ class Interface:
         self.ser.close()
 
 
-class Interface2:
+# ********************************* STREAM DECODER ****************************************#
+#
+#  Cuts stream frames for a list of packets out of the bytes read from the Roomba.
+#  A frame with the wrong header, length, packet ids or checksum is thrown away and we
+#  look for the next header byte (resync).
+#
+# ******************************************************************************************#
+class StreamDecoder:
+    def __init__(self, packet_ids=STREAM_PACKETS):
+        self.packet_ids = list(packet_ids)
+        self.ids = tuple(self.packet_ids)
+        self.frame_struct = frame_struct(self.packet_ids)
+        self.frame_dtype = frame_dtype(self.packet_ids)
+        self.frame_size = self.frame_struct.size  # header, n-bytes, ids, data and checksum
+        self.data_size = self.frame_size - 3
+        self.bad_frames = 0
+        self.stream_command = bytes(bytearray([STREAM, len(self.packet_ids)] + self.packet_ids))
+
+    # Decode every complete frame in the buffer and drop the bytes we used
+    # Returns the packet values of each frame, oldest first
+    def parse(self, buf):
+        frames = []
+        while True:
+            start = buf.find(STREAM_HEADER)
+            if start < 0:
+                del buf[:]
+                return frames
+            del buf[:start]
+            if len(buf) < self.frame_size:
+                return frames
+
+            values = None
+            if buf[1] == self.data_size and sum(buf[:self.frame_size]) & BYTE == 0:
+                values = self.decode(buf)
+            if values is None:
+                # Not a real frame, the header byte was part of some data. Resync
+                self.bad_frames += 1
+                del buf[0]
+                continue
+
+            del buf[:self.frame_size]
+            frames.append(values)
+
+    # Decode the packets of one frame, returns None if the packet ids do not match
+    # The frame struct unpacks header, n-bytes, then id and value of every packet, then checksum
+    def decode(self, buf):
+        fields = self.frame_struct.unpack_from(buf)
+        if fields[2:-1:2] != self.ids:
+            return None
+        return dict(zip(self.packet_ids, fields[3:-1:2]))
+
+    # Decode every frame in a buffer of stream bytes in one go (a recording, for example)
+    # Returns packet id -> NumPy array with the value of the packet in every good frame
+    # Bytes that are not part of a good frame are skipped like parse() does
+    def columns(self, buf):
+        frames = self.frames(buf)
+        columns = {}
+        for packet in self.packet_ids:
+            columns[packet] = frames[PACKETS[packet].name].astype(np.int32)
+        return columns
+
+    # The good frames in the buffer as a NumPy structured array (see frame_dtype)
+    def frames(self, buf):
+        data = np.frombuffer(bytes(buf), np.uint8)
+        size = self.frame_size
+        if len(data) < size:
+            return np.zeros(0, self.frame_dtype)
+
+        # Every place a frame could start: header, n-bytes, checksum and packet ids all match
+        starts = np.flatnonzero(data[:len(data) - size + 1] == STREAM_HEADER)
+        starts = starts[data[starts + 1] == self.data_size]
+        sums = np.concatenate(([0], np.cumsum(data, dtype=np.int64)))
+        starts = starts[(sums[starts + size] - sums[starts]) & BYTE == 0]
+        id_offsets = np.cumsum([2] + [1 + PACKETS[packet].size for packet in self.packet_ids[:-1]])
+        starts = starts[np.all(data[starts[:, None] + id_offsets] == self.ids, axis=1)]
+
+        # Frames can't overlap, a start inside the previous frame was data that looked like one
+        if len(starts) > 1 and np.any(np.diff(starts) < size):
+            kept = [starts[0]]
+            for start in starts[1:]:
+                if start >= kept[-1] + size:
+                    kept.append(start)
+            starts = np.array(kept)
+        rows = data[starts[:, None] + np.arange(size)]
+        return rows.view(self.frame_dtype).reshape(len(starts))
+
+    # The Stream command asking for our packets
+    def command(self):
+        return self.stream_command
+
+
+# ********************************* SENSOR STREAM *****************************************#
+#
+#  Asks the Roomba once for a list of packets and decodes the frames it sends every 15 ms
+#  on a background thread. The latest decoded values are kept in a dictionary so the
+#  control loop can read them without any serial traffic.
+#
+# ******************************************************************************************#
+class SensorStream(StreamDecoder):
+    def __init__(self, inter, packet_ids=STREAM_PACKETS):
+        StreamDecoder.__init__(self, packet_ids)
+        self.inter = inter
+        self.latest = {}
+        self.timestamp = None
+        self.frame_count = 0
+        self.running = False
+        self.thread = None
+        self.new_frame = threading.Condition()
+        # Called with (values, timestamp) for every frame, on the reader thread
+        self.listeners = []
+
+    # Send the stream command and start decoding frames
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.inter.set_timeout(STREAM_TIMEOUT)
+        self.request()
+        self.thread = threading.Thread(target=self.run, name='stream')
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Pause the stream and wait for the reader to finish
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.inter.write(PAUSE_STREAM)
+        self.thread.join()
+        self.inter.set_timeout(READ_TIMEOUT)
+        self.inter.ser.reset_input_buffer()
+
+    # Ask the Roomba to stream our packets
+    def request(self):
+        self.inter.write(self.command())
+
+    # Reader thread: keep reading whatever arrived and decode every full frame
+    # If the connection is lost and the Interface reconnects, ask for the stream again
+    def run(self):
+        buf = bytearray()
+        while self.running:
+            try:
+                data = self.inter.read(max(1, self.inter.ser.in_waiting))
+            except serial.SerialException:
+                if not self.inter.reconnect:
+                    raise
+                del buf[:]
+                self.resubscribe()
+                continue
+            if data:
+                buf += data
+                for values in self.parse(buf):
+                    self.publish(values)
+
+    # Keep trying to get the stream back on a new connection until we are stopped
+    def resubscribe(self):
+        while self.running:
+            try:
+                if not self.inter.ser.is_open:
+                    self.inter.reopen()
+                self.request()
+                return
+            except serial.SerialException:
+                time.sleep(SLEEP_EXTENDED)
+
+    # Make a decoded frame the latest one, hand it to the listeners and wake up whoever
+    # waits for it
+    def publish(self, values):
+        now = time.monotonic()
+        recorder = self.inter.recorder
+        if recorder is not None:
+            recorder.frame(values)
+        for listener in self.listeners:
+            listener(values, now)
+        with self.new_frame:
+            self.latest = values
+            self.timestamp = now
+            self.frame_count += 1
+            self.new_frame.notify_all()
+
+    # Wait for the next frame to arrive. Returns False if none came in time
+    def wait(self, timeout=STREAM_WAIT):
+        with self.new_frame:
+            count = self.frame_count
+            self.new_frame.wait_for(lambda: self.frame_count != count, timeout)
+            return self.frame_count != count
+
+    # Latest value of a packet in the stream
+    def value(self, packet):
+        if packet not in self.packet_ids:
+            raise ValueError("Packet " + str(packet) + " is not in the stream")
+        if not self.frame_count and not self.wait():
+            raise IOError("No sensor frames received from the Roomba")
+        return self.latest[packet]
+
+
+# ********************************* SNAPSHOT *********************************************#
+#
+#  The values of several sensor packets read at the same time, either from one Query List
+#  request or from one stream frame. Index it with the packet id to get the raw value.
+#  timestamp is time.monotonic() when it was read, the clock a replay (Replay.py) can run.
+#
+# ******************************************************************************************#
+class Snapshot:
+    def __init__(self, values, timestamp):
+        self.values = values
+        self.timestamp = timestamp
+
+    def __getitem__(self, packet):
+        return self.values[packet]
+
+    def __contains__(self, packet):
+        return packet in self.values
+
+    # State of a button, same names as Interface2.button
+    def button(self, buttons):
+        return bool(self.values[BUTTONS_PACKET_ID] & BUTTON_BITS[buttons.lower()])
+
+    # State of a bumper or wheel drop, same names as Interface2.bump_wheels
+    def bumper(self, bumper):
+        return bool(self.values[BUMPERS_PACKET_ID] & BUMPER_BITS[bumper.lower()])
+
+    # True if any of the cliff sensors in the snapshot sees a cliff
+    def cliff(self):
+        for packet in CLIFF_PACKETS:
+            if self.values.get(packet):
+                return True
+        return False
+
+
+# Struct of a whole stream frame: header, n-bytes, id and value of each packet, checksum
+def frame_struct(packet_ids):
+    return struct.Struct('>BB' + ''.join('B' + PACKETS[packet].code for packet in packet_ids) + 'B')
+
+
+# NumPy structured dtype of a stream frame, the fields are named after the packets
+def frame_dtype(packet_ids):
+    fields = [('header', 'u1'), ('size', 'u1')]
+    for packet in packet_ids:
+        fields.append(('id_' + str(packet), 'u1'))
+        fields.append((PACKETS[packet].name, PACKETS[packet].dtype))
+    fields.append(('checksum', 'u1'))
+    return np.dtype(fields)
+
+
+# Struct that unpacks a Query List answer for these packets. Built once per packet list
+QUERY_STRUCTS = {}
+
+
+def query_struct(packet_ids):
+    unpacker = QUERY_STRUCTS.get(packet_ids)
+    if unpacker is None:
+        fmt = '>' + ''.join(PACKET_FORMATS[packet].lstrip('>') for packet in packet_ids)
+        unpacker = QUERY_STRUCTS[packet_ids] = struct.Struct(fmt)
+    return unpacker
+
+
+# ********************************* COMMANDS *********************************************#
+#
+#  Every command is encoded straight to bytes, the way pyserial wants it on Python 3.
+#  Commands that never change (modes, sensor requests, play song, pausing the stream) are
+#  built once here. Drive commands are packed by a precompiled Struct: for 5 bytes that is
+#  faster than packing into a reused buffer, and pyserial writes bytes without copying them.
+#  Song uploads are packed into a buffer that is reused for every upload, one buffer per
+#  thread so two threads never share one.
+#
+#  MODE_COMMANDS: the opcode for each control() state
+#  SENSOR_COMMANDS: Sensors (142) request for every packet in PACKET_FORMATS
+#  PLAY_COMMANDS: Play (141) for song slots 0 to 3
+#  query_command: Query List (149) request for a list of packets, built once per list
+#
+# ******************************************************************************************#
+SONG_SLOTS = 4
+MAX_SONG_NOTES = 16
+
+MODE_COMMANDS = {'start': bytes(bytearray([START])), 'reset': bytes(bytearray([RESET])),
+                 'stop': bytes(bytearray([STOP])), 'passive': bytes(bytearray([PASSIVE])),
+                 'safe': bytes(bytearray([SAFE])), 'full': bytes(bytearray([FULL]))}
+SENSOR_COMMANDS = dict((packet, bytes(bytearray([SENSORS_OP, packet]))) for packet in PACKET_FORMATS)
+PLAY_COMMANDS = [bytes(bytearray([PLAY_SONG, slot])) for slot in range(SONG_SLOTS)]
+PAUSE_STREAM = bytes(bytearray([PAUSE_RESUME, STREAM_PAUSE]))
+DRIVE_STRUCT = struct.Struct('>B2h')
+
+QUERY_COMMANDS = {}
+
+
+def query_command(packet_ids):
+    command = QUERY_COMMANDS.get(packet_ids)
+    if command is None:
+        command = QUERY_COMMANDS[packet_ids] = bytes(bytearray([QUERY_LIST, len(packet_ids)] + list(packet_ids)))
+    return command
+
+
+class CommandEncoder:
+    def __init__(self):
+        self.local = threading.local()
+
+    # This thread's song buffer, made the first time the thread uploads a song
+    # songs[n] is the part of the buffer a song of n notes fills
+    def buffers(self):
+        local = self.local
+        if not hasattr(local, 'song'):
+            local.song = bytearray(3 + 2 * MAX_SONG_NOTES)
+            local.songs = [memoryview(local.song)[:3 + 2 * n] for n in range(MAX_SONG_NOTES + 1)]
+        return local
+
+    # Drive (137): velocity and radius
+    def drive(self, velocity, radius):
+        return DRIVE_STRUCT.pack(DRIVE, velocity, radius)
+
+    # Drive Direct (145): the two wheel velocities in the order the Roomba reads them
+    def drive_direct(self, lvelocity, rvelocity):
+        return DRIVE_STRUCT.pack(DRIVE_DIRECT, lvelocity, rvelocity)
+
+    # Song (140): notes is a flat list of note, length, note, length...
+    # Every value has to fit in a byte, a ValueError is raised otherwise
+    def song(self, slot, notes):
+        count = len(notes) // 2
+        if slot < 0 or slot >= SONG_SLOTS or count > MAX_SONG_NOTES or len(notes) % 2:
+            raise ValueError("A song is up to 16 note, length pairs in slot 0 to 3")
+        local = self.buffers()
+        buf = local.song
+        buf[0] = SONG
+        buf[1] = slot
+        buf[2] = count
+        buf[3:3 + 2 * count] = notes
+        return local.songs[count]
+
+    def play(self, slot):
+        return PLAY_COMMANDS[slot]
+
+
+# ********************************* MODE TRACKER *****************************************#
+#
+#  Keeps track of the OI mode so the drive and button helpers only send a mode opcode when
+#  the robot is not already in a mode that works for them. Driving in FULL no longer puts
+#  the robot back in SAFE. mode is None until we send a mode or read packet 35.
+#  The robot leaves SAFE by itself, so a reading that shows a cliff, a wheel drop or a
+#  charger moves the tracker to PASSIVE, and a reading of packet 35 is taken as it is.
+#  Readings from before our last mode opcode (plus one stream period) are ignored.
+#
+#  sent: mode opcodes sent
+#  avoided: mode opcodes the helpers did not need to send
+#
+# ******************************************************************************************#
+class ModeTracker:
     def __init__(self):
-        self.inter = Interface()
+        self.mode = None
+        self.changed = 0.0
+        self.sent = 0
+        self.avoided = 0
+
+    # We sent the opcode for this control() state
+    def set(self, state):
+        if state in MODE_STATES:
+            self.mode = MODE_STATES[state]
+            self.changed = time.monotonic()
+            self.sent += 1
+
+    # States to send to be in at least the required mode
+    # replaces is how many opcodes the helper used to send every time
+    def needed(self, required, replaces=1):
+        if self.mode is not None and self.mode >= required:
+            self.avoided += replaces
+            return []
+        states = []
+        if self.mode is None or self.mode == MODE_OFF:
+            states.append('start')
+        if required == MODE_SAFE:
+            states.append('safe')
+        elif required == MODE_FULL:
+            states.append('full')
+        self.avoided += max(0, replaces - len(states))
+        return states
+
+    # Sensor values (packet id -> value) read at time timestamp
+    def observe(self, values, timestamp):
+        if timestamp < self.changed + SLEEP:
+            return
+        if OI_MODE in values:
+            self.mode = values[OI_MODE]
+        elif self.mode == MODE_SAFE and self.left_safe(values):
+            self.mode = MODE_PASSIVE
+
+    @staticmethod
+    def left_safe(values):
+        if values.get(BUMPERS_PACKET_ID, 0) & (LEFT_WHEEL | RIGHT_WHEEL):
+            return True
+        if values.get(CHARGING_SOURCE_AVAILABLE):
+            return True
+        for packet in CLIFF_PACKETS:
+            if values.get(packet):
+                return True
+        return False
+
+    def stats(self):
+        return {'mode': self.mode, 'sent': self.sent, 'avoided': self.avoided}
+
+
+# ************************************ ODOMETRY ********************************************#
+#
+#  Dead reckoning from the wheel encoders (43/44), or from distance and angle (19/20) when
+#  a reading has no encoders. Every reading moves the pose by what the wheels did since
+#  the one before, so an update costs the same after a minute or an hour of driving.
+#
+#  pose: (x, y, theta) in mm and radians from where the tracker started, counter clockwise
+#  is positive. theta keeps counting past a full turn, heading() is theta in -pi..pi.
+#  pose is replaced as a whole, so any thread can read it without a lock.
+#
+#  Encoder counts are unsigned and roll over. The change between two readings is taken
+#  modulo 2^16 as a signed number, which is right both ways as long as a wheel moves
+#  less than half the range (about 7 m) between readings. The first reading only sets
+#  the reference. Distance and angle are signed and already are changes.
+#  The move is applied at the heading halfway through the turn (the chord of the arc).
+#
+#  distance: signed sum of the forward moves in mm
+#  updates: readings that moved the pose
+#
+# ******************************************************************************************#
+ODOMETRY_PACKETS = (LEFT_ENCODER, RIGHT_ENCODER)
+
+
+# A 16 bit value as the signed number it stands for
+def signed16(value):
+    value %= ENCODER_RANGE
+    return value - ENCODER_RANGE if value >= ENCODER_RANGE // 2 else value
+
+
+class Odometry:
+    def __init__(self, x=0.0, y=0.0, theta=0.0):
+        self.pose = (x, y, theta)
+        self.left = None
+        self.right = None
+        self.distance = 0.0
+        self.updates = 0
+        self.timestamp = None
+
+    # Put the robot at a new pose. The encoder reference is kept
+    def reset(self, x=0.0, y=0.0, theta=0.0):
+        self.pose = (x, y, theta)
+        self.distance = 0.0
+
+    # The robot went forward mm along the arc and turned by turn radians
+    def move(self, forward, turn):
+        x, y, theta = self.pose
+        middle = theta + turn / 2.0
+        self.pose = (x + forward * math.cos(middle), y + forward * math.sin(middle), theta + turn)
+        self.distance += forward
+        self.updates += 1
+
+    # Raw readings of packets 43 and 44
+    def update_encoders(self, left, right):
+        if self.left is None:
+            self.left, self.right = left, right
+            return
+        left_mm = signed16(left - self.left) * MM_PER_COUNT
+        right_mm = signed16(right - self.right) * MM_PER_COUNT
+        self.left, self.right = left, right
+        self.move((left_mm + right_mm) / 2.0, (right_mm - left_mm) / DIAMETER)
+
+    # Readings of packets 19 (mm) and 20 (degrees)
+    def update_distance_angle(self, distance, angle):
+        self.move(signed16(distance), math.radians(signed16(angle)))
+
+    # Sensor values (packet id -> value) read at time timestamp
+    def observe(self, values, timestamp=None):
+        if LEFT_ENCODER in values and RIGHT_ENCODER in values:
+            self.update_encoders(values[LEFT_ENCODER], values[RIGHT_ENCODER])
+        elif DISTANCE in values and ANGLE in values:
+            self.update_distance_angle(values[DISTANCE], values[ANGLE])
+        else:
+            return
+        self.timestamp = timestamp
+
+    # theta wrapped to -pi..pi
+    def heading(self):
+        return math.atan2(math.sin(self.pose[2]), math.cos(self.pose[2]))
+
+    def stats(self):
+        x, y, theta = self.pose
+        return {'x': x, 'y': y, 'theta': theta, 'distance': self.distance, 'updates': self.updates}
+
+
+# *************************************** SONGS ********************************************#
+#
+#  compile_song turns a score in LilyPond notation into the note, length pairs of the Song
+#  command (140):
+#
+#       compile_song("a'4 a' a' f'8. c''16 a'4 f'8. c''16 a'4") == IMPERIAL_MARCH
+#
+#  A note is a name (c d e f g a b) with sharps (is) or flats (es, or s after a and e), ' for
+#  each octave up and , for each octave down from the octave below middle c (c' is 60), then
+#  a length (1 2 4 8 16 32 64) with a dot for each half as long again. A note without a
+#  length takes the one before it, the first note is a quarter. r is a rest and | a bar
+#  line, which is ignored. The lengths are fractions of the measure, MEASURE by default.
+#
+#  A slot holds MAX_SONG_NOTES notes. split_song cuts a longer song into parts for up to
+#  SONG_SLOTS slots, which are played one after the other.
+#
+#  SongSlots remembers what is in each slot. load() returns only the parts that are not on
+#  the robot already, and the caller uploads those: a song that is already there costs
+#  nothing. A part that is not there goes into the slot used longest ago, never into one
+#  that the same song needs. Reset and stop (control()) forget the slots.
+#
+#  Playing a song that takes several slots plays the first part, then due() says when it
+#  should be over. Only then does the caller read Song Playing (37) and hand it to next(),
+#  which returns the Play command for the next part once the robot is quiet. Nothing waits
+#  for the song, so it can be called from a control loop every tick.
+#
+#  With ROOMBA_SONG_CACHE set to a file name, the slots are saved there for each port and a
+#  new program does not upload a song the one before it left on the robot. The robot forgets
+#  its songs when it is switched off, so after a power cycle the file is wrong: delete it.
+#
+#  uploads, skipped: parts uploaded and parts already on the robot
+#  parts_played: Play commands sent
+#
+# ******************************************************************************************#
+SONG_CACHE = os.environ.get('ROOMBA_SONG_CACHE')
+
+NOTE_STEPS = {'c': 0, 'd': 2, 'e': 4, 'f': 5, 'g': 7, 'a': 9, 'b': 11}
+NOTE_LENGTHS = (1, 2, 4, 8, 16, 32, 64)
+LOWEST_NOTE = 31
+HIGHEST_NOTE = 127
+MAX_NOTE_LENGTH = 255
+BASE_OCTAVE = 48  # c without ' or ,
+
+
+# The MIDI number of a note name with its accidentals, ' and , marks
+def note_number(name, accidentals, octaves):
+    number = BASE_OCTAVE + NOTE_STEPS[name] + 12 * (octaves.count("'") - octaves.count(","))
+    rest = accidentals
+    while rest:
+        if rest.startswith('is'):
+            number += 1
+            rest = rest[2:]
+        elif rest.startswith('es'):
+            number -= 1
+            rest = rest[2:]
+        elif rest.startswith('s') and rest == accidentals and name in 'ae':
+            number -= 1
+            rest = rest[1:]
+        else:
+            raise ValueError("Bad accidental %r on %s" % (accidentals, name))
+    return number
+
+
+# A score in LilyPond notation to a flat list of note, length pairs
+def compile_song(score, measure=MEASURE):
+    notes = []
+    length = measure // 4
+    for token in score.split():
+        if token == '|':
+            continue
+        name = token[0]
+        rest = token[1:]
+        if name != 'r' and name not in NOTE_STEPS:
+            raise ValueError("Bad note %r" % token)
+        accidentals = ''
+        while rest and rest[0] in 'ies':
+            accidentals += rest[0]
+            rest = rest[1:]
+        octaves = ''
+        while rest and rest[0] in "',":
+            octaves += rest[0]
+            rest = rest[1:]
+        dots = len(rest) - len(rest.rstrip('.'))
+        rest = rest.rstrip('.')
+        if rest:
+            if not rest.isdigit() or int(rest) not in NOTE_LENGTHS:
+                raise ValueError("Bad length in %r" % token)
+            division = int(rest)
+            length = measure * (2 ** (dots + 1) - 1) // (division * 2 ** dots)
+        elif dots:
+            raise ValueError("Dots without a length in %r" % token)
+        if not 1 <= length <= MAX_NOTE_LENGTH:
+            raise ValueError("%r is %d/64 s long, a note is 1 to %d" % (token, length, MAX_NOTE_LENGTH))
+
+        if name == 'r':
+            if accidentals or octaves:
+                raise ValueError("Bad rest %r" % token)
+            number = r
+        else:
+            number = note_number(name, accidentals, octaves)
+            if not LOWEST_NOTE <= number <= HIGHEST_NOTE:
+                raise ValueError("%r is note %d, the Roomba plays %d to %d" % (
+                    token, number, LOWEST_NOTE, HIGHEST_NOTE))
+        notes += [number, length]
+    return notes
+
+
+# Cut a flat note list into parts of at most MAX_SONG_NOTES notes, one per slot
+def split_song(notes):
+    notes = list(notes)
+    if len(notes) % 2:
+        raise ValueError("A song is note, length pairs")
+    size = 2 * MAX_SONG_NOTES
+    parts = [notes[i:i + size] for i in range(0, len(notes), size)]
+    if len(parts) > SONG_SLOTS:
+        raise ValueError("A song is at most %d notes (%d slots of %d)" % (
+            SONG_SLOTS * MAX_SONG_NOTES, SONG_SLOTS, MAX_SONG_NOTES))
+    return parts
+
+
+class SongSlots:
+    def __init__(self, port=None, path=SONG_CACHE):
+        self.port = port or PORT
+        self.path = path
+        self.slots = [None] * SONG_SLOTS
+        self.used = [0] * SONG_SLOTS
+        self.loads = 0
+        self.queue = []
+        self.current = None
+        self.ends = 0.0
+        self.uploads = 0
+        self.skipped = 0
+        self.parts_played = 0
+        self.read_cache()
+
+    # The slots saved for this port by an earlier program
+    def read_cache(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f).get(self.port)
+        except (IOError, ValueError):
+            return
+        if saved and len(saved) == SONG_SLOTS:
+            self.slots = [tuple(part) if part else None for part in saved]
+
+    def write_cache(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            cache = {}
+        cache[self.port] = [list(part) if part else None for part in self.slots]
+        with open(self.path, 'w') as f:
+            json.dump(cache, f)
+
+    # The robot lost its songs (reset, stop or a new robot)
+    def forget(self):
+        self.slots = [None] * SONG_SLOTS
+        self.queue = []
+        self.current = None
+        self.write_cache()
+
+    # Put a song (a score or note, length pairs) into slots
+    # Returns the slots of its parts in order, and the (slot, part) uploads the caller has
+    # to send. The slots count as holding their parts from now on
+    def load(self, song):
+        notes = compile_song(song) if isinstance(song, str) else song
+        parts = [tuple(part) for part in split_song(notes)]
+        slots = [None] * len(parts)
+        for index, part in enumerate(parts):
+            for slot in range(SONG_SLOTS):
+                if self.slots[slot] == part and slot not in slots:
+                    slots[index] = slot
+                    break
+        free = sorted((slot for slot in range(SONG_SLOTS) if slot not in slots),
+                      key=lambda slot: self.used[slot])
+        uploads = []
+        for index, part in enumerate(parts):
+            if slots[index] is None:
+                slots[index] = free.pop(0)
+                self.slots[slots[index]] = part
+                uploads.append((slots[index], list(part)))
+        self.loads += 1
+        for slot in slots:
+            self.used[slot] = self.loads
+        self.uploads += len(uploads)
+        self.skipped += len(parts) - len(uploads)
+        if uploads:
+            self.write_cache()
+        return slots, uploads
+
+    # Start playing the slots in order at time now, returns the Play command for the first
+    def play(self, slots, now):
+        self.queue = list(slots)
+        return self.advance(now)
+
+    def advance(self, now):
+        slot = self.current = self.queue.pop(0)
+        self.ends = now + sum(self.slots[slot][1::2]) / 64.0
+        self.parts_played += 1
+        return PLAY_COMMANDS[slot]
+
+    # The part playing should be over, time to look at Song Playing
+    def due(self, now):
+        return self.current is not None and now >= self.ends
+
+    # Song Playing (37) read at time now. Returns the Play command for the next part when
+    # the one before it has ended, None otherwise
+    def next(self, playing, now):
+        if not self.due(now) or playing:
+            return None
+        if not self.queue:
+            self.current = None
+            return None
+        return self.advance(now)
+
+    # A song is playing or still has parts to play
+    def busy(self):
+        return self.current is not None
+
+    def stats(self):
+        return {'slots': sum(1 for part in self.slots if part), 'uploads': self.uploads,
+                'skipped': self.skipped, 'parts_played': self.parts_played}
+
+
+# The metrics registry connections report to (see Metrics.py), None with ROOMBA_METRICS=0
+def metrics_registry():
+    import Metrics
+    return Metrics.registry()
+
+
+# The tracer connections add their spans to (see Trace.py), None unless ROOMBA_TRACE is set
+def active_tracer():
+    import Trace
+    return Trace.TRACER
+
+
+class Interface2:
+    def __init__(self, port=None):
+        self.port = port
+        self.stream = None
+        self.modes = ModeTracker()
+        self.encoder = CommandEncoder()
+        self.recorder = None
+        self.metrics = metrics_registry()
+        self.tracer = active_tracer()
+        self.odometry = Odometry()
+        self.songs = SongSlots(port)
+        self.open_connection()
+
+    # A new serial connection of its own, opened right away
+    def open_connection(self):
+        self.inter = Interface(self.port)
+        self.inter.metrics = self.metrics
+        self.inter.tracer = self.tracer
+
+    # Record every command, read and stream frame from now on (see Telemetry.py)
+    def record(self, recorder):
+        self.recorder = recorder
+        self.inter.recorder = recorder
+        return recorder
+
+    # Start streaming the given packets. The sensor accessors will read from the stream
+    def start_stream(self, packet_ids=STREAM_PACKETS):
+        self.stop_stream()
+        self.stream = SensorStream(self.inter, packet_ids)
+        self.stream.listeners.append(self.odometry.observe)
+        self.stream.start()
+        return self.stream
+
+    # Stop streaming and go back to requesting each packet
+    def stop_stream(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream = None
+
+    # Read a single sensor packet
+    # When streaming this is the latest decoded value and nothing is sent to the Roomba,
+    # otherwise request the packet, read it and sleep for settle seconds
+    def sensor(self, packet, settle=0):
+        if self.stream is not None:
+            return self.stream.value(packet)
+        unpacker = PACKET_STRUCTS[packet]
+        self.inter.write(SENSOR_COMMANDS[packet])
+        x = unpacker.unpack(self.inter.read(unpacker.size))[0]
+        self.modes.observe({packet: x}, time.monotonic())
+        if settle:
+            time.sleep(settle)
+        return x
+
+    # Read several sensor packets with one round trip
+    # When streaming the snapshot is the latest frame. The reader thread owns the port then,
+    # so a packet that is not in the stream is an error, as it is for sensor()
+    def query(self, *packet_ids):
+        stream = self.stream
+        if stream is not None:
+            for packet in packet_ids:
+                if packet not in stream.packet_ids:
+                    raise ValueError("Packet " + str(packet) + " is not in the stream")
+            if not stream.frame_count and not stream.wait():
+                raise IOError("No sensor frames received from the Roomba")
+            latest = stream.latest
+            return Snapshot(dict((packet, latest[packet]) for packet in packet_ids), stream.timestamp)
+
+        unpacker = query_struct(packet_ids)
+        self.inter.write(query_command(packet_ids))
+        data = unpacker.unpack(self.inter.read(unpacker.size))
+        snapshot = Snapshot(dict(zip(packet_ids, data)), time.monotonic())
+        self.modes.observe(snapshot.values, snapshot.timestamp)
+        self.odometry.observe(snapshot.values, snapshot.timestamp)
+        return snapshot
+
+    # Where the robot is, (x, y, theta) from odometry. When streaming the pose follows
+    # every frame, otherwise the encoders are queried first
+    def pose(self):
+        if self.stream is None or LEFT_ENCODER not in self.stream.packet_ids:
+            self.query(*ODOMETRY_PACKETS)
+        return self.odometry.pose
 
     # Get the state and ignore case of argument passed
     def control(self, state):
-        if state.lower() == "start":
-            self.inter.write(chr(START))
-        if state.lower() == "reset":
-            self.inter.write(chr(RESET))
-        if state.lower() == "stop":
-            self.inter.write(chr(STOP))
-        if state.lower() == "passive":
-            self.inter.write(chr(PASSIVE))
-        if state.lower() == "safe":
-            self.inter.write(chr(SAFE))
-        if state.lower() == "full":
-            self.inter.write(chr(FULL))
+        state = state.lower()
+        command = MODE_COMMANDS.get(state)
+        if command is not None:
+            self.inter.write(command)
+            self.modes.set(state)
+            # The robot forgets its songs on reset, and on stop when it leaves the OI
+            if state in ('reset', 'stop'):
+                self.songs.forget()
 
         # Sleep after setting the state
         time.sleep(SLEEP)
 
+    # Make sure the robot is in at least the required mode, send the mode opcodes only
+    # if it is not. When streaming, the mode comes from the latest frame
+    def require_mode(self, required, replaces=1):
+        stream = self.stream
+        if stream is not None and stream.frame_count and OI_MODE in stream.latest:
+            self.modes.observe(stream.latest, stream.timestamp)
+        for state in self.modes.needed(required, replaces):
+            self.control(state)
+
     # Send a request for buttons sensor packet (from Roomba documentation)
     # Read all 7 bits to get the state of the buttons
     # We sleep after sending the instruction to ensure we don't overload the Roomba
     def button(self, buttons):
-        self.control('safe')
-        self.inter.write(chr(SENSORS_OP) + chr(BUTTONS_PACKET_ID))
-        y = self.inter.read(BYTE_SIZE_BUTTON)
-        x = struct.unpack('B', y)[0]
-        time.sleep(SLEEP)
+        if self.stream is None:
+            self.require_mode(MODE_PASSIVE)
+        x = self.sensor(BUTTONS_PACKET_ID, SLEEP)
 
-        # Return the state of which button is specified
-        if buttons.lower() == 'clean':
-            clean = bool(x & CLEAN)
-            return clean
-        if buttons.lower() == 'spot':
-            spot = bool(x & SPOT)
-            return spot
-        if buttons.lower() == 'dock':
-            dock = bool(x & DOCK)
-            return dock
-        if buttons.lower() == 'minute':
-            minute = bool(x & MINUTE)
-            return minute
-        if buttons.lower() == 'hour':
-            hour = bool(x & HOUR)
-            return hour
-        if buttons.lower() == 'day':
-            day = bool(x & DAY)
-            return day
-        if buttons.lower() == 'schedule':
-            schedule = bool(x & SCHEDULE)
-            return schedule
-        if buttons.lower() == 'clock':
-            clock = bool(x & CLOCK)
-            return clock
+        # Return the state of which button is specified (the bits are in the packet registry)
+        return PACKETS[BUTTONS_PACKET_ID].flag(x, buttons)
 
     # Send a request for bumpers and wheel drops sensor packet (from Roomba documentation)
     def bump_wheels(self, bumper):
         # self.control('safe')
-        self.inter.write(chr(SENSORS_OP) + chr(BUMPERS_PACKET_ID))
-        y = self.inter.read(BYTE_SIZE_BUMPS)
-        x = struct.unpack('B', y)[0]
-        time.sleep(SLEEP)
-
-        if bumper.lower() == 'left':
-            left_bumper = bool(x & LEFT_BUMPER)
-            return left_bumper
-        if bumper.lower() == 'right':
-            right_bumper = bool(x & RIGHT_BUMPER)
-            return right_bumper
-        if bumper.lower() == 'lwheel':
-            left_wheel = bool(x & LEFT_WHEEL)
-            return left_wheel
-        if bumper.lower() == 'rwheel':
-            right_wheel = bool(x & RIGHT_WHEEL)
-            return right_wheel
+        x = self.sensor(BUMPERS_PACKET_ID, SLEEP)
+        return PACKETS[BUMPERS_PACKET_ID].flag(x, bumper)
 
     # Send a request for cliff sensors
     def cliff(self, cliff_packet):
         # self.control('safe')
-        self.inter.write(chr(SENSORS_OP) + chr(cliff_packet))
-        y = self.inter.read(BYTE_SIZE_BUTTON)
-        time.sleep(SLEEP)
-        x = struct.unpack('B', y)[0]
+        x = self.sensor(cliff_packet, SLEEP)
         return x  # 0 = no cliff 1 = cliff
 
     # Send a request for the light bump sensors
     def light_bump(self, light_packet):
-        self.inter.write(chr(SENSORS_OP) + chr(light_packet))
-        y = self.inter.read(LIGHT_BYTES)
-        x = struct.unpack('>H', y)[0]
+        x = self.sensor(light_packet)
         return x
 
+    # This method returns The distance that Roomba has traveled in millimeters
+    # since the distance it was last requested
+    def distance(self):
+        return self.sensor(DISTANCE, SLEEP)
+
+    # This method returns the angle in degrees the Roomba has turned
+    # since the angle was last requested
+    def angle(self):
+        return self.sensor(ANGLE, SLEEP)
+
+    # This method specifies the drive ability of the Roomba
+    def drive(self, velocity, radius):
+        # First set the robot to safe mode, unless it already is in safe or full
+        self.require_mode(MODE_SAFE, 2)
+        self.inter.write(self.encoder.drive(velocity, radius))
+
     def drive_direct(self, lvelocity, rvelocity):
-        # Set to safe first
-        self.control('safe')
-        self.inter.write(struct.pack('>B2h', DRIVE_DIRECT, lvelocity, rvelocity))
+        # Set to safe first, unless it already is in safe or full
+        self.require_mode(MODE_SAFE)
+        self.inter.write(self.encoder.drive_direct(lvelocity, rvelocity))
 
     def ints2str(self, lst):
         MIN_LIST = 0
@@ -409,52 +1497,130 @@ class Interface2:
         '''
         Taking a list of notes/lengths, convert it to a string
         '''
-        s = ""
         for i in lst:
             if i < MIN_LIST or i > MAX_LIST:
                 raise Exception
-            s = s + str(chr(i))
-        return s
+        return ''.join(map(chr, lst))
 
-    # Upload songs onto the robot
-    def song(self):
+    # Upload a song onto the robot: a score (see compile_song) or note, length pairs, the
+    # Imperial March by default. Parts that are in their slots already are not sent again
+    # Returns the slots the song is in
+    def song(self, song=IMPERIAL_MARCH):
         print("Sending Songs please wait.....")
-        self.inter.write(self.ints2str([SONG, SONG_ZERO, SONG_LEN_ONE,
-                                        a4, Q, a4, Q, a4, Q, f4, Ed, c5, S,
-                                        a4, Q, f4, Ed, c5, S, a4, Q]))
+        return self.upload_song(song)
 
-    def play_song(self):
+    def upload_song(self, song):
+        slots, uploads = self.songs.load(song)
+        for slot, part in uploads:
+            self.inter.write(self.encoder.song(slot, part))
+        return slots
+
+    # Play a song, uploading it first if it is not on the robot. A song in several slots
+    # plays its first part now, continue_song() plays the rest
+    def play_song(self, song=IMPERIAL_MARCH):
         print("Playing the song now")
-        # Play each song uploaded
-        self.inter.write(self.ints2str([PLAY_SONG, SONG_ZERO]))
+        slots = self.upload_song(song)
+        self.inter.write(self.songs.play(slots, time.time()))
+
+    # Play the next part of a long song once the part before it is over. Returns quickly:
+    # Song Playing is only read when a part should have ended, call it every tick
+    # While streaming without Song Playing, the length of the part is all we go by
+    # Returns True while the song is not finished
+    def continue_song(self):
+        now = time.time()
+        if self.songs.due(now):
+            stream = self.stream
+            if stream is None or SONG_PLAYING in stream.packet_ids:
+                playing = self.query(SONG_PLAYING)[SONG_PLAYING]
+            else:
+                playing = 0
+            command = self.songs.next(playing, now)
+            if command is not None:
+                self.inter.write(command)
+        return self.songs.busy()
 
     def charging_state(self):
-        self.inter.write(chr(SENSORS_OP) + chr(CHARGING_STATE))
-        y = self.inter.read(1)
-        x = struct.unpack('B', y)[0]
+        x = self.sensor(CHARGING_STATE)
         return x
 
     def charge_source_available(self):
-        self.inter.write(chr(SENSORS_OP) + chr(CHARGING_SOURCE_AVAILABLE))
-        y = self.inter.read(1)
-        x = struct.unpack('B', y)[0]
+        x = self.sensor(CHARGING_SOURCE_AVAILABLE)
         return x
 
     def ir_omni(self):
-        self.inter.write(chr(SENSORS_OP) + chr(INFRARED_PACK))
-        y = self.inter.read(1)
-        x = struct.unpack('B', y)[0]
+        x = self.sensor(INFRARED_PACK)
         return x
 
     def ir_left(self):
-        self.inter.write(chr(SENSORS_OP) + chr(INFRARED_LEFT))
-        y = self.inter.read(1)
-        x = struct.unpack('B', y)[0]
+        x = self.sensor(INFRARED_LEFT)
         return x
 
     def ir_right(self):
-        self.inter.write(chr(SENSORS_OP) + chr(INFRARED_RIGHT))
-        y = self.inter.read(1)
-        x = struct.unpack('B', y)[0]
+        x = self.sensor(INFRARED_RIGHT)
         return x
 
+
+# ********************************* ROOMBA CLIENT ******************************************#
+#
+#  Interface2() opens a new serial connection every time it is created and never closes it.
+#  The client is one long lived connection to the Roomba that every helper and thread shares.
+#  The port is opened the first time the client is used and stays open until close() is
+#  called or the with block ends. A connection that breaks is reopened (see Interface).
+#
+#  Usage:
+#       roomba = RoombaClient()
+#       roomba.control('safe')
+#
+#       with RoombaClient('/dev/ttyUSB1') as roomba:
+#           roomba.drive_direct(50, 50)
+#
+# ******************************************************************************************#
+class RoombaClient(Interface2):
+    def __init__(self, port=None):
+        self.connection = None
+        self.connect_lock = threading.Lock()
+        Interface2.__init__(self, port)
+        # ROOMBA_TELEMETRY names a log file to record the whole run to
+        if os.environ.get('ROOMBA_TELEMETRY'):
+            from Telemetry import TelemetryRecorder
+            self.recorder = TelemetryRecorder(os.environ['ROOMBA_TELEMETRY'])
+
+    # Nothing to open yet, see inter
+    def open_connection(self):
+        pass
+
+    # The serial connection, opened the first time it is needed
+    @property
+    def inter(self):
+        connection = self.connection
+        if connection is None:
+            connection = self.connect()
+        return connection
+
+    # Open the serial port if it is not open yet
+    def connect(self):
+        with self.connect_lock:
+            if self.connection is None:
+                self.connection = Interface(self.port, reconnect=True)
+                self.connection.recorder = self.recorder
+                self.connection.metrics = self.metrics
+                self.connection.tracer = self.tracer
+            return self.connection
+
+    # Stop streaming and close the serial port. The next command opens it again
+    def close(self):
+        with self.connect_lock:
+            self.stop_stream()
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            if self.recorder is not None:
+                self.recorder.flush()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,277 @@
+'''
+Logging for the control loops
+
+pd(), pid() and the Project 2 main loop printed their sensor values on every tick. A print
+to the Raspberry Pi's serial console waits until the line is out, so the prints stretched
+the loops they were in. A Logger does not write anything itself: a message is put on a
+queue as (time, level, module, format, args) and a writer thread formats the lines and
+writes them out in batches every FLUSH_INTERVAL. The queue is a collections.deque, whose
+append and popleft are atomic in CPython, so the loops never take a lock to log and
+never wait for the console.
+
+    log = Log.get('proj3v7')
+    log.debug("LIGHT_RIGHT: %s ERROR: %s", light_right, error)   # formatted by the writer
+    log.info("Dock Detected.")
+    status = log.limit(1.0)     # at most one message a second, the rest are counted
+    values = log.every(10)      # only every 10th message
+    values.debug("GAP: %s", gap)
+
+Levels are DEBUG, INFO, WARNING, ERROR and OFF, set for every module with ROOMBA_LOG and
+for single modules after it:
+
+    ROOMBA_LOG=debug python proj3v7.py                 # the per tick values too
+    ROOMBA_LOG=info,proj4v6=debug,Docking=off python proj4v6.py
+
+The default is INFO, which leaves out the per tick values. A message below the level of
+its module costs one comparison. ROOMBA_LOG_FILE=run.log writes to a file instead of
+stdout. Whatever is still queued is written out at exit.
+'''
+import atexit
+import collections
+import os
+import sys
+import threading
+import time
+
+# ************************************ LOGGING ****************************************#
+#
+#  DEBUG, INFO, WARNING, ERROR: message levels (the numbers of the logging module),
+#                               OFF turns a module off
+#  DEFAULT_LEVEL: level of the modules ROOMBA_LOG does not name
+#  FLUSH_INTERVAL: how often the writer thread writes out the queue (s)
+#  MAX_QUEUED: messages the queue holds, when the writer falls behind the oldest are
+#              dropped instead of holding up the loops
+#
+# *************************************************************************************#
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR', OFF: 'OFF'}
+LEVELS = dict((name.lower(), level) for level, name in LEVEL_NAMES.items())
+DEFAULT_LEVEL = INFO
+FLUSH_INTERVAL = 0.05
+MAX_QUEUED = 10000
+
+perf_counter = time.perf_counter
+START = perf_counter()
+
+
+# Parse ROOMBA_LOG: a default level and module=level pairs, separated by commas
+def parse(config):
+    default = DEFAULT_LEVEL
+    modules = {}
+    for part in config.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        module, _, level = part.rpartition('=')
+        if level.lower() not in LEVELS:
+            raise ValueError("Unknown log level %r, one of %s" % (level, ', '.join(sorted(LEVELS))))
+        if module:
+            modules[module] = LEVELS[level.lower()]
+        else:
+            default = LEVELS[level.lower()]
+    return default, modules
+
+
+class Writer:
+    def __init__(self, path=None, interval=FLUSH_INTERVAL, limit=MAX_QUEUED):
+        self.path = path
+        self.interval = interval
+        self.queue = collections.deque(maxlen=limit)
+        self.queued = 0
+        self.written = 0
+        self.file = None
+        self.thread = None
+        self.start_lock = threading.Lock()
+        # The writer waits on this instead of time.sleep, which a replay (Replay.py) swaps
+        # for its virtual clock
+        self.stopping = threading.Event()
+
+    def put(self, record):
+        self.queue.append(record)
+        self.queued += 1
+        if self.thread is None:
+            self.start()
+
+    def start(self):
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='log writer')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.flush()
+
+    # Format and write out everything queued so far
+    def flush(self):
+        lines = []
+        queue = self.queue
+        while queue:
+            try:
+                lines.append(format_record(queue.popleft()))
+            except IndexError:
+                break
+        if not lines:
+            return
+        out = self.output()
+        out.write('\n'.join(lines) + '\n')
+        out.flush()
+        self.written += len(lines)
+
+    def output(self):
+        if self.path is None:
+            return sys.stdout
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        return self.file
+
+    # Messages lost because the queue was full
+    def dropped(self):
+        return max(0, self.queued - self.written - len(self.queue))
+
+    # Stop the thread and write out what is left
+    def close(self):
+        self.stopping.set()
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def format_record(record):
+    timestamp, level, module, message, args = record
+    if args:
+        try:
+            message = message % args
+        except (TypeError, ValueError):
+            message = '%s %r' % (message, args)
+    return "%9.3f %-7s %s: %s" % (timestamp - START, LEVEL_NAMES.get(level, level), module, message)
+
+
+class Logger:
+    def __init__(self, module, level, writer):
+        self.module = module
+        self.level = level
+        self.writer = writer
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, message, *args):
+        if level >= self.level:
+            self.emit(level, message, args)
+
+    def debug(self, message, *args):
+        if DEBUG >= self.level:
+            self.emit(DEBUG, message, args)
+
+    def info(self, message, *args):
+        if INFO >= self.level:
+            self.emit(INFO, message, args)
+
+    def warning(self, message, *args):
+        if WARNING >= self.level:
+            self.emit(WARNING, message, args)
+
+    def error(self, message, *args):
+        if ERROR >= self.level:
+            self.emit(ERROR, message, args)
+
+    def emit(self, level, message, args):
+        self.writer.put((perf_counter(), level, self.module, message, args))
+
+    # A logger of the same module that only passes every n-th message on
+    def every(self, n):
+        return Sampled(self, n)
+
+    # A logger of the same module that passes at most one message every interval seconds
+    def limit(self, interval):
+        return RateLimited(self, interval)
+
+
+# Every n-th message of a module, the level still comes from the module
+class Sampled(Logger):
+    def __init__(self, logger, n):
+        self.logger = logger
+        self.n = n
+        self.count = 0
+
+    @property
+    def level(self):
+        return self.logger.level
+
+    def emit(self, level, message, args):
+        self.count += 1
+        if self.count >= self.n:
+            self.count = 0
+            self.logger.emit(level, message, args)
+
+
+# At most one message every interval seconds, the next one says how many were left out
+class RateLimited(Logger):
+    def __init__(self, logger, interval):
+        self.logger = logger
+        self.interval = interval
+        self.last = None
+        self.suppressed = 0
+
+    @property
+    def level(self):
+        return self.logger.level
+
+    def emit(self, level, message, args):
+        now = perf_counter()
+        if self.last is not None and now - self.last < self.interval:
+            self.suppressed += 1
+            return
+        self.last = now
+        if self.suppressed:
+            message = message + ' (%d more)' % self.suppressed
+            self.suppressed = 0
+        self.logger.emit(level, message, args)
+
+
+# ************************************ MODULES ****************************************#
+
+DEFAULT, MODULE_LEVELS = parse(os.environ.get('ROOMBA_LOG', ''))
+WRITER = Writer(os.environ.get('ROOMBA_LOG_FILE'))
+LOGGERS = {}
+
+
+# The logger of a module, made the first time it is asked for
+def get(module):
+    logger = LOGGERS.get(module)
+    if logger is None:
+        logger = LOGGERS[module] = Logger(module, MODULE_LEVELS.get(module, DEFAULT), WRITER)
+    return logger
+
+
+# Change the level of one module, or of every module not set on its own with module=None
+def set_level(level, module=None):
+    global DEFAULT
+    if isinstance(level, str):
+        level = LEVELS[level.lower()]
+    if module is not None:
+        MODULE_LEVELS[module] = level
+        get(module).level = level
+        return
+    DEFAULT = level
+    for name, logger in LOGGERS.items():
+        if name not in MODULE_LEVELS:
+            logger.level = level
+
+
+# Write out what is queued now, from the calling thread
+def flush():
+    WRITER.flush()
+
+
+atexit.register(WRITER.close)
@@ -0,0 +1,319 @@
+'''
+Where the time goes on the serial port and the locks
+
+Every RoombaClient reports its traffic to one registry in the process (REGISTRY):
+
+    requests  Sensors (142) and Query List (149) requests by packet list: round trip
+              latency from the write to the end of the read, bytes out and in, and the
+              reads that timed out (fewer bytes than asked for)
+    writes    every command by opcode: time in write() and bytes
+    stream    reads that answer no request (stream frames): count, bytes, time
+    locks     every MeteredLock by the function that took it: how often, how often it
+              had to wait, the wait and the hold times
+
+The times are kept in histograms with power of two buckets from 1 us up, so a record is a
+dictionary lookup, a bit_length() and a few additions, and nothing grows with the run.
+There is no lock around the counts: two threads adding at the same moment can lose a
+count, which is the price of leaving it on.
+
+    python proj2v4.py &
+    kill -USR1 %1                       # prints the tables to stderr
+    REGISTRY.dump()                     # the same from the program
+    REGISTRY.stats()                    # everything as a dictionary
+
+With ROOMBA_METRICS_DUMP=metrics.json the signal writes the stats to that file instead.
+ROOMBA_METRICS=0 turns it all off: RoombaClient does not report, new_lock() returns a
+plain threading.Lock.
+'''
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+from Interface import *
+import Trace
+
+# ********************************** METRICS *****************************************#
+#
+#  BUCKETS: histogram buckets, bucket 0 is below 1 us, bucket i from 2^(i-1) to 2^i us,
+#           the last one takes everything longer (about 18 minutes and up)
+#  OPCODE_NAMES: names for the report
+#
+# ***********************************************************************************#
+BUCKETS = 32
+OPCODE_NAMES = {START: 'start', RESET: 'reset', STOP: 'stop', SAFE: 'safe', FULL: 'full',
+                DRIVE: 'drive', DRIVE_DIRECT: 'drive_direct', SONG: 'song', PLAY_SONG: 'play_song',
+                SENSORS_OP: 'sensors', QUERY_LIST: 'query_list', STREAM: 'stream',
+                PAUSE_RESUME: 'pause_resume'}
+
+ENABLED = os.environ.get('ROOMBA_METRICS', '1') != '0'
+DUMP_PATH = os.environ.get('ROOMBA_METRICS_DUMP')
+
+perf_counter = time.perf_counter
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Upper edge of the bucket the p-th percentile falls in, in seconds
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << index) / 1e6, self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def stats(self):
+        return {'count': self.count, 'mean': self.mean(), 'p50': self.percentile(50),
+                'p99': self.percentile(99), 'max': self.max,
+                'buckets_us': dict(((1 << index), count) for index, count in enumerate(self.counts) if count)}
+
+
+class RequestStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.timeouts = 0
+
+
+class WriteStats:
+    def __init__(self):
+        self.time = Histogram()
+        self.bytes = 0
+
+
+class LockStats:
+    def __init__(self):
+        self.acquires = 0
+        self.contended = 0
+        self.wait = Histogram()
+        self.hold = Histogram()
+
+
+# Name of a request for the report: the opcode and the packets it asks for, with the
+# packet name when there is only one
+def request_name(command):
+    packets = list(command[2:]) if command[0] == QUERY_LIST else list(command[1:2])
+    if len(packets) == 1 and packets[0] in PACKETS:
+        packets = ['%d %s' % (packets[0], PACKETS[packets[0]].name)]
+    return OPCODE_NAMES.get(command[0], str(command[0])) + ' ' + ','.join(str(packet) for packet in packets)
+
+
+def milliseconds(seconds):
+    return '-' if seconds is None else '%.3f' % (seconds * 1000)
+
+
+class Registry:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = {}
+        self.writes = {}
+        self.stream = RequestStats()
+        self.locks = {}
+        self.sites = {}
+        self.started = time.time()
+
+    # ************************* RECORDING (called by Interface) ***********************#
+
+    def wrote(self, command, seconds):
+        opcode = command[0]
+        stats = self.writes.get(opcode)
+        if stats is None:
+            stats = self.writes[opcode] = WriteStats()
+        stats.time.add(seconds)
+        stats.bytes += len(command)
+
+    # A read answered request, seconds after it was written
+    def answered(self, request, seconds, size, timed_out):
+        stats = self.requests.get(request)
+        if stats is None:
+            stats = self.requests[request] = RequestStats()
+        stats.latency.add(seconds)
+        stats.bytes_out += len(request)
+        stats.bytes_in += size
+        if timed_out:
+            stats.timeouts += 1
+
+    def streamed(self, size, seconds):
+        self.stream.latency.add(seconds)
+        self.stream.bytes_in += size
+
+    # Stats of the lock call site in code (a code object), named module:function
+    def lock_site(self, code):
+        stats = self.locks.get(code)
+        if stats is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            self.sites[code] = module + ':' + code.co_name
+            stats = self.locks[code] = LockStats()
+        return stats
+
+    # ********************************** REPORTS **********************************#
+
+    def stats(self):
+        return {
+            'seconds': time.time() - self.started,
+            'requests': dict((request_name(request), {
+                'latency': stats.latency.stats(), 'bytes_out': stats.bytes_out,
+                'bytes_in': stats.bytes_in, 'timeouts': stats.timeouts})
+                for request, stats in list(self.requests.items())),
+            'writes': dict((OPCODE_NAMES.get(opcode, str(opcode)), {
+                'time': stats.time.stats(), 'bytes': stats.bytes})
+                for opcode, stats in list(self.writes.items())),
+            'stream': {'reads': self.stream.latency.stats(), 'bytes_in': self.stream.bytes_in},
+            'locks': dict((self.sites[code], {
+                'acquires': stats.acquires, 'contended': stats.contended,
+                'wait': stats.wait.stats(), 'hold': stats.hold.stats()})
+                for code, stats in list(self.locks.items())),
+        }
+
+    def report(self):
+        lines = ["metrics over %.1f s" % (time.time() - self.started)]
+        lines.append("%-44s %8s %9s %9s %9s %9s %9s %8s" % (
+            'request', 'count', 'p50 ms', 'p99 ms', 'max ms', 'bytes out', 'bytes in', 'timeouts'))
+        for request, stats in sorted(self.requests.items(), key=lambda item: -item[1].latency.count):
+            latency = stats.latency
+            lines.append("%-44s %8d %9s %9s %9s %9d %9d %8d" % (
+                request_name(request)[:44], latency.count, milliseconds(latency.percentile(50)),
+                milliseconds(latency.percentile(99)), milliseconds(latency.max),
+                stats.bytes_out, stats.bytes_in, stats.timeouts))
+        if self.stream.latency.count:
+            lines.append("%-44s %8d %9s %9s %9s %9s %9d" % (
+                'stream reads', self.stream.latency.count, milliseconds(self.stream.latency.percentile(50)),
+                milliseconds(self.stream.latency.percentile(99)), milliseconds(self.stream.latency.max),
+                '-', self.stream.bytes_in))
+        lines.append("%-44s %8s %9s %9s %9s %9s" % ('write', 'count', 'p50 ms', 'p99 ms', 'max ms', 'bytes'))
+        for opcode, stats in sorted(self.writes.items(), key=lambda item: -item[1].time.count):
+            lines.append("%-44s %8d %9s %9s %9s %9d" % (
+                OPCODE_NAMES.get(opcode, str(opcode)), stats.time.count, milliseconds(stats.time.percentile(50)),
+                milliseconds(stats.time.percentile(99)), milliseconds(stats.time.max), stats.bytes))
+        if self.locks:
+            lines.append("%-44s %8s %9s %9s %9s %9s %9s" % (
+                'lock', 'acquires', 'contended', 'wait p99', 'wait max', 'hold p99', 'hold max'))
+            for code, stats in sorted(self.locks.items(), key=lambda item: -item[1].wait.total):
+                lines.append("%-44s %8d %9d %9s %9s %9s %9s" % (
+                    self.sites[code][:44], stats.acquires, stats.contended,
+                    milliseconds(stats.wait.percentile(99)), milliseconds(stats.wait.max),
+                    milliseconds(stats.hold.percentile(99)), milliseconds(stats.hold.max)))
+        return '\n'.join(lines)
+
+    def dump(self, file=None):
+        file = file or sys.stderr
+        file.write(self.report() + '\n')
+        file.flush()
+
+
+REGISTRY = Registry()
+
+
+# **************************************** LOCKS *******************************************#
+#
+#  A threading.Lock that times itself. acquire()/release() and with both work, so it takes
+#  the place of the Lock() the project scripts share between their threads. The call site
+#  is the function that called acquire, found from the caller's frame.
+#  An acquire that gets the lock straight away is not counted as contended. The waits of
+#  the others are also spans of the trace when ROOMBA_TRACE is set (Trace.py).
+#
+# ******************************************************************************************#
+class MeteredLock:
+    def __init__(self, registry=None):
+        self.lock = threading.Lock()
+        self.registry = registry or REGISTRY
+        self.held = None
+        self.acquired = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        return self.take(sys._getframe(1).f_code, blocking, timeout)
+
+    def take(self, code, blocking=True, timeout=-1):
+        stats = self.registry.lock_site(code)
+        start = perf_counter()
+        got = self.lock.acquire(False)
+        contended = not got
+        if contended:
+            stats.contended += 1
+            got = self.lock.acquire(blocking, timeout)
+        if got:
+            now = perf_counter()
+            stats.acquires += 1
+            stats.wait.add(now - start)
+            self.held = stats
+            self.acquired = now
+            if contended and Trace.TRACER is not None:
+                Trace.TRACER.complete('wait ' + self.registry.sites[code], 'lock', start, now)
+        return got
+
+    def release(self):
+        held = perf_counter() - self.acquired
+        stats = self.held
+        self.lock.release()
+        stats.hold.add(held)
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.take(sys._getframe(1).f_code)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+# A lock for the threads of a project script, metered unless ROOMBA_METRICS=0
+def new_lock():
+    return MeteredLock() if ENABLED else threading.Lock()
+
+
+# The registry a new connection reports to, None when metrics are off
+def registry():
+    if not ENABLED:
+        return None
+    install()
+    return REGISTRY
+
+
+# ************************************** DUMPING *******************************************#
+
+installed = False
+
+
+def on_signal(signum, frame):
+    if DUMP_PATH:
+        with open(DUMP_PATH, 'w') as f:
+            json.dump(REGISTRY.stats(), f, indent=2)
+    else:
+        REGISTRY.dump()
+
+
+# Dump the registry on SIGUSR1. Signal handlers can only be set from the main thread,
+# anywhere else (or without SIGUSR1) this does nothing
+def install(signum=getattr(signal, 'SIGUSR1', None)):
+    global installed
+    if installed or signum is None or threading.current_thread() is not threading.main_thread():
+        return
+    signal.signal(signum, on_signal)
+    installed = True
@@ -0,0 +1,287 @@
+'''
+Closed loop turns and straight drives
+
+The old turns and straight drives worked out how long a move should take at a fixed speed
+and slept that long. Wheel slip and command latency made them miss, and nothing looked at
+the bumpers or cliffs while they slept. Motion drives to a target angle or distance with
+the odometry from Interface.py instead. Every SLEEP seconds it reads the pose together with
+the bumpers, wheel drops and cliffs. It goes at full speed until the target is close, slows
+down to SLOW_SPEED for the last part, and stops the wheels once it is there.
+
+The moves run on their own thread and give back a future straight away:
+
+    motion = Motion(roomba, lock)
+    turning = motion.turn(90)              # degrees, counter clockwise is positive
+    ...                                    # free to do something else meanwhile
+    turning.result()                       # degrees turned, or raises MotionStopped
+    motion.straight(500, 200).result()     # mm at 200 mm/s, negative goes backwards
+
+A bump, wheel drop or cliff that shows up during a move stops it, and its future raises
+MotionStopped. turning.cancel() or motion.cancel() stops the wheels where they are. A new
+move replaces the one in progress.
+
+lock is held for every request to the Roomba, pass the lock the other threads use.
+'''
+import math
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+from Interface import *
+import Trace
+
+# ********************************** MOTION ******************************************#
+#
+#  FAST_SPEED: default wheel speed (mm/s) while the target is still far
+#  APPROACH_GAIN: close to the target the wheel speed is APPROACH_GAIN times the distance
+#                 the wheels still have to go (mm/s per mm), so it slows down smoothly...
+#  SLOW_SPEED: ...but never below SLOW_SPEED, the wheels would stall
+#  ANGLE_TOLERANCE, DISTANCE_TOLERANCE: close enough to stop
+#  HEADING_GAIN: mm/s between the wheels for every degree off the heading while
+#                driving straight
+#  TIME_MARGIN: a move taking TIME_MARGIN times longer than it should at full speed (plus
+#               a second) stops with 'timeout', it is stuck on something the bumper does not feel
+#
+#  A bump, wheel drop or cliff that is already there when a move starts does not stop it,
+#  the move is usually what gets the robot away from it. Only a new one does.
+#
+# ***********************************************************************************#
+FAST_SPEED = 150
+APPROACH_GAIN = 6.0
+SLOW_SPEED = 40
+ANGLE_TOLERANCE = 0.5
+DISTANCE_TOLERANCE = 1.5
+HEADING_GAIN = 4
+TIME_MARGIN = 3.0
+
+TURN = 'turn'
+STRAIGHT = 'straight'
+
+HAZARD_BITS = {'left bump': LEFT_BUMPER, 'right bump': RIGHT_BUMPER,
+               'left wheel drop': LEFT_WHEEL, 'right wheel drop': RIGHT_WHEEL}
+
+# Read with one Query List every tick of a move
+MOTION_PACKETS = (BUMPERS_PACKET_ID,) + tuple(CLIFF_PACKETS) + ODOMETRY_PACKETS
+
+
+# Names of the bumps, wheel drops and cliffs in a sensor reading
+def hazards(values):
+    found = set()
+    bumps = values.get(BUMPERS_PACKET_ID, 0)
+    for name, bit in HAZARD_BITS.items():
+        if bumps & bit:
+            found.add(name)
+    for packet in CLIFF_PACKETS:
+        if values.get(packet):
+            found.add(PACKETS[packet].name)
+    return found
+
+
+# Wheel speeds the Roomba takes: whole mm/s between MIN_VEL and MAX_VEL
+def wheel_speeds(right, left):
+    return int(max(MIN_VEL, min(MAX_VEL, right))), int(max(MIN_VEL, min(MAX_VEL, left)))
+
+
+class MotionStopped(Exception):
+    def __init__(self, reason, progress):
+        Exception.__init__(self, "stopped by %s after %.1f" % (reason, progress))
+        self.reason = reason
+        self.progress = progress
+
+
+# The future of one move. progress is how far it got (degrees or mm) and is kept up to
+# date while it runs
+# begin() and step() are the control loop of the move without the I/O: Motion runs them
+# on its thread, the coroutines in AsyncInterface.py on the stream frames
+class Maneuver(Future):
+    def __init__(self, kind, target, speed):
+        Future.__init__(self)
+        self.kind = kind
+        self.target = target
+        self.speed = abs(speed)
+        self.progress = 0.0
+        self.ticks = 0
+        self.elapsed = 0.0
+        self.stop_reason = None
+        self.reason = None
+
+    # The pose and the sensor values the move starts from, read at time now
+    def begin(self, pose, values, now):
+        self.x0, self.y0, self.theta0 = pose
+        self.present = hazards(values)
+        if self.kind == TURN:
+            self.tolerance = ANGLE_TOLERANCE
+            path = math.radians(abs(self.target)) * TURN_RAD
+        else:
+            self.tolerance = DISTANCE_TOLERANCE
+            path = abs(self.target)
+        self.slow_speed = min(SLOW_SPEED, self.speed)
+        self.limit = TIME_MARGIN * path / self.speed + 1.0
+        self.started = now
+
+    # One tick on the pose and the sensor values read at time now
+    # Returns the right and left wheel speeds, in the order drive_direct takes them, or None
+    # when the move is over. Then the wheels have to stop and reason says why, None when
+    # it got there
+    def step(self, pose, values, now):
+        x, y, theta = pose
+        turning = self.kind == TURN
+        if turning:
+            self.progress = math.degrees(theta - self.theta0)
+        else:
+            self.progress = (x - self.x0) * math.cos(self.theta0) + (y - self.y0) * math.sin(self.theta0)
+        self.elapsed = now - self.started
+        remaining = self.target - self.progress
+
+        reason = self.stop_reason
+        if reason is None:
+            new = hazards(values) - self.present
+            if new:
+                reason = ', '.join(sorted(new))
+            elif self.elapsed > self.limit:
+                reason = 'timeout'
+        if self.done() or reason is not None or abs(remaining) <= self.tolerance:
+            self.reason = reason
+            return None
+
+        # Fast until the target is close, then slow. Going past it turns the wheels around
+        wheel_path = math.radians(remaining) * TURN_RAD if turning else remaining
+        speed = max(self.slow_speed, min(self.speed, APPROACH_GAIN * abs(wheel_path)))
+        speed = speed if remaining > 0 else -speed
+        self.ticks += 1
+        if turning:
+            return wheel_speeds(speed, -speed)
+        correction = HEADING_GAIN * math.degrees(self.theta0 - theta)
+        correction = max(-abs(speed) / 2.0, min(abs(speed) / 2.0, correction))
+        return wheel_speeds(speed + correction, speed - correction)
+
+
+class Motion:
+    def __init__(self, roomba, lock=None, period=SLEEP):
+        self.roomba = roomba
+        self.lock = lock if lock is not None else threading.Lock()
+        self.period = period
+        self.current = None
+        self.thread = None
+        self.wheel_speeds = None
+        self.moves = 0
+        self.stops = 0
+
+    # Turn angle degrees on the spot, counter clockwise is positive
+    def turn(self, angle, speed=FAST_SPEED):
+        return self.start(Maneuver(TURN, angle, speed))
+
+    # Drive distance mm along the current heading, negative goes backwards
+    def straight(self, distance, speed=FAST_SPEED):
+        return self.start(Maneuver(STRAIGHT, distance, speed))
+
+    def start(self, maneuver):
+        self.cancel()
+        self.current = maneuver
+        self.moves += 1
+        self.thread = threading.Thread(target=self.run, args=(maneuver,), name='motion')
+        self.thread.daemon = True
+        self.thread.start()
+        return maneuver
+
+    # Stop the move in progress and cancel its future
+    # Do not call it while holding the lock, the move needs it to stop the wheels
+    def cancel(self):
+        if self.current is not None:
+            self.current.cancel()
+        self.join()
+
+    # Stop the move in progress because of something seen somewhere else (a button, a
+    # sensor another thread read). Its future raises MotionStopped(reason)
+    def stop(self, reason='stopped'):
+        if self.current is not None:
+            self.current.stop_reason = reason
+        self.join()
+
+    def join(self):
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def busy(self):
+        return self.current is not None and not self.current.done()
+
+    # Any error ends the move: the wheels are stopped if the port still works and the
+    # future raises it, so whoever waits on it is not left waiting with the robot moving
+    def run(self, maneuver):
+        try:
+            with Trace.span(maneuver.kind, 'motion'):
+                self.drive(maneuver)
+        except Exception as error:
+            self.halt()
+            finish(maneuver, error=error)
+
+    # Stop the wheels after an error, which may well have been the port itself
+    def halt(self):
+        try:
+            with self.lock:
+                self.roomba.drive_direct(0, 0)
+            self.wheel_speeds = (0, 0)
+        except Exception:
+            self.wheel_speeds = None
+
+    # The control loop of one move, on absolute deadlines so a slow read does not slow it
+    # The wheels only move in SAFE or FULL, and a robot that was stopped does not answer
+    # the reads either, so the mode comes first
+    def drive(self, maneuver):
+        with self.lock:
+            self.roomba.require_mode(MODE_SAFE)
+        values = self.read()
+        maneuver.begin(self.roomba.odometry.pose, values, time.monotonic())
+        deadline = time.monotonic()
+        self.wheel_speeds = None
+
+        while True:
+            speeds = maneuver.step(self.roomba.odometry.pose, values, time.monotonic())
+            if speeds is None:
+                self.wheels(0, 0)
+                if maneuver.reason is not None:
+                    self.stops += 1
+                    finish(maneuver, error=MotionStopped(maneuver.reason, maneuver.progress))
+                else:
+                    finish(maneuver, result=maneuver.progress)
+                return
+            self.wheels(*speeds)
+
+            deadline += self.period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                with Trace.span('sleep', 'sleep'):
+                    time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+            values = self.read()
+
+    # Bumpers, wheel drops, cliffs and encoders in one request. The encoders move the pose
+    def read(self):
+        with self.lock:
+            return self.roomba.query(*MOTION_PACKETS).values
+
+    # drive_direct takes the right wheel first, the order on the wire
+    # The same speeds are only sent once
+    def wheels(self, right, left):
+        speeds = wheel_speeds(right, left)
+        if speeds == self.wheel_speeds:
+            return
+        with self.lock:
+            self.roomba.drive_direct(*speeds)
+        self.wheel_speeds = speeds
+
+    def stats(self):
+        return {'moves': self.moves, 'stops': self.stops}
+
+
+# Complete a future unless it was cancelled meanwhile
+def finish(maneuver, result=None, error=None):
+    try:
+        if error is not None:
+            maneuver.set_exception(error)
+        else:
+            maneuver.set_result(result)
+    except InvalidStateError:
+        pass
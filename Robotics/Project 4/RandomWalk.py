@@ -0,0 +1,86 @@
+'''
+What the random walk does on each tick
+
+random_walk() in Project 2 and the random_walk coroutine in AsyncInterface.py read the
+bumpers, wheel drops and cliffs every tick and ask decide() what to do with them, so both
+turn the same way. They only differ in how they talk to the Roomba:
+
+    action, angle = decide(roomba.query(*WALK_PACKETS))
+    if action == STOP:          # a wheel dropped: stop the robot, the walk is over
+        ...
+    elif action == CLIFF:       # full mode, the song, stop the wheels, then turn angle degrees
+        ...
+    elif action == BUMP:        # turn angle degrees
+        ...
+    else:                       # STRAIGHT: keep driving
+        ...
+
+The angles are in degrees, counter clockwise positive, as motion.turn() takes them.
+'''
+import random
+
+from Interface import *
+
+# ********************************** RANDOM WALK *************************************#
+#
+#  WALK_PACKETS: the bumpers, wheel drops and cliffs, read with one Query List request
+#  TURN_AROUND: a cliff turns the robot TURN_AROUND degrees, a bump TURN_AROUND plus a
+#               random LOWER_RAND_BOUND to UPPER_RAND_BOUND degrees
+#
+#  STRAIGHT: nothing there, keep driving
+#  BUMP: turn away from a bump
+#  CLIFF: turn around at a cliff
+#  STOP: a wheel dropped, the walk ends
+#
+# ***********************************************************************************#
+WALK_PACKETS = (BUMPERS_PACKET_ID, CLIFF_LEFT, CLIFF_RIGHT, CLIFF_FLEFT, CLIFF_FRIGHT)
+TURN_AROUND = 180
+
+STRAIGHT = 'straight'
+BUMP = 'bump'
+CLIFF = 'cliff'
+STOP = 'stop'
+
+
+# Randomly pick left or right
+def left_or_right():
+    random_direction = random.randint(0, 2)
+    if random_direction == 0:
+        return "counter clockwise"
+    else:
+        return "clockwise"
+
+
+# This method calculates the total angle to turn
+def angle_to_turn(turn_around=TURN_AROUND):
+    # Pick a random angle between -45 to 45 degrees
+    random_angle = random.randint(LOWER_RAND_BOUND, UPPER_RAND_BOUND)
+    # Total angle to be turned
+    tot_angle = turn_around + random_angle
+    return tot_angle
+
+
+# What to do about one snapshot of WALK_PACKETS (a stream frame has them too)
+# Returns the action and the angle to turn, 0 when there is nothing to turn
+# The 'clockwise' turns are the ones the robot always made with drive_direct(SPEED, -SPEED):
+# the right wheel forward (drive_direct takes the right wheel first), counter clockwise
+# on the odometry. The left bumper turns the same way
+def decide(snapshot, turn_around=TURN_AROUND):
+    if snapshot.bumper('lwheel') or snapshot.bumper('rwheel'):
+        return STOP, 0
+    left_bump = snapshot.bumper('left')
+    right_bump = snapshot.bumper('right')
+
+    if snapshot.cliff():
+        sign = 1 if left_or_right() == 'clockwise' else -1
+        return CLIFF, sign * turn_around
+
+    if left_bump and right_bump:
+        sign = 1 if left_or_right() == 'clockwise' else -1
+    elif left_bump:
+        sign = 1
+    elif right_bump:
+        sign = -1
+    else:
+        return STRAIGHT, 0
+    return BUMP, sign * angle_to_turn(turn_around)
@@ -0,0 +1,294 @@
+'''
+Replay a recorded run (see Telemetry.py) through the project controllers
+
+The project script is loaded with its roomba replaced by a ReplayClient. Every sensor
+request the controller sends is answered with the bytes the Roomba sent back to the same
+request in the recording, in the same order, and every command it sends is kept. Sleeps
+are skipped (the replay keeps a virtual clock), so a run replays much faster than it was
+recorded. Each answer sets the virtual clock to the time it was read in the recording, so
+controllers with timers (dock()) see the same times as in the run. When the recording runs out of answers the replay stops.
+
+At the end the Drive Direct commands the controller sent are compared one by one with the
+ones in the recording. The same code on the same recording sends the same commands, so
+this works as a regression test for a field run, and with different gains it shows what
+the new gains would have done with the same sensor readings:
+
+    python Replay.py run.log "Project 4/proj4v6.py" hug_wall --tolerance 1
+    python Replay.py run.log "Project 4/proj4v6.py" hug_wall --set kp=3.0 --set set_point=80
+
+The robot does not really move differently in a replay, the sensor readings are the
+recorded ones. Streaming runs can't be replayed, only polled sensor requests.
+'''
+import argparse
+import collections
+import contextlib
+import importlib.util
+import os
+import sys
+import time
+import numpy as np
+
+from Interface import *
+from Motion import Motion
+from SerialWorker import SerialWorker
+from Telemetry import TelemetryLog, COMMAND, READ
+
+# Behaviors that can be replayed: the module function called over and over
+BEHAVIORS = ('pd', 'pid', 'wall', 'hug_wall', 'dock')
+
+# Requests that are answered from the recording
+REQUESTS = (SENSORS_OP, QUERY_LIST)
+
+
+class ReplayFinished(Exception):
+    pass
+
+
+# ************************************ REPLAY CONNECTION ***********************************#
+#
+#  Stands in for Interface. The answers in the recording are kept per request, so a
+#  controller that sends an extra drive or mode command still gets the right readings.
+#  Every answer keeps the time it was read, seconds from the start of the recording
+#
+# ******************************************************************************************#
+class ReplayConnection:
+    def __init__(self, log):
+        self.answers = collections.defaultdict(collections.deque)
+        # Recorded Drive Direct commands with the number of requests sent before them
+        self.recorded = []
+        requests = 0
+        request = None
+        events = log.events()
+        first = events[0][1] if events else 0.0
+        for kind, when, data in events:
+            if kind == COMMAND:
+                request = None
+                if data and data[0] in REQUESTS:
+                    request = data
+                    requests += 1
+                    self.answers[request].append([when - first, bytearray()])
+                elif data and data[0] == DRIVE_DIRECT:
+                    self.recorded.append((requests, data))
+            elif kind == READ and request is not None:
+                answer = self.answers[request][-1]
+                answer[0] = when - first
+                answer[1] += data
+        # The VirtualClock that answers move, set by replay()
+        self.clock = None
+        self.answered = 0
+        self.sent = []
+        self.drives = []
+        self.pending = bytearray()
+        self.port = 'replay'
+        self.reconnect = False
+        self.recorder = None
+        self.writes = 0
+        self.reads = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.io_time = 0.0
+
+    def write(self, instr):
+        if isinstance(instr, str):
+            instr = instr.encode('latin-1')
+        data = bytes(instr)
+        self.writes += 1
+        self.bytes_written += len(data)
+        self.sent.append(data)
+        if data[0] == DRIVE_DIRECT:
+            self.drives.append((self.answered, data))
+        elif data[0] in REQUESTS:
+            answers = self.answers.get(data)
+            if not answers:
+                raise ReplayFinished()
+            when, answer = answers.popleft()
+            self.pending += answer
+            self.answered += 1
+            if self.clock is not None:
+                self.clock.at(when)
+
+    def read(self, num):
+        if len(self.pending) < num:
+            raise ReplayFinished()
+        x = bytes(self.pending[:num])
+        del self.pending[:num]
+        self.reads += 1
+        self.bytes_read += num
+        return x
+
+    def set_timeout(self, timeout):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReplayClient(RoombaClient):
+    def __init__(self, log):
+        RoombaClient.__init__(self, 'replay')
+        self.connection = ReplayConnection(log)
+
+    def connect(self):
+        return self.connection
+
+    def close(self):
+        pass
+
+
+# Skips the sleeps and counts the time they would have taken
+# Its monotonic() moves with the sleeps, so the control loops see the recorded rate, and
+# jumps to the recorded time of every answer
+class VirtualClock:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.now = self.start
+        self.slept = 0.0
+
+    def sleep(self, seconds):
+        seconds = max(0.0, seconds)
+        self.slept += seconds
+        self.now += seconds
+
+    def monotonic(self):
+        return self.now
+
+    # An answer read seconds after the start of the recording
+    def at(self, seconds):
+        self.now = self.start + seconds
+
+    # Seconds of the run replayed so far
+    def elapsed(self):
+        return self.now - self.start
+
+
+# Load a project script as a module (the folders have spaces so they can't be imported)
+def load_script(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Replay the log through module.behavior() until the recording runs out
+# settings are module globals to change first, like the gains
+def replay(log, module, behavior, settings=None, verbose=False, tolerance=0):
+    for name, value in (settings or {}).items():
+        setattr(module, name, value)
+    client = ReplayClient(log)
+    module.roomba = client
+    if hasattr(module, 'bus'):
+        module.bus = SerialWorker(client)
+    if hasattr(module, 'motion'):
+        module.motion = Motion(client, module.motion.lock)
+    # Globals the scripts set up in their main block
+    for name, value in (('charging_state_v', 0), ('clean', True), ('isMOVING', True)):
+        if not hasattr(module, name):
+            setattr(module, name, value)
+
+    clock = VirtualClock()
+    client.connection.clock = clock
+    real_sleep = time.sleep
+    real_monotonic = time.monotonic
+    outputs = []
+    start = time.perf_counter()
+    time.sleep = clock.sleep
+    time.monotonic = clock.monotonic
+    try:
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+            function = getattr(module, behavior)
+            while True:
+                outputs.append(function())
+    except ReplayFinished:
+        pass
+    finally:
+        time.sleep = real_sleep
+        time.monotonic = real_monotonic
+        if hasattr(module, 'bus'):
+            module.bus.close()
+        if hasattr(module, 'motion'):
+            module.motion.cancel()
+    elapsed = time.perf_counter() - start
+    result = compare(client.connection, len(outputs), elapsed, clock.elapsed(), tolerance)
+    result['outputs'] = outputs
+    return result
+
+
+# Compare the Drive Direct commands sent in the replay with the recorded ones
+# Only commands sent before the last answered request count, on both sides: after it the
+# recording may have been cut in the middle of a tick
+# Wheel speeds within tolerance mm/s of the recorded ones count as the same. Controllers
+# that use the measured time between ticks (the I and D terms of pid()) see a slightly
+# different dt in a replay and can round a speed the other way
+def compare(connection, ticks, elapsed, slept, tolerance=0):
+    recorded = [DRIVE_STRUCT.unpack(data[:DRIVE_STRUCT.size])[1:]
+                for requests, data in connection.recorded if requests < connection.answered]
+    emitted = [DRIVE_STRUCT.unpack(data[:DRIVE_STRUCT.size])[1:]
+               for requests, data in connection.drives if requests < connection.answered]
+    compared = min(len(recorded), len(emitted))
+    differences = [i for i in range(compared)
+                   if max(abs(recorded[i][0] - emitted[i][0]), abs(recorded[i][1] - emitted[i][1])) > tolerance]
+    largest = 0
+    for i in differences:
+        largest = max(largest, abs(recorded[i][0] - emitted[i][0]), abs(recorded[i][1] - emitted[i][1]))
+    return {
+        'ticks': ticks,
+        'recorded': len(recorded),
+        'emitted': len(emitted),
+        'different': len(differences),
+        'first_difference': differences[0] if differences else None,
+        'largest_difference': largest,
+        'replay_seconds': elapsed,
+        'virtual_seconds': slept,
+        'speedup': slept / elapsed if elapsed else 0.0,
+        'pairs': list(zip(recorded, emitted)),
+    }
+
+
+# name=value, the value is read as a number when it is one
+def setting(text):
+    name, value = text.split('=', 1)
+    for kind in (int, float):
+        try:
+            return name, kind(value)
+        except ValueError:
+            pass
+    return name, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('log', help='telemetry log recorded with ROOMBA_TELEMETRY')
+    parser.add_argument('script', help='project script, e.g. "Project 4/proj4v6.py"')
+    parser.add_argument('behavior', choices=BEHAVIORS)
+    parser.add_argument('--set', action='append', type=setting, default=[], metavar='NAME=VALUE',
+                        help='change a global of the script first (kp, kd, set_point...)')
+    parser.add_argument('--tolerance', type=int, default=0,
+                        help='wheel speed difference (mm/s) that still counts as the same')
+    parser.add_argument('--show', type=int, default=0, help='print the first N command pairs')
+    parser.add_argument('--verbose', action='store_true', help="show what the behavior prints")
+    args = parser.parse_args()
+
+    result = replay(TelemetryLog(args.log), load_script(args.script), args.behavior,
+                    dict(args.set), args.verbose, args.tolerance)
+    # pd() only computes u and pid() the wheel speeds, there are no drive commands to compare
+    if args.behavior in ('pd', 'pid'):
+        outputs = np.array(result['outputs'], dtype=float).reshape(len(result['outputs']), -1)
+        print("ticks %d" % len(outputs))
+        for column in outputs.T:
+            print("  min %d  max %d  mean %.2f" % (column.min(), column.max(), column.mean()))
+        return
+    print("ticks %d, %d recorded and %d replayed drive commands, %d different (largest by %d mm/s)" % (
+        result['ticks'], result['recorded'], result['emitted'], result['different'],
+        result['largest_difference']))
+    print("%.1f s of run replayed in %.3f s (%.0fx real time)" % (
+        result['virtual_seconds'], result['replay_seconds'], result['speedup']))
+    for recorded, emitted in result['pairs'][:args.show]:
+        print("recorded %-12s replayed %-12s %s" % (recorded, emitted, '' if recorded == emitted else '<--'))
+    if result['different'] or result['recorded'] != result['emitted']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
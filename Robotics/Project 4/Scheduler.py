@@ -0,0 +1,208 @@
+'''
+Fixed rate scheduler for the control loops
+
+The control loops used to do their serial requests and then sleep(sampling_time), so a
+tick took sampling_time plus however long the requests took, and the rate drifted with
+the load. Scheduler keeps the ticks on a fixed grid of absolute deadlines instead:
+start + n * period. A slow tick makes the next sleep shorter, not the loop slower. A tick
+that runs past a whole period skips the deadlines it missed and carries on from the grid.
+It measures the real time between ticks (dt), how late each tick starts (jitter) and the
+overruns. dt goes to the controller, so the D term is right even when a tick is late.
+
+In an existing loop, wait() takes the place of the sleep:
+
+    loop = Scheduler(sampling_time)
+    while True:
+        u = pd(loop.dt)
+        drive_direct(RSPEED, LSPEED)
+        loop.wait()
+
+or give it the tick to run, on this thread or its own:
+
+    loop.run(tick)          # calls tick(dt) every period
+    loop.start(tick)        # same on a new thread, loop.stop() ends it
+
+On Linux it can run the loop thread with the SCHED_FIFO real time policy (realtime=True,
+needs root or CAP_SYS_NICE) and pin it to one CPU (cpu=N), so other programs on the
+Raspberry Pi do not push the ticks around. ROOMBA_REALTIME=1 and ROOMBA_CPU=N do the same
+for every Scheduler of a run. When that is not allowed the loop runs as usual and policy
+says why.
+
+    python Scheduler.py 20 --seconds 5 --realtime --cpu 3    # jitter of an empty 20 Hz loop
+'''
+import argparse
+import collections
+import os
+import threading
+import time
+
+import Trace
+
+# ********************************** SCHEDULER ***************************************#
+#
+#  FIFO_PRIORITY: SCHED_FIFO priority of the loop thread (1 is the lowest, 99 the highest).
+#                 Low on purpose, the serial port and kernel threads should still win
+#  HISTORY: ticks kept for the dt and jitter statistics
+#
+#  overruns: ticks that started after their deadline because the tick before ran long
+#  missed: deadlines skipped altogether by those overruns
+#
+# ***********************************************************************************#
+FIFO_PRIORITY = 10
+HISTORY = 1000
+
+
+class Scheduler:
+    def __init__(self, period, realtime=None, cpu=None, priority=FIFO_PRIORITY, history=HISTORY):
+        if realtime is None:
+            realtime = os.environ.get('ROOMBA_REALTIME', '') not in ('', '0')
+        if cpu is None and os.environ.get('ROOMBA_CPU'):
+            cpu = int(os.environ['ROOMBA_CPU'])
+        self.period = period
+        self.realtime = realtime
+        self.cpu = cpu
+        self.priority = priority
+        self.policy = None
+        self.start_time = None
+        self.index = 0
+        self.last = None
+        self.dt = period
+        self.ticks = 0
+        self.overruns = 0
+        self.missed = 0
+        self.dts = collections.deque(maxlen=history)
+        self.jitter = collections.deque(maxlen=history)
+        self.running = False
+        self.thread = None
+
+    # Sleep until the next deadline and return the real time since the last tick
+    # period changes the rate from this tick on (the grid starts again at the last deadline)
+    # The first call only sets the grid up
+    def wait(self, period=None):
+        now = time.monotonic()
+        if self.start_time is None:
+            self.setup()
+            self.start_time = self.last = now
+            self.index = 0
+        elif period is not None and period != self.period:
+            self.start_time += self.index * self.period
+            self.index = 0
+        if period is not None:
+            self.period = period
+
+        self.index += 1
+        deadline = self.start_time + self.index * self.period
+        if now > deadline:
+            self.overruns += 1
+            skipped = int((now - deadline) / self.period)
+            self.missed += skipped
+            self.index += skipped
+            deadline = self.start_time + self.index * self.period
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            with Trace.span('sleep', 'sleep'):
+                time.sleep(delay)
+
+        now = time.monotonic()
+        self.jitter.append(now - deadline)
+        self.dt = now - self.last
+        self.last = now
+        self.dts.append(self.dt)
+        self.ticks += 1
+        return self.dt
+
+    # Call tick(dt) every period until stop() or until ticks ticks have run
+    def run(self, tick, ticks=None):
+        self.running = True
+        count = 0
+        while self.running and (ticks is None or count < ticks):
+            tick(self.dt)
+            count += 1
+            self.wait()
+        self.running = False
+
+    def start(self, tick, ticks=None):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(tick, ticks), name='scheduler')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    # Real time policy and CPU for the thread running the loop, when they were asked for
+    def setup(self):
+        done = []
+        if self.cpu is not None:
+            try:
+                os.sched_setaffinity(0, {self.cpu})
+                done.append('cpu %d' % self.cpu)
+            except (AttributeError, OSError) as error:
+                done.append('not pinned (%s)' % error)
+        if self.realtime:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+                done.append('SCHED_FIFO %d' % self.priority)
+            except (AttributeError, OSError) as error:
+                done.append('not real time (%s)' % error)
+        self.policy = ', '.join(done) or 'normal'
+
+    def stats(self):
+        dts = sorted(self.dts)
+        jitter = sorted(self.jitter)
+        if not dts:
+            return {'ticks': 0, 'period': self.period, 'policy': self.policy}
+        mean = sum(dts) / len(dts)
+        return {
+            'ticks': self.ticks,
+            'period': self.period,
+            'rate_hz': 1.0 / mean if mean else 0.0,
+            'dt_mean': mean,
+            'dt_min': dts[0],
+            'dt_max': dts[-1],
+            'dt_std': (sum((dt - mean) ** 2 for dt in dts) / len(dts)) ** 0.5,
+            'jitter_p50': percentile(jitter, 50),
+            'jitter_p99': percentile(jitter, 99),
+            'jitter_max': jitter[-1],
+            'overruns': self.overruns,
+            'missed': self.missed,
+            'policy': self.policy,
+        }
+
+
+# p-th percentile of sorted samples
+def percentile(samples, p):
+    index = int(round(p / 100.0 * (len(samples) - 1)))
+    return samples[max(0, min(len(samples) - 1, index))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('rate', type=float, help='ticks per second')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--work', type=float, default=0.0, help='busy time per tick in ms')
+    parser.add_argument('--realtime', action='store_true', help='SCHED_FIFO (Linux, root)')
+    parser.add_argument('--cpu', type=int, help='pin the loop to this CPU')
+    args = parser.parse_args()
+
+    def tick(dt):
+        end = time.perf_counter() + args.work / 1000.0
+        while time.perf_counter() < end:
+            pass
+
+    loop = Scheduler(1.0 / args.rate, args.realtime, args.cpu)
+    loop.run(tick, int(args.seconds * args.rate))
+    stats = loop.stats()
+    print("%d ticks at %.2f Hz (%s)" % (stats['ticks'], stats['rate_hz'], stats['policy']))
+    print("dt     mean %.3f ms  min %.3f  max %.3f  std %.3f" % (
+        stats['dt_mean'] * 1000, stats['dt_min'] * 1000, stats['dt_max'] * 1000, stats['dt_std'] * 1000))
+    print("jitter p50 %.3f ms  p99 %.3f  max %.3f" % (
+        stats['jitter_p50'] * 1000, stats['jitter_p99'] * 1000, stats['jitter_max'] * 1000))
+    print("overruns %d, missed deadlines %d" % (stats['overruns'], stats['missed']))
+
+
+if __name__ == '__main__':
+    main()
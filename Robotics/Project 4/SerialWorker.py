@@ -0,0 +1,153 @@
+'''
+One thread that owns the serial port
+
+Instead of every thread taking a lock around the port, threads hand their commands to the
+worker and get a future back. The worker runs them one at a time in priority order, so a
+stop or a mode change goes ahead of any sensor reads that are already waiting:
+
+    bus = SerialWorker(RoombaClient())
+    bus.submit('drive_direct', 50, 50)                  # fire and forget
+    l_bump = bus.submit('bump_wheels', 'left').result() # wait for the answer
+    bus.submit('control', 'stop')                       # jumps the queue
+
+A command that is already on the wire finishes first (a sensor read is a few ms), but
+nothing else waits behind it. A stop also cancels the wheel commands still waiting, which
+would otherwise drive the robot again after it. Every command records how long it waited
+in the queue.
+'''
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import Trace
+
+# ********************************** PRIORITIES *************************************#
+#
+#  Lower runs first. Commands with the same priority run in the order they came in
+#
+#  SAFETY: stop and mode changes
+#  DRIVE: wheel commands
+#  SENSOR: sensor reads (telemetry)
+#  BACKGROUND: songs and anything that can wait
+#
+# ***********************************************************************************#
+SAFETY = 0
+DRIVE = 1
+SENSOR = 2
+BACKGROUND = 3
+PRIORITY_NAMES = {SAFETY: 'safety', DRIVE: 'drive', SENSOR: 'sensor', BACKGROUND: 'background'}
+
+# Priority of each Interface2 method, anything else is a SENSOR read
+PRIORITIES = {'control': SAFETY, 'drive': DRIVE, 'drive_direct': DRIVE,
+              'song': BACKGROUND, 'play_song': BACKGROUND,
+              'continue_song': BACKGROUND}
+
+# Modes that stop the robot, the DRIVE commands queued before them are cancelled
+STOP_STATES = ('stop', 'reset')
+
+# Put in the queue to stop the worker, goes ahead of everything
+CLOSE = -1
+
+
+# A command waiting for the worker. It is the future the caller gets back
+# queue_wait: seconds between submit and the worker picking it up
+# service_time: seconds the worker spent running it
+class Command(Future):
+    def __init__(self, priority, method, args):
+        Future.__init__(self)
+        self.priority = priority
+        self.method = method
+        self.args = args
+        self.submitted = time.perf_counter()
+        self.queue_wait = None
+        self.service_time = None
+
+
+class SerialWorker:
+    def __init__(self, roomba):
+        self.roomba = roomba
+        self.commands = queue.PriorityQueue()
+        self.order = itertools.count()
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.running = False
+        # Per priority: [commands run, total queue wait, longest queue wait]
+        self.waits = dict((priority, [0, 0.0, 0.0]) for priority in PRIORITY_NAMES)
+
+    # The thread starts with the first command
+    def start(self):
+        with self.start_lock:
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(target=self.run, name='serial worker')
+                self.thread.daemon = True
+                self.thread.start()
+
+    # Queue a call to roomba.method(*args) and return its future
+    def submit(self, method, *args, **kwargs):
+        priority = kwargs.get('priority', PRIORITIES.get(method, SENSOR))
+        command = Command(priority, method, args)
+        if method == 'control' and args and str(args[0]).lower() in STOP_STATES:
+            self.cancel(DRIVE)
+        self.start()
+        self.commands.put((priority, next(self.order), command))
+        return command
+
+    # Cancel the commands of a priority that are still waiting. The worker skips them
+    def cancel(self, priority):
+        with self.commands.mutex:
+            waiting = [command for _, _, command in self.commands.queue
+                       if command is not None and command.priority == priority]
+        for command in waiting:
+            command.cancel()
+
+    # Stop the worker. Commands still waiting are cancelled
+    def close(self):
+        if not self.running:
+            return
+        self.running = False
+        self.commands.put((CLOSE, next(self.order), None))
+        self.thread.join()
+        while not self.commands.empty():
+            command = self.commands.get()[2]
+            if command is not None:
+                command.cancel()
+
+    def run(self):
+        while True:
+            priority, _, command = self.commands.get()
+            if command is None:
+                return
+            if not command.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            command.queue_wait = start - command.submitted
+            try:
+                with Trace.span(command.method, 'worker'):
+                    result = getattr(self.roomba, command.method)(*command.args)
+            except Exception as e:
+                command.service_time = time.perf_counter() - start
+                self.record(command)
+                command.set_exception(e)
+            else:
+                command.service_time = time.perf_counter() - start
+                self.record(command)
+                command.set_result(result)
+
+    def record(self, command):
+        waits = self.waits.setdefault(command.priority, [0, 0.0, 0.0])
+        waits[0] += 1
+        waits[1] += command.queue_wait
+        waits[2] = max(waits[2], command.queue_wait)
+
+    # Average and longest queue wait (ms) of each priority
+    def stats(self):
+        stats = {}
+        for priority, (count, total, longest) in self.waits.items():
+            if count:
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                stats[name] = {'commands': count, 'mean_wait_ms': total / count * 1000,
+                               'max_wait_ms': longest * 1000}
+        return stats
@@ -0,0 +1,581 @@
+'''
+Roomba Open Interface simulator
+
+Opens a pseudo-terminal that behaves like an iCreate2 on the other end of the serial cable,
+so every project can run without the robot:
+
+    python Simulator.py
+    Roomba simulator listening on /dev/pts/3
+    ROOMBA_PORT=/dev/pts/3 python proj4v6.py
+
+Or from python:
+
+    with RoombaSimulator() as sim:
+        Interface.PORT = sim.port
+        ...
+'''
+import math
+import os
+import struct
+import threading
+import time
+import tty
+
+from Interface import *
+
+# ********************************** WIRE TIMING *************************************#
+#
+#  Every byte on the wire is 10 bits (start bit, 8 data bits, stop bit), so at BAUDRATE
+#  a byte takes 10 / BAUDRATE seconds. Answers are held back for that long.
+#  The sensors are recomputed every 15 ms like on the real Roomba (TICK)
+#
+# *************************************************************************************#
+BYTE_TIME = 10.0 / BAUDRATE
+TICK = 0.015
+
+# Number of data bytes after each opcode. Songs, streams and query lists are sized by
+# their own length byte. Opcodes we do not know are skipped one byte at a time
+COMMAND_ARGS = {START: 0, RESET: 0, STOP: 0, SAFE: 0, FULL: 0, 133: 0, 135: 0, 136: 0, 143: 0,
+                129: 1, 138: 1, 139: 3, 144: 3, 146: 4, 147: 1, 163: 4, 164: 4, 165: 1,
+                DRIVE: 4, DRIVE_DIRECT: 4, PLAY_SONG: 1, SENSORS_OP: 1, PAUSE_RESUME: 1}
+
+# ********************************** THE ROBOT ***************************************#
+#
+#  Create 2 body and sensor geometry, in millimeters and degrees from the heading
+#  (counter clockwise is positive)
+#  A wall closer than BUMP_TRAVEL to the front of the robot presses the bumper
+#
+#  The light bumpers (LIGHT_SENSORS in Interface.py) follow LIGHT_MAX * e^(-d / LIGHT_FALLOFF)
+#  up to LIGHT_RANGE mm from the wall and read 0 further away
+#
+# *************************************************************************************#
+BUMP_TRAVEL = 5
+CLIFF_SENSORS = {CLIFF_LEFT: (70, 150), CLIFF_FLEFT: (20, 160),
+                 CLIFF_FRIGHT: (-20, 160), CLIFF_RIGHT: (-70, 150)}
+LIGHT_RANGE = 400
+WALL_RANGE = 30
+
+# ********************************** THE DOCK ****************************************#
+#
+#  The dock sends a red beam to its right, a green beam to its left (looking out of the
+#  dock) and a short force field in front of it. The beams overlap a little in the
+#  middle so driving straight in sees both (RED_GREEN).
+#  Each infrared receiver only sees the dock inside its field of view
+#
+# *************************************************************************************#
+IR_BASE = 160
+IR_RED = 8
+IR_GREEN = 4
+IR_FIELD = 1
+BEAM_RANGE = 2500
+BEAM_ANGLE = 70
+BEAM_OVERLAP = 40
+FIELD_RANGE = 600
+IR_RECEIVERS = {INFRARED_PACK: (0, 360), INFRARED_LEFT: (20, 100), INFRARED_RIGHT: (-20, 100)}
+DOCK_CONTACT = 60
+DOCK_ALIGN = 30
+CHARGING = 2
+HOME_BASE = 2
+
+
+# Closest point to p on the segment a-b
+def closest_point(p, a, b):
+    ax, ay = a
+    dx, dy = b[0] - ax, b[1] - ay
+    length = dx * dx + dy * dy
+    t = 0.0
+    if length:
+        t = max(0.0, min(1.0, ((p[0] - ax) * dx + (p[1] - ay) * dy) / length))
+    return ax + t * dx, ay + t * dy
+
+
+# Distance along the ray (origin, direction) to the segment a-b, None if it misses
+def ray_hit(origin, direction, a, b):
+    ox, oy = origin
+    rx, ry = direction
+    sx, sy = b[0] - a[0], b[1] - a[1]
+    denom = rx * sy - ry * sx
+    if abs(denom) < 1e-9:
+        return None
+    qx, qy = a[0] - ox, a[1] - oy
+    t = (qx * sy - qy * sx) / denom
+    u = (qx * ry - qy * rx) / denom
+    if t >= 0 and 0 <= u <= 1:
+        return t
+    return None
+
+
+def wrap_angle(angle):
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+COVER_CELL = 25
+COVER_REACH = int(ROBOT_RADIUS // COVER_CELL)
+COVER_DISK = [(i, j) for i in range(-COVER_REACH, COVER_REACH + 1)
+              for j in range(-COVER_REACH, COVER_REACH + 1)
+              if math.hypot(i, j) * COVER_CELL <= ROBOT_RADIUS]
+
+
+# ************************************ WORLD *******************************************#
+#
+#  A differential drive robot in a room made of wall segments, with rectangular cliffs
+#  (stairs) and a dock. Distances are in millimeters, the heading in radians.
+#
+#  step(dt) moves the robot with the current wheel speeds, stopping it at walls,
+#  and sensors() gives the value of every sensor packet at the current position.
+#
+#  covered_area() is the floor area (m^2) the body of the robot has been over. The floor
+#  is split into COVER_CELL mm squares, marked every half cell the robot moves
+#
+#  The default world is a 3m x 3m room with a drop off in one corner and the dock in the
+#  middle of the north wall.
+#
+# ***************************************************************************************#
+class World:
+    def __init__(self, walls=None, cliffs=None, dock=None, pose=(1500.0, 1000.0, 0.0)):
+        if walls is None:
+            walls = [((0, 0), (3000, 0)), ((3000, 0), (3000, 3000)),
+                     ((3000, 3000), (0, 3000)), ((0, 3000), (0, 0))]
+        if cliffs is None:
+            cliffs = [(0, 0, 600, 400)]
+        if dock is None:
+            dock = (1500.0, 3000.0, -math.pi / 2)
+        self.walls = walls
+        self.cliffs = cliffs
+        self.dock = dock
+        self.x, self.y, self.theta = pose
+        self.left_velocity = 0
+        self.right_velocity = 0
+        self.wheel_drop = False
+        self.bump_left = False
+        self.bump_right = False
+        self.distance = 0.0
+        self.angle = 0.0
+        self.left_counts = 0.0
+        self.right_counts = 0.0
+        self.buttons = 0
+        self.time = 0.0
+        self.covered = set()
+        self.covered_at = None
+
+    def set_wheels(self, left_velocity, right_velocity):
+        self.left_velocity = max(MIN_VEL, min(MAX_VEL, left_velocity))
+        self.right_velocity = max(MIN_VEL, min(MAX_VEL, right_velocity))
+
+    def in_cliff(self, x, y):
+        for x1, y1, x2, y2 in self.cliffs:
+            if x1 <= x <= x2 and y1 <= y <= y2:
+                return True
+        return False
+
+    # Point at a distance and bearing (degrees) from the center of the robot
+    def body_point(self, bearing, distance):
+        angle = self.theta + math.radians(bearing)
+        return self.x + distance * math.cos(angle), self.y + distance * math.sin(angle)
+
+    # Move the robot for dt seconds. Walls stop it, a wheel drop stops it for good
+    def step(self, dt):
+        self.time += dt
+        if self.wheel_drop:
+            return
+        left = self.left_velocity * dt
+        right = self.right_velocity * dt
+        forward = (left + right) / 2.0
+        turn = (right - left) / DIAMETER
+
+        theta = self.theta + turn / 2.0
+        x = self.x + forward * math.cos(theta)
+        y = self.y + forward * math.sin(theta)
+        if not self.blocked(x, y):
+            self.x, self.y = x, y
+            self.distance += forward
+        self.theta = wrap_angle(self.theta + turn)
+        self.angle += math.degrees(turn)
+        self.left_counts += left / MM_PER_COUNT
+        self.right_counts += right / MM_PER_COUNT
+        self.update_bumpers()
+        self.cover()
+
+        if self.in_cliff(self.x, self.y):
+            self.wheel_drop = True
+
+    # Mark the floor under the robot
+    def cover(self):
+        if self.covered_at is not None and math.hypot(self.x - self.covered_at[0],
+                                                      self.y - self.covered_at[1]) < COVER_CELL / 2.0:
+            return
+        self.covered_at = (self.x, self.y)
+        cx, cy = int(self.x // COVER_CELL), int(self.y // COVER_CELL)
+        for i, j in COVER_DISK:
+            self.covered.add((cx + i, cy + j))
+
+    def covered_area(self):
+        return len(self.covered) * COVER_CELL ** 2 / 1e6
+
+    # The robot cannot get closer than its radius to a wall, but can always back away
+    def blocked(self, x, y):
+        for a, b in self.walls:
+            px, py = closest_point((x, y), a, b)
+            new = math.hypot(x - px, y - py)
+            if new < ROBOT_RADIUS:
+                px, py = closest_point((self.x, self.y), a, b)
+                if new < math.hypot(self.x - px, self.y - py):
+                    return True
+        return False
+
+    # A wall touching the front half of the robot presses the bumper on that side,
+    # a wall straight ahead presses both
+    def update_bumpers(self):
+        self.bump_left = False
+        self.bump_right = False
+        for a, b in self.walls:
+            px, py = closest_point((self.x, self.y), a, b)
+            if math.hypot(px - self.x, py - self.y) > ROBOT_RADIUS + BUMP_TRAVEL:
+                continue
+            bearing = math.degrees(wrap_angle(math.atan2(py - self.y, px - self.x) - self.theta))
+            if abs(bearing) < 90:
+                if bearing > -15:
+                    self.bump_left = True
+                if bearing < 15:
+                    self.bump_right = True
+
+    # Light bumper signal for the sensor looking out at bearing degrees
+    def light(self, bearing):
+        origin = self.body_point(bearing, ROBOT_RADIUS)
+        angle = self.theta + math.radians(bearing)
+        direction = (math.cos(angle), math.sin(angle))
+        nearest = LIGHT_RANGE
+        for a, b in self.walls:
+            hit = ray_hit(origin, direction, a, b)
+            if hit is not None and hit < nearest:
+                nearest = hit
+        if nearest >= LIGHT_RANGE:
+            return 0
+        return int(LIGHT_MAX * math.exp(-nearest / LIGHT_FALLOFF))
+
+    # Position of the robot seen from the dock: forward distance, sideways (left) distance
+    def dock_frame(self):
+        dx, dy, facing = self.dock
+        rx, ry = self.x - dx, self.y - dy
+        forward = rx * math.cos(facing) + ry * math.sin(facing)
+        left = -rx * math.sin(facing) + ry * math.cos(facing)
+        return forward, left
+
+    # Infrared character seen by a receiver looking out at bearing with a field of view fov
+    def infrared(self, bearing, fov):
+        dx, dy, facing = self.dock
+        to_dock = math.atan2(dy - self.y, dx - self.x)
+        off_axis = math.degrees(wrap_angle(to_dock - self.theta - math.radians(bearing)))
+        if abs(off_axis) > fov / 2.0:
+            return 0
+
+        forward, left = self.dock_frame()
+        distance = math.hypot(forward, left)
+        code = 0
+        if forward > 0 and distance < BEAM_RANGE and \
+                math.degrees(math.atan2(abs(left), forward)) < BEAM_ANGLE:
+            if left < BEAM_OVERLAP:
+                code |= IR_RED
+            if left > -BEAM_OVERLAP:
+                code |= IR_GREEN
+        if forward > 0 and distance < FIELD_RANGE:
+            code |= IR_FIELD
+        if code:
+            code |= IR_BASE
+        return code
+
+    # The robot charges when it sits on the dock contacts facing the dock
+    def on_dock(self):
+        dx, dy, facing = self.dock
+        cx = dx + ROBOT_RADIUS * math.cos(facing)
+        cy = dy + ROBOT_RADIUS * math.sin(facing)
+        if math.hypot(self.x - cx, self.y - cy) > DOCK_CONTACT:
+            return False
+        heading = math.degrees(wrap_angle(self.theta - facing - math.pi))
+        return abs(heading) < DOCK_ALIGN
+
+    def cliff_sensor(self, packet):
+        bearing, distance = CLIFF_SENSORS[packet]
+        return int(self.in_cliff(*self.body_point(bearing, distance)))
+
+    # Value of every packet the Roomba can be asked for.
+    # Distance and angle are reset every time they are read, like the real Roomba
+    def sensors(self):
+        bumps = 0
+        if self.bump_right:
+            bumps |= RIGHT_BUMPER
+        if self.bump_left:
+            bumps |= LEFT_BUMPER
+        if self.wheel_drop:
+            bumps |= RIGHT_WHEEL | LEFT_WHEEL
+        charging = self.on_dock()
+
+        values = {
+            BUMPERS_PACKET_ID: bumps,
+            WALL: int(self.light(LIGHT_SENSORS[LIGHT_RIGHT]) > LIGHT_MAX * math.exp(-WALL_RANGE / LIGHT_FALLOFF)),
+            V_WALL: 0,
+            BUTTONS_PACKET_ID: self.buttons,
+            DISTANCE: 0,
+            ANGLE: 0,
+            CHARGING_STATE: CHARGING if charging else 0,
+            CHARGING_SOURCE_AVAILABLE: HOME_BASE if charging else 0,
+            VEL_ID: int(self.right_velocity),
+            LEFT_ENCODER: int(self.left_counts) % ENCODER_RANGE,
+            RIGHT_ENCODER: int(self.right_counts) % ENCODER_RANGE,
+        }
+        for packet in CLIFF_SENSORS:
+            values[packet] = self.cliff_sensor(packet)
+        for packet, bearing in LIGHT_SENSORS.items():
+            values[packet] = self.light(bearing)
+        for packet, (bearing, fov) in IR_RECEIVERS.items():
+            values[packet] = self.infrared(bearing, fov)
+        return values
+
+    # Take the distance and angle travelled since they were last read
+    def take_odometry(self):
+        distance = max(-32768, min(32767, int(self.distance)))
+        angle = max(-32768, min(32767, int(self.angle)))
+        self.distance -= distance
+        self.angle -= angle
+        return distance, angle
+
+    def cliff_or_drop(self, values):
+        return self.wheel_drop or any(values[packet] for packet in CLIFF_SENSORS)
+
+
+# ************************************ SIMULATOR *****************************************#
+#
+#  Speaks the part of the Open Interface the projects use over a pseudo-terminal:
+#       128/131/132/173/7 modes, 137 drive, 145 drive direct, 140/141 songs,
+#       142 sensors, 148 stream, 149 query list, 150 pause/resume stream
+#
+#  A tick thread moves the world every 15 ms and sends the stream frames.
+#  A reader thread decodes the commands. Answers go out at the speed of the serial line.
+#
+#  press(button, seconds) holds a button down, lift() drops the wheels
+#
+# ******************************************************************************************#
+class RoombaSimulator:
+    def __init__(self, world=None):
+        self.world = world or World()
+        self.mode = MODE_OFF
+        self.songs = {}
+        self.song_end = 0.0
+        self.stream_packets = []
+        self.streaming = False
+        self.values = self.world.sensors()
+        self.buttons_until = {}
+        self.commands = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.running = False
+        self.master = None
+        self.slave = None
+        self.port = None
+
+    # Open the pseudo-terminal and start the Roomba
+    def start(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        for target in (self.tick_loop, self.read_loop):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    # Hold a button down for a number of seconds
+    def press(self, button, seconds=0.1):
+        with self.lock:
+            self.buttons_until[BUTTON_BITS[button.lower()]] = self.world.time + seconds
+
+    # Pick the robot up: both wheel drops trigger
+    def lift(self):
+        with self.lock:
+            self.world.wheel_drop = True
+
+    def song_playing(self):
+        return self.world.time < self.song_end
+
+    # Send bytes to the client, taking as long as the serial line would
+    def send(self, data):
+        with self.write_lock:
+            time.sleep(len(data) * BYTE_TIME)
+            try:
+                os.write(self.master, data)
+            except OSError:
+                return
+            self.bytes_out += len(data)
+
+    # Every 15 ms: move the robot, refresh the sensors and send a stream frame
+    def tick_loop(self):
+        deadline = time.time()
+        while self.running:
+            deadline += TICK
+            with self.lock:
+                self.tick()
+                frame = self.frame() if self.streaming and self.stream_packets else None
+            if frame is not None:
+                self.send(frame)
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.time()
+
+    def tick(self):
+        world = self.world
+        world.step(TICK)
+        buttons = 0
+        for bit, until in self.buttons_until.items():
+            if world.time < until:
+                buttons |= bit
+        world.buttons = buttons
+        self.values = world.sensors()
+        if self.mode == MODE_SAFE and (world.cliff_or_drop(self.values)
+                                       or self.values[CHARGING_SOURCE_AVAILABLE]):
+            world.set_wheels(0, 0)
+            self.mode = MODE_PASSIVE
+
+    # Value of a packet right now. Distance and angle are reset once read
+    def packet(self, packet):
+        if packet == OI_MODE:
+            return self.mode
+        if packet in (DISTANCE, ANGLE):
+            distance, angle = self.world.take_odometry()
+            if packet == DISTANCE:
+                self.world.angle += angle
+                return distance
+            self.world.distance += distance
+            return angle
+        return self.values.get(packet, 0)
+
+    def packet_bytes(self, packet):
+        return PACKET_STRUCTS[packet].pack(self.packet(packet))
+
+    # | 19 | n-bytes | id | data | ... | checksum |
+    def frame(self):
+        body = bytearray()
+        for packet in self.stream_packets:
+            body.append(packet)
+            body += self.packet_bytes(packet)
+        frame = bytearray([STREAM_HEADER, len(body)]) + body
+        frame.append(-sum(frame) & BYTE)
+        return bytes(frame)
+
+    def read_loop(self):
+        buf = bytearray()
+        while self.running:
+            try:
+                data = os.read(self.master, 256)
+            except OSError:
+                return
+            self.bytes_in += len(data)
+            buf += data
+            while buf:
+                size = self.command_size(buf)
+                if size is None or len(buf) < size:
+                    break
+                command = bytes(buf[:size])
+                del buf[:size]
+                self.commands += 1
+                self.execute(command)
+
+    # Length of the command at the start of buf, None if we need more bytes to tell
+    def command_size(self, buf):
+        opcode = buf[0]
+        if opcode in (STREAM, QUERY_LIST):
+            return 2 + buf[1] if len(buf) > 1 else None
+        if opcode == SONG:
+            return 3 + 2 * buf[2] if len(buf) > 2 else None
+        return 1 + COMMAND_ARGS.get(opcode, 0)
+
+    def execute(self, command):
+        opcode = command[0]
+        answer = None
+        with self.lock:
+            world = self.world
+            if opcode == START:
+                self.mode = MODE_PASSIVE
+            elif opcode in (STOP, RESET):
+                self.mode = MODE_OFF
+                self.streaming = False
+                world.set_wheels(0, 0)
+            elif self.mode == MODE_OFF:
+                return
+            elif opcode == SAFE:
+                self.mode = MODE_SAFE
+            elif opcode == FULL:
+                self.mode = MODE_FULL
+            elif opcode == DRIVE_DIRECT:
+                right, left = struct.unpack('>hh', command[1:])
+                if self.mode >= MODE_SAFE:
+                    world.set_wheels(left, right)
+            elif opcode == DRIVE:
+                velocity, radius = struct.unpack('>hh', command[1:])
+                if self.mode >= MODE_SAFE:
+                    world.set_wheels(*self.drive_wheels(velocity, radius))
+            elif opcode == SONG:
+                self.songs[command[1]] = list(zip(command[3::2], command[4::2]))
+            elif opcode == PLAY_SONG:
+                notes = self.songs.get(command[1])
+                if notes and self.mode >= MODE_PASSIVE and not self.song_playing():
+                    self.song_end = world.time + sum(length for _, length in notes) / 64.0
+            elif opcode == SENSORS_OP:
+                if command[1] in PACKET_STRUCTS:
+                    answer = self.packet_bytes(command[1])
+            elif opcode == QUERY_LIST:
+                answer = b''.join(self.packet_bytes(packet) for packet in command[2:]
+                                  if packet in PACKET_STRUCTS)
+            elif opcode == STREAM:
+                self.stream_packets = [packet for packet in command[2:] if packet in PACKET_STRUCTS]
+                self.streaming = True
+            elif opcode == PAUSE_RESUME:
+                self.streaming = bool(command[1])
+        if answer:
+            self.send(answer)
+
+    # Wheel speeds for a Drive command. The projects drive straight with a radius of 0,
+    # the simulator treats that like the special straight radius
+    @staticmethod
+    def drive_wheels(velocity, radius):
+        if radius in (0, 32767, -32768) or abs(radius) > MAX_RAD:
+            return velocity, velocity
+        if radius == 1:
+            return -velocity, velocity
+        if radius == -1:
+            return velocity, -velocity
+        half = DIAMETER / 2.0
+        return velocity * (radius - half) / radius, velocity * (radius + half) / radius
+
+
+if __name__ == '__main__':
+    simulator = RoombaSimulator().start()
+    print("Roomba simulator listening on " + simulator.port)
+    print("Run a project with ROOMBA_PORT=" + simulator.port)
+    try:
+        while True:
+            time.sleep(1)
+            world = simulator.world
+            print("x %7.1f  y %7.1f  heading %6.1f  mode %d" %
+                  (world.x, world.y, math.degrees(world.theta), simulator.mode))
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -0,0 +1,227 @@
+'''
+Binary telemetry log of a Roomba run
+
+TelemetryRecorder appends every command written to the Roomba, every chunk of bytes read
+back and every decoded stream frame to a file of fixed size records, each with a
+time.monotonic() timestamp. The file is a memory mapped ring buffer: once it is full the
+oldest records are overwritten. Appending is a couple of struct.pack_into calls into the
+mapping, there is no lock, no write() call and no buffer to grow, so the stream thread
+and the control threads can record at 67 Hz without waiting on anything:
+
+    roomba = RoombaClient()
+    roomba.record(TelemetryRecorder('run.log'))
+
+or set ROOMBA_TELEMETRY=run.log and every RoombaClient records to it.
+
+TelemetryLog reads a log back as NumPy arrays:
+
+    log = TelemetryLog('run.log')
+    frames = log.frames()            # {'time': ..., 7: ..., 51: ...}
+    drives = log.drive_commands()    # time, opcode, first and second velocity
+    python Telemetry.py run.log      # summary of a log
+'''
+import itertools
+import mmap
+import struct
+import sys
+import time
+
+from Interface import *
+
+# ********************************** LOG FORMAT **************************************#
+#
+#  Header (HEADER_SIZE bytes): magic, version, number of frame packets, record size,
+#  capacity, records written, wall clock and monotonic time at the start, then the
+#  ids of the packets stored in every frame record
+#
+#  Record (RECORD_SIZE bytes): kind, flags, length, sequence number, timestamp and
+#  PAYLOAD bytes of payload
+#    COMMAND: bytes written to the Roomba
+#    READ: bytes read from the Roomba
+#    FRAME: the value of every frame packet as a little endian int32
+#  Commands and reads longer than the payload go on in the next records (CONTINUED)
+#  MAX_FRAME_PACKETS: packets a frame record holds, as many int32 as fit in the payload
+#
+# ***********************************************************************************#
+MAGIC = b'ROOMBLOG'
+VERSION = 1
+HEADER = struct.Struct('<8sHHIIQdd')
+HEADER_SIZE = 128
+RECORD_HEAD = struct.Struct('<BBHId')
+PAYLOAD = 96
+RECORD_SIZE = RECORD_HEAD.size + PAYLOAD
+MAX_FRAME_PACKETS = min(PAYLOAD // 4, HEADER_SIZE - HEADER.size)
+CAPACITY = 1 << 16  # records, about 5 minutes of a streaming control loop
+
+COMMAND = 1
+READ = 2
+FRAME = 3
+KIND_NAMES = {COMMAND: 'command', READ: 'read', FRAME: 'frame'}
+CONTINUED = 0x01
+
+WRITTEN = struct.Struct('<Q')
+WRITTEN_OFFSET = 20  # where HEADER keeps the records written
+
+RECORD_DTYPE = np.dtype([('kind', 'u1'), ('flags', 'u1'), ('length', '<u2'), ('sequence', '<u4'),
+                         ('time', '<f8'), ('payload', 'u1', (PAYLOAD,))])
+
+
+class TelemetryRecorder:
+    def __init__(self, path, packet_ids=STREAM_PACKETS, capacity=CAPACITY):
+        self.path = path
+        self.packet_ids = list(packet_ids)
+        if len(self.packet_ids) > MAX_FRAME_PACKETS:
+            raise ValueError("Too many packets for a frame record: %d, at most %d"
+                             % (len(self.packet_ids), MAX_FRAME_PACKETS))
+        self.capacity = capacity
+        self.sequence = itertools.count()
+        self.frame_struct = struct.Struct('<BBHId%di' % len(self.packet_ids))
+        self.zeros = [0] * len(self.packet_ids)
+
+        size = HEADER_SIZE + capacity * RECORD_SIZE
+        self.file = open(path, 'w+b')
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        # Touch every page now, so no append has to wait for the file system to find one
+        chunk = bytes(mmap.PAGESIZE * 256)
+        for offset in range(0, size, len(chunk)):
+            self.map[offset:offset + len(chunk)] = chunk[:size - offset]
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, len(self.packet_ids), RECORD_SIZE,
+                         capacity, 0, time.time(), time.monotonic())
+        self.map[HEADER.size:HEADER.size + len(self.packet_ids)] = bytes(bytearray(self.packet_ids))
+
+    # Claim the next record. next() on a count is atomic, so threads never get the same one
+    def claim(self):
+        sequence = next(self.sequence)
+        WRITTEN.pack_into(self.map, WRITTEN_OFFSET, sequence + 1)
+        return sequence, HEADER_SIZE + (sequence % self.capacity) * RECORD_SIZE
+
+    def append(self, kind, data):
+        now = time.monotonic()
+        length = len(data)
+        start = 0
+        flags = 0
+        while True:
+            used = min(PAYLOAD, length - start)
+            sequence, offset = self.claim()
+            RECORD_HEAD.pack_into(self.map, offset, kind, flags, used, sequence, now)
+            offset += RECORD_HEAD.size
+            self.map[offset:offset + used] = data[start:start + used]
+            start += used
+            flags = CONTINUED
+            if start >= length:
+                return
+
+    # Bytes written to the Roomba
+    def command(self, data):
+        self.append(COMMAND, data)
+
+    # Bytes read from the Roomba
+    def read(self, data):
+        if data:
+            self.append(READ, data)
+
+    # A decoded stream frame (packet id -> value)
+    def frame(self, values):
+        sequence, offset = self.claim()
+        self.frame_struct.pack_into(self.map, offset, FRAME, 0, len(self.packet_ids), sequence,
+                                    time.monotonic(), *map(values.get, self.packet_ids, self.zeros))
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        if self.map is None:
+            return
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+        self.map = None
+
+
+class TelemetryLog:
+    def __init__(self, path):
+        data = np.fromfile(path, np.uint8)
+        (magic, version, count, record_size, capacity, written,
+         self.wall_start, self.start) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            raise ValueError(path + " is not a Roomba telemetry log")
+        self.packet_ids = [int(packet) for packet in data[HEADER.size:HEADER.size + count]]
+        self.written = written
+        self.capacity = capacity
+        records = np.frombuffer(data, RECORD_DTYPE, capacity, HEADER_SIZE)
+        records = records[records['kind'] != 0]
+        self.records = records[np.argsort(records['sequence'], kind='stable')]
+        self.dropped = max(0, written - capacity)
+
+    def __len__(self):
+        return len(self.records)
+
+    def of_kind(self, kind):
+        return self.records[self.records['kind'] == kind]
+
+    # Every frame as columns: 'time' and one int array per packet id
+    def frames(self):
+        frames = self.of_kind(FRAME)
+        count = len(self.packet_ids)
+        values = np.ascontiguousarray(frames['payload'][:, :4 * count]).view('<i4')
+        columns = {'time': frames['time']}
+        for index, packet in enumerate(self.packet_ids):
+            columns[packet] = values[:, index]
+        return columns
+
+    # Commands and reads in the order they happened as (kind, time, bytes), with the records
+    # that continue them joined back. A chunk whose start was overwritten is left out
+    def events(self, kinds=(COMMAND, READ)):
+        events = []
+        last = {}
+        for record in self.records[np.isin(self.records['kind'], kinds)]:
+            kind = int(record['kind'])
+            data = record['payload'][:record['length']].tobytes()
+            if record['flags'] & CONTINUED:
+                if kind in last:
+                    index = last[kind]
+                    events[index] = (kind, events[index][1], events[index][2] + data)
+            else:
+                last[kind] = len(events)
+                events.append((kind, float(record['time']), data))
+        return events
+
+    # Commands or reads as (time, bytes)
+    def chunks(self, kind):
+        return [(when, data) for _, when, data in self.events((kind,))]
+
+    def commands(self):
+        return self.chunks(COMMAND)
+
+    def reads(self):
+        return self.chunks(READ)
+
+    # Drive (137) and Drive Direct (145) commands: time, opcode and the two 16 bit
+    # arguments as they went on the wire (velocity and radius, or the two wheel velocities)
+    def drive_commands(self):
+        commands = self.of_kind(COMMAND)
+        payload = commands['payload']
+        drives = commands[((payload[:, 0] == DRIVE) | (payload[:, 0] == DRIVE_DIRECT))
+                          & (commands['length'] >= DRIVE_STRUCT.size)]
+        payload = drives['payload'].astype(np.int32)
+        first = (payload[:, 1] << 8) | payload[:, 2]
+        second = (payload[:, 3] << 8) | payload[:, 4]
+        return {'time': drives['time'], 'opcode': payload[:, 0],
+                'first': np.where(first >= 32768, first - 65536, first),
+                'second': np.where(second >= 32768, second - 65536, second)}
+
+    def summary(self):
+        lines = []
+        duration = self.records['time'][-1] - self.records['time'][0] if len(self) else 0.0
+        lines.append("%d records over %.1f s (%d written, %d overwritten)" % (
+            len(self), duration, self.written, self.dropped))
+        for kind, name in sorted(KIND_NAMES.items()):
+            count = int(np.sum(self.records['kind'] == kind))
+            rate = count / duration if duration else 0.0
+            lines.append("%-8s %8d  %7.1f /s" % (name, count, rate))
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(TelemetryLog(sys.argv[1]).summary())
@@ -0,0 +1,183 @@
+'''
+Chrome trace of the control loops
+
+When random_walk() turns late after a bump, the metrics (Metrics.py) say how long the
+requests and the lock waits take on average, not what happened in that one tick. With
+ROOMBA_TRACE set, every thread of the run records spans:
+
+    tick     one iteration of a behavior loop: random_walk, wall, hug_wall, dock, side
+    query    a Sensors or Query List request, from the write to the end of the answer
+    write    every command written to the serial port, read: every read
+    sleep    Scheduler and Motion sleeping until their next deadline
+    lock     waits for a MeteredLock another thread holds
+    worker   a call run by the SerialWorker thread
+    motion   a turn or a drive of Motion, and the walk waiting for it (finish_turn)
+
+At exit they are written in the Chrome Trace Event format, one row per thread:
+
+    ROOMBA_TRACE=trace.json python proj2v4.py
+    # open trace.json in https://ui.perfetto.dev or chrome://tracing
+
+TRACER.save() writes it while the program runs. Only the last MAX_EVENTS spans are kept.
+Without ROOMBA_TRACE TRACER is None and every hook is one test of it.
+'''
+import atexit
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+# ************************************ TRACE ******************************************#
+#
+#  PATH: where the trace is written at exit, tracing is off when it is not set
+#  MAX_EVENTS: spans kept, the oldest are dropped first (about 100 bytes each)
+#
+#  A span is kept as a tuple (name, category, start, duration, thread, args) with the
+#  perf_counter times, the Chrome format is only made when the trace is saved.
+#
+# *************************************************************************************#
+PATH = os.environ.get('ROOMBA_TRACE')
+MAX_EVENTS = 500000
+
+perf_counter = time.perf_counter
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.complete(self.name, self.category, self.start, perf_counter(), self.args)
+        return False
+
+
+# What span() gives when tracing is off
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    def __init__(self, path=None, limit=MAX_EVENTS):
+        self.path = path
+        self.events = collections.deque(maxlen=limit)
+        self.count = 0
+        self.threads = {}
+        self.ticks = {}
+        self.names = {}
+        self.origin = perf_counter()
+
+    # The calling thread (its id in the OS, as top -H shows it), named the first time
+    # it records something
+    def thread(self):
+        ident = threading.get_native_id()
+        if ident not in self.threads:
+            self.threads[ident] = threading.current_thread().name
+        return ident
+
+    # A span on the calling thread from start to end (perf_counter seconds)
+    def complete(self, name, category, start, end, args=None):
+        self.events.append((name, category, start, end - start, self.thread(), args))
+        self.count += 1
+
+    def span(self, name, category='span', args=None):
+        return Span(self, name, category, args)
+
+    # Start a tick of the loop name on this thread, which ends the tick before it
+    # tick(None) only ends it, when the loop stops
+    def tick(self, name=None):
+        now = perf_counter()
+        ident = self.thread()
+        last = self.ticks.pop(ident, None)
+        if last is not None:
+            self.complete(last[0], 'tick', last[1], now)
+        if name is not None:
+            self.ticks[ident] = (name, now)
+
+    # Span name of a command: the opcode, and the packets a request asks for
+    def command(self, instr):
+        name = self.names.get(instr)
+        if name is None:
+            from Interface import SENSORS_OP, QUERY_LIST
+            from Metrics import OPCODE_NAMES, request_name
+            if instr[0] in (SENSORS_OP, QUERY_LIST):
+                name = request_name(instr)
+            else:
+                name = OPCODE_NAMES.get(instr[0], str(instr[0]))
+            self.names[instr] = name
+        return name
+
+    # ********************************** SAVING ***********************************#
+
+    def trace(self):
+        now = perf_counter()
+        pid = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                   'args': {'name': os.path.basename(sys.argv[0]) or 'python'}}]
+        for ident, name in list(self.threads.items()):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': ident, 'args': {'name': name}})
+        spans = list(self.events)
+        dropped = self.count - len(spans)
+        # Ticks still running end now
+        spans.extend((name, 'tick', start, now - start, ident, None)
+                     for ident, (name, start) in list(self.ticks.items()))
+        # Parents before their children: by thread, start and the longest first
+        spans.sort(key=lambda span: (span[4], span[2], -span[3]))
+        for name, category, start, duration, ident, args in spans:
+            event = {'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': ident,
+                     'ts': round((start - self.origin) * 1e6, 3), 'dur': round(duration * 1e6, 3)}
+            if args:
+                event['args'] = args
+            events.append(event)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'spans': self.count, 'dropped': dropped}}
+
+    def save(self, path=None):
+        path = path or self.path
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f)
+        return path
+
+
+TRACER = Tracer(PATH) if PATH else None
+
+
+# Save the trace at exit, with a note on stderr where it went
+def save_at_exit():
+    if TRACER is not None and TRACER.count:
+        sys.stderr.write("trace written to %s\n" % TRACER.save())
+
+
+atexit.register(save_at_exit)
+
+
+# ************************** HOOKS FOR THE PROJECT SCRIPTS ****************************#
+
+# Start a tick of the behavior loop name on this thread, tick() when the loop ends
+def tick(name=None):
+    if TRACER is not None:
+        TRACER.tick(name)
+
+
+# with span('finish_turn', 'motion'): ...
+def span(name, category='span', args=None):
+    if TRACER is None:
+        return NULL_SPAN
+    return Span(TRACER, name, category, args)
@@ -0,0 +1,362 @@
+'''
+Gain tuner for the wall follower
+
+The gains of the wall following controllers were found by trying them on the robot.
+Tuner tries them in the simulator instead, thousands of times, on a process pool with a
+worker per core. An episode drives a WallFollower (the controller of hug_wall()) along
+the walls of a simulated room for a while with one set of parameters:
+
+    kp, ki, kd       PID gains
+    set_point        gap to keep from the wall (mm)
+    sampling_time    time between control ticks (s)
+    speed            forward speed (mm/s)
+
+and scores it on three things:
+
+    error        mean difference (mm) between the real gap to the wall and set_point
+    oscillation  how much the turn rate changes, in degrees/s per second
+    velocity     mean forward speed the robot really made (mm/s)
+
+Episodes are seeded. The seed picks the size of the room, whether it has a notch (an
+outside corner to go around), where the robot starts and the noise on the light bumpers,
+so a seed gives the same episode every time and different runs are comparable. Every
+candidate runs the same seeds. The candidates that no other candidate beats on all three
+scores (the Pareto front) are printed, best tracking first. Candidates that bumped into a
+wall or lost it are left out of the front.
+
+    python Tuner.py grid --grid kp=1,2,4 --grid kd=0,0.4 --episodes 8
+    python Tuner.py bayes --trials 200 --seed 1 --output tuned.json
+
+grid tries every combination of the --grid values (the other parameters keep their
+DEFAULT_GRID values). bayes samples the parameter ranges (RANGES): first at random, then
+where a Gaussian process fitted to the scores so far expects the biggest improvement, on
+a different weighting of the three scores every round (ParEGO), so it spreads over the
+front.
+'''
+import argparse
+import concurrent.futures
+import itertools
+import json
+import math
+import os
+import random
+import time
+
+from Interface import *
+from Simulator import World, closest_point, TICK
+from WallFollower import WallFollower, KI
+
+# ********************************** EPISODES ****************************************#
+#
+#  EPISODE_SECONDS: simulated time of an episode
+#  ROOM_SIZES: the room is a rectangle between these sizes (mm)...
+#  NOTCH_CHANCE, NOTCH_SIZES: ...with a corner cut out of it, sometimes
+#  START_GAP, START_ANGLE: the robot starts beside the south wall, up to START_GAP mm
+#                          off the set point and START_ANGLE degrees off the wall
+#  LIGHT_NOISE: standard deviation of the light bumper noise, a fraction of the signal
+#  MAX_BUMPS, MAX_LOST: mean bumps per episode, and share of the ticks without a wall on
+#                       the side, a candidate can have and still make the front. Going
+#                       around an outside corner loses the wall for a moment
+#
+# ***********************************************************************************#
+EPISODE_SECONDS = 40
+ROOM_SIZES = (2500, 5000)
+NOTCH_CHANCE = 0.5
+NOTCH_SIZES = (600, 1200)
+START_GAP = 40
+START_ANGLE = 10
+LIGHT_NOISE = 0.05
+MAX_BUMPS = 0
+MAX_LOST = 0.1
+
+PARAMETERS = ('kp', 'ki', 'kd', 'set_point', 'sampling_time', 'speed')
+DEFAULT_GRID = {
+    'kp': (1.0, 2.0, 3.0, 4.0),
+    'ki': (KI,),
+    'kd': (0.0, 0.2, 0.4, 0.8),
+    'set_point': (40, 60, 100),
+    'sampling_time': (0.03, 0.05, 0.1),
+    'speed': (100, 200, 300),
+}
+RANGES = {
+    'kp': (0.2, 8.0),
+    'ki': (0.0, 2.0),
+    'kd': (0.0, 1.5),
+    'set_point': (30, 150),
+    'sampling_time': (0.015, 0.25),
+    'speed': (50, MAX_VEL),
+}
+# Scores: True when bigger is better
+SCORES = (('error', False), ('oscillation', False), ('velocity', True))
+
+INITIAL_TRIALS = 0.25  # share of the bayes trials sampled at random first
+EI_SAMPLES = 2000      # random points the expected improvement is checked on per round
+BATCH = 8              # candidates per bayes round, fixed so the search does not depend on the cores
+
+
+# The room of an episode, as wall segments
+def room(rng):
+    width = rng.uniform(*ROOM_SIZES)
+    height = rng.uniform(*ROOM_SIZES)
+    corners = [(0, 0), (width, 0), (width, height), (0, height)]
+    if rng.random() < NOTCH_CHANCE:
+        notch_x = rng.uniform(*NOTCH_SIZES)
+        notch_y = rng.uniform(*NOTCH_SIZES)
+        corners[2:3] = [(width, height - notch_y), (width - notch_x, height - notch_y),
+                        (width - notch_x, height)]
+    return [(corners[i], corners[(i + 1) % len(corners)]) for i in range(len(corners))]
+
+
+# Gap (mm) between the side of the robot and the nearest wall
+def wall_gap(world):
+    gap = None
+    for a, b in world.walls:
+        px, py = closest_point((world.x, world.y), a, b)
+        distance = math.hypot(px - world.x, py - world.y)
+        if gap is None or distance < gap:
+            gap = distance
+    return gap - ROBOT_RADIUS
+
+
+# The six light bumpers, with noise
+def lights(world, rng):
+    values = {}
+    for packet in LIGHT_PACKETS:
+        signal = world.light(LIGHT_SENSORS[packet])
+        if signal:
+            signal = max(0, int(round(signal * (1 + rng.gauss(0, LIGHT_NOISE)))))
+        values[packet] = signal
+    return values
+
+
+# One wall following episode. Returns the scores and counts of the episode
+def episode(params, seed, seconds=EPISODE_SECONDS):
+    rng = random.Random(seed)
+    walls = room(rng)
+    start_x = rng.uniform(600, 1200)
+    start_gap = params['set_point'] + rng.uniform(-START_GAP, START_GAP)
+    pose = (start_x, ROBOT_RADIUS + max(5, start_gap), math.radians(rng.uniform(-START_ANGLE, START_ANGLE)))
+    world = World(walls=walls, cliffs=[], pose=pose)
+    follower = WallFollower(params['set_point'], params['speed'], params['kp'], params['ki'], params['kd'])
+
+    period = params['sampling_time']
+    steps = max(1, int(math.ceil(period / TICK - 1e-9)))
+    step = period / steps
+    ticks = int(seconds / period)
+    errors = 0.0
+    turning = 0.0
+    last_rate = None
+    bumps = 0
+    bumped = False
+    for _ in range(ticks):
+        right, left = follower.update(lights(world, rng), period)
+        world.set_wheels(left, right)
+        rate = math.degrees((right - left) / float(DIAMETER))
+        if last_rate is not None:
+            turning += abs(rate - last_rate)
+        last_rate = rate
+        for _ in range(steps):
+            world.step(step)
+        errors += abs(wall_gap(world) - params['set_point'])
+        bump = world.bump_left or world.bump_right
+        if bump and not bumped:
+            bumps += 1
+        bumped = bump
+    elapsed = ticks * period
+    return {
+        'error': errors / ticks,
+        'oscillation': turning / elapsed,
+        'velocity': world.distance / elapsed,
+        'bumps': bumps,
+        'lost': follower.lost / float(ticks),
+    }
+
+
+# Mean scores of params over the seeds. Runs in the worker processes
+def evaluate(task):
+    params, seeds, seconds = task
+    results = [episode(params, seed, seconds) for seed in seeds]
+    scores = dict(params)
+    for key in results[0]:
+        scores[key] = sum(result[key] for result in results) / float(len(results))
+    return scores
+
+
+# ************************************* TUNER ****************************************#
+#
+#  Runs the candidates on a process pool. Every candidate gets the same episode seeds
+#  (seed, seed + 1, ...), results keep the order the candidates were given in
+#
+# ***********************************************************************************#
+class Tuner:
+    def __init__(self, episodes=4, seconds=EPISODE_SECONDS, seed=0, workers=None):
+        self.seeds = list(range(seed, seed + episodes))
+        self.seconds = seconds
+        self.workers = workers or os.cpu_count() or 1
+        self.results = []
+        self.pool = None
+
+    def __enter__(self):
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.shutdown()
+
+    def run(self, candidates):
+        tasks = [(candidate, self.seeds, self.seconds) for candidate in candidates]
+        results = list(self.pool.map(evaluate, tasks, chunksize=max(1, len(tasks) // (4 * self.workers))))
+        self.results.extend(results)
+        return results
+
+    # Every combination of the grid values
+    def grid(self, grid):
+        values = [grid[name] for name in PARAMETERS]
+        return self.run([dict(zip(PARAMETERS, combination)) for combination in itertools.product(*values)])
+
+    # Bayesian optimization of a random weighting of the scores every round (ParEGO)
+    def bayes(self, trials, ranges=RANGES, seed=0):
+        rng = np.random.default_rng(seed)
+        initial = max(2, int(trials * INITIAL_TRIALS))
+        self.run([to_params(point, ranges) for point in rng.random((initial, len(PARAMETERS)))])
+        while len(self.results) < trials:
+            batch = min(BATCH, trials - len(self.results))
+            points = np.array([to_unit(result, ranges) for result in self.results])
+            weights = rng.dirichlet(np.ones(len(SCORES)))
+            targets = scalarize(self.results, weights)
+            samples = rng.random((EI_SAMPLES, len(PARAMETERS)))
+            improvement = expected_improvement(points, targets, samples)
+            best = samples[np.argsort(-improvement)[:batch]]
+            self.run([to_params(point, ranges) for point in best])
+        return self.results
+
+
+# Parameters from a point in the unit cube and back
+def to_params(point, ranges):
+    params = {}
+    for name, value in zip(PARAMETERS, point):
+        low, high = ranges[name]
+        params[name] = float(low + value * (high - low))
+    params['set_point'] = int(round(params['set_point']))
+    params['speed'] = int(round(params['speed']))
+    return params
+
+
+def to_unit(params, ranges):
+    return [(params[name] - ranges[name][0]) / float(ranges[name][1] - ranges[name][0])
+            for name in PARAMETERS]
+
+
+# One number to minimize from the three scores: each score scaled to 0..1 over the results
+# so far, then the augmented Chebyshev distance with weights. Bumps and losses are added
+# so the search stays away from them
+def scalarize(results, weights):
+    columns = []
+    for name, bigger in SCORES:
+        column = np.array([result[name] for result in results], dtype=float)
+        if bigger:
+            column = -column
+        spread = column.max() - column.min()
+        columns.append((column - column.min()) / spread if spread else np.zeros(len(column)))
+    scaled = np.array(columns).T * weights
+    penalty = np.array([result['bumps'] + result['lost'] for result in results])
+    return scaled.max(axis=1) + 0.05 * scaled.sum(axis=1) + penalty
+
+
+# Expected improvement of the samples over the best target, from a Gaussian process with a
+# squared exponential kernel fitted to the points
+def expected_improvement(points, targets, samples, length=0.3, noise=1e-4):
+    mean = targets.mean()
+    std = targets.std() or 1.0
+    y = (targets - mean) / std
+
+    def kernel(a, b):
+        distances = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)
+        return np.exp(-0.5 * distances / length ** 2)
+
+    factor = np.linalg.cholesky(kernel(points, points) + noise * np.eye(len(points)))
+    alpha = np.linalg.solve(factor.T, np.linalg.solve(factor, y))
+    cross = kernel(samples, points)
+    predicted = cross.dot(alpha)
+    v = np.linalg.solve(factor, cross.T)
+    sigma = np.sqrt(np.maximum(1e-12, 1.0 - (v * v).sum(axis=0)))
+    z = (y.min() - predicted) / sigma
+    cdf = 0.5 * (1 + np.array([math.erf(value / math.sqrt(2)) for value in z]))
+    pdf = np.exp(-0.5 * z ** 2) / math.sqrt(2 * math.pi)
+    return sigma * (z * cdf + pdf)
+
+
+# True when a is at least as good as b on every score and better on one
+def dominates(a, b):
+    better = False
+    for name, bigger in SCORES:
+        x, y = (a[name], b[name]) if bigger else (b[name], a[name])
+        if x < y:
+            return False
+        if x > y:
+            better = True
+    return better
+
+
+# The results no other result dominates, best tracking first
+def pareto(results, max_bumps=MAX_BUMPS, max_lost=MAX_LOST):
+    safe = [result for result in results if result['bumps'] <= max_bumps and result['lost'] <= max_lost]
+    front = [result for result in safe if not any(dominates(other, result) for other in safe)]
+    return sorted(front, key=lambda result: result['error'])
+
+
+# name=1,2,3
+def grid_values(text):
+    name, values = text.split('=', 1)
+    if name not in PARAMETERS:
+        raise argparse.ArgumentTypeError("unknown parameter " + name)
+    return name, tuple(number(value) for value in values.split(','))
+
+
+def number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('search', choices=('grid', 'bayes'))
+    parser.add_argument('--grid', action='append', type=grid_values, default=[], metavar='NAME=V1,V2',
+                        help='values to try for a parameter (grid search)')
+    parser.add_argument('--trials', type=int, default=200, help='candidates to try (bayes search)')
+    parser.add_argument('--episodes', type=int, default=4, help='episodes (seeds) per candidate')
+    parser.add_argument('--seconds', type=float, default=EPISODE_SECONDS, help='simulated time per episode')
+    parser.add_argument('--seed', type=int, default=0, help='first episode seed, and the seed of the search')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--output', help='write every result to this JSON file')
+    args = parser.parse_args()
+
+    start = time.time()
+    with Tuner(args.episodes, args.seconds, args.seed, args.workers) as tuner:
+        if args.search == 'grid':
+            grid = dict(DEFAULT_GRID)
+            grid.update(args.grid)
+            results = tuner.grid(grid)
+        else:
+            results = tuner.bayes(args.trials, seed=args.seed)
+    elapsed = time.time() - start
+    print("%d candidates, %d episodes in %.1f s on %d workers" % (
+        len(results), len(results) * args.episodes, elapsed, tuner.workers))
+
+    print("%7s %6s %6s %9s %8s %6s   %9s %11s %8s" % ('kp', 'ki', 'kd', 'set_point', 'sampling', 'speed',
+                                                  'error mm', 'oscillation', 'mm/s'))
+    for result in pareto(results):
+        print("%7.3f %6.3f %6.3f %9d %8.3f %6d   %9.1f %11.1f %8.1f" % (
+            result['kp'], result['ki'], result['kd'], result['set_point'], result['sampling_time'],
+            result['speed'], result['error'], result['oscillation'], result['velocity']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'search': args.search, 'seeds': tuner.seeds, 'seconds': args.seconds,
+                       'results': results, 'pareto': pareto(results)}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+'''
+Wall following with all six light bumpers
+
+pd() in Projects 3 and 4 steers on LIGHT_RIGHT alone. One reading can't tell a wall that
+is far away from one that turns away, so the robot had to crawl at 40 mm/s to keep it.
+That PD is LightPD, at the end of this file.
+WallFollower reads the six light bumpers with one Query List request and turns the
+readings into two numbers:
+
+    distance  gap between the side of the robot and the wall, in mm
+    angle     angle of the wall to the heading in degrees, positive when it closes in ahead
+
+and steers with a PID controller on the distance the robot will be from the wall a little
+further on (LOOKAHEAD mm). The center and front bumpers on the other side watch for a wall
+ahead: the robot slows down and turns away from it before it bumps. When the wall goes
+away (an outside corner) the robot arcs around to find it again.
+
+    follower = WallFollower(gap=60, speed=200)
+    values = roomba.query(*LIGHT_PACKETS).values
+    right, left = follower.update(values, dt)
+    roomba.drive_direct(right, left)
+
+The distances come from the light signal with the LIGHT_MAX / LIGHT_FALLOFF curve in
+Interface.py, which is worth checking on each robot and wall.
+'''
+import math
+
+from Interface import *
+
+# ******************************** WALL FOLLOWING ************************************#
+#
+#  GAP: gap to keep between the robot and the wall (mm)
+#  FOLLOW_SPEED: forward speed along a straight wall (mm/s)
+#  KP, KI, KD: PID gains, the output is the difference between the wheel speeds (mm/s)
+#              for an error in mm
+#  DERIVATIVE_FILTER: time constant (s) of the low pass filter on the D term, the light
+#                     readings are noisy and the raw derivative would amplify that
+#  LOOKAHEAD: the error is the gap LOOKAHEAD mm further on, which damps the turns
+#  MIN_SIGNAL: weaker light readings are taken as no wall
+#  FRONT_SLOW, FRONT_TURN: a wall ahead closer than FRONT_SLOW slows the robot down, closer
+#                          than FRONT_TURN it turns on the spot away from it
+#  SEARCH_RATIO: with no wall on the side the inner wheel runs at this fraction of the speed
+#
+# ***********************************************************************************#
+GAP = 60
+FOLLOW_SPEED = 200
+KP = 2.0
+KI = 0.5
+KD = 0.4
+DERIVATIVE_FILTER = 0.1
+LOOKAHEAD = 150
+MIN_SIGNAL = 5
+FRONT_SLOW = 150
+FRONT_TURN = 60
+SEARCH_RATIO = 0.4
+
+RIGHT = 'right'
+LEFT = 'left'
+
+# Bumpers looking at the side wall (sideways first) and ahead, for each side
+SIDE_PACKETS = {RIGHT: (LIGHT_RIGHT, LIGHT_FRONT_RIGHT), LEFT: (LIGHT_LEFT, LIGHT_FRONT_LEFT)}
+FRONT_PACKETS = {RIGHT: (LIGHT_CENTER_RIGHT, LIGHT_CENTER_LEFT, LIGHT_FRONT_LEFT),
+                 LEFT: (LIGHT_CENTER_LEFT, LIGHT_CENTER_RIGHT, LIGHT_FRONT_RIGHT)}
+
+
+# Distance (mm) from a light bumper to what it sees, None when it sees nothing
+def light_distance(signal):
+    if signal < MIN_SIGNAL:
+        return None
+    return max(0.0, LIGHT_FALLOFF * math.log(float(LIGHT_MAX) / signal))
+
+
+# Where the wall a light bumper sees is, from the center of the robot: x ahead, y to the
+# left. None when it sees nothing
+def light_point(packet, signal):
+    distance = light_distance(signal)
+    if distance is None:
+        return None
+    reach = ROBOT_RADIUS + distance
+    bearing = math.radians(LIGHT_SENSORS[packet])
+    return reach * math.cos(bearing), reach * math.sin(bearing)
+
+
+# Discrete PID with a filtered derivative and anti windup
+# The output is clamped to -limit..limit, and while it is clamped the integral only moves
+# in the direction that brings it back
+class PID:
+    def __init__(self, kp, ki=0.0, kd=0.0, limit=None, derivative_filter=DERIVATIVE_FILTER):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.limit = limit
+        self.derivative_filter = derivative_filter
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.derivative = 0.0
+        self.last_error = None
+        self.output = 0.0
+
+    def update(self, error, dt):
+        if dt <= 0:
+            return self.output
+        if self.last_error is not None:
+            raw = (error - self.last_error) / dt
+            self.derivative += dt / (self.derivative_filter + dt) * (raw - self.derivative)
+        self.last_error = error
+
+        integral = self.integral + self.ki * error * dt
+        output = self.kp * error + integral + self.kd * self.derivative
+        if self.limit is not None and abs(output) > self.limit:
+            output = math.copysign(self.limit, output)
+            # Saturated: keep the old integral unless the error pulls the output back
+            if error * output < 0:
+                self.integral = integral
+        else:
+            self.integral = integral
+        self.output = output
+        return output
+
+
+# The wall on one side of the robot, from one reading of the six light bumpers
+# distance and angle are None when the side bumpers see nothing, front when nothing is ahead
+class WallEstimate:
+    def __init__(self, distance, angle, front):
+        self.distance = distance
+        self.angle = angle
+        self.front = front
+
+    def __repr__(self):
+        return "WallEstimate(%s, %s, %s)" % (self.distance, self.angle, self.front)
+
+
+class WallFollower:
+    def __init__(self, gap=GAP, speed=FOLLOW_SPEED, kp=KP, ki=KI, kd=KD, side=RIGHT,
+                 lookahead=LOOKAHEAD):
+        self.gap = gap
+        self.speed = speed
+        self.side = side
+        self.sign = -1 if side == RIGHT else 1  # y of the wall side
+        self.lookahead = lookahead
+        self.pid = PID(kp, ki, kd, limit=speed)
+        self.angle = 0.0
+        self.wall = None
+        self.error = None
+        self.lost = 0
+        self.updates = 0
+
+    # Fuse the six light bumper values (packet id -> value) into a WallEstimate
+    def estimate(self, values):
+        side, ahead = SIDE_PACKETS[self.side]
+        beside = light_point(side, values.get(side, 0))
+        front_side = light_point(ahead, values.get(ahead, 0))
+        # Both side bumpers see the wall: the line through the two points. Only one does:
+        # a wall at the last angle through that point
+        if beside is not None and front_side is not None and front_side[0] > beside[0] + 1:
+            self.angle = math.degrees(math.atan2(self.sign * (beside[1] - front_side[1]),
+                                                 front_side[0] - beside[0]))
+        point = beside or front_side
+        distance = None
+        if point is not None:
+            angle = math.radians(self.angle)
+            # Distance from the center to the line through point at the wall angle
+            distance = abs(point[1] * math.cos(angle) + self.sign * point[0] * math.sin(angle))
+            distance -= ROBOT_RADIUS
+        front = None
+        for packet in FRONT_PACKETS[self.side]:
+            seen = light_distance(values.get(packet, 0))
+            if seen is not None and (front is None or seen < front):
+                front = seen
+        return WallEstimate(distance, self.angle if distance is not None else None, front)
+
+    # One control step: the light bumper values and the time since the last step
+    # Returns the right and left wheel speeds, in the order drive_direct takes them
+    def update(self, values, dt):
+        self.updates += 1
+        wall = self.wall = self.estimate(values)
+        speed = self.speed
+        if wall.front is not None and wall.front < FRONT_TURN:
+            # Wall ahead: turn away from the side wall on the spot
+            self.pid.reset()
+            return self.wheels(0, -speed / 2.0)
+        if wall.front is not None and wall.front < FRONT_SLOW:
+            speed *= max(0.3, (wall.front - FRONT_TURN) / float(FRONT_SLOW - FRONT_TURN))
+
+        if wall.distance is None:
+            # No wall on the side: arc towards where it was
+            self.lost += 1
+            self.error = None
+            self.pid.reset()
+            return self.wheels(speed, speed * (1 - SEARCH_RATIO))
+        # Positive error: too far from the wall, turn towards it
+        self.error = wall.distance - self.lookahead * math.sin(math.radians(wall.angle)) - self.gap
+        turn = self.pid.update(self.error, dt)
+        return self.wheels(speed, turn)
+
+    # Forward speed and turn towards the wall (mm/s difference) to (right, left) speeds
+    def wheels(self, speed, turn):
+        towards = turn if self.side == RIGHT else -turn
+        right = max(MIN_VEL, min(MAX_VEL, speed - towards))
+        left = max(MIN_VEL, min(MAX_VEL, speed + towards))
+        return int(right), int(left)
+
+    def stats(self):
+        return {'updates': self.updates, 'lost': self.lost, 'angle': self.angle}
+
+
+# ************************************ LIGHT PD **************************************#
+#
+#  The Project 3 controller, for wall() in proj3v7 and the wall coroutine in
+#  AsyncInterface.py: a PD on the LIGHT_RIGHT reading alone
+#
+#  LIGHT_SET_POINT: LIGHT_RIGHT reading to keep, about 90 mm from the wall
+#  LIGHT_KP, LIGHT_KD: gains, the output is a wheel speed change (mm/s) for an error in
+#                      light units
+#  LIGHT_SPEED: forward speed (mm/s)
+#
+# ***********************************************************************************#
+LIGHT_SET_POINT = 300
+LIGHT_KP = 0.016
+LIGHT_KD = 0.002
+LIGHT_SPEED = 40
+
+
+class LightPD:
+    def __init__(self, set_point=LIGHT_SET_POINT, kp=LIGHT_KP, kd=LIGHT_KD):
+        self.set_point = set_point
+        self.kp = kp
+        self.kd = kd
+        self.error = 0
+        self.past_error = 0
+
+    # One step on the LIGHT_RIGHT reading and the time since the last step, returns u
+    def update(self, light_right, dt):
+        self.past_error = self.error
+        self.error = self.set_point - light_right
+        return self.kp * self.error + self.kd * (self.error - self.past_error) / dt
+
+
+# Right and left wheel speeds for a LightPD output u, in the order drive_direct takes them
+# A large u (far from the wall) turns towards it at a fixed speed
+def light_speeds(u):
+    if u > 5:
+        return 25, 35
+    elif 3.5 <= u <= 5:
+        return LIGHT_SPEED - u, 100 + u
+    else:
+        return LIGHT_SPEED - u, LIGHT_SPEED + u
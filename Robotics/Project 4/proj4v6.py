@@ -1,15 +1,26 @@
 from Interface import *
+from SerialWorker import SerialWorker, BACKGROUND, DRIVE
+from ButtonEvents import ButtonEvents, PRESS
+from Scheduler import Scheduler
+from WallFollower import WallFollower
+from Docking import DockingEngine, DOCK_PACKETS, DOCK_PERIOD, DOCKED
+from Trace import tick
+import Log
 import threading
 
-lock = threading.Lock()
+# One connection to the Roomba, owned by the serial worker thread.
+# Every helper and thread hands its commands to the worker
+roomba = RoombaClient()
+bus = SerialWorker(roomba)
 
 
 # ************************************ HELPER METHODS **************************************#
 #
-# We use semaphores to avoid synchronisation problems
 # Cliffs, wheels, bumpers and clean all need to read and write to the roomba
-# By locking the specific method each time it is used, we prevent multiple threads
-# from overloading the Roomba
+# Instead of locking the port in every method, the commands are queued to the serial
+# worker, which sends them one at a time. Stop and mode changes go first, so the robot
+# can always stop even while another thread waits for a sensor reading
+# Commands don't wait for the worker, sensor reads wait for their answer
 #
 # Following Methods Included:
 #   turn_time: Given the velocity and angle, we find the time needed to turn Roomba
@@ -19,89 +30,89 @@ lock = threading.Lock()
 #
 # ********************************************************************************************#
 
-# Stops the robot
+# Stops the robot, the wheel commands still queued are dropped
+# Returns the future of the stop
 def stop():
-    lock.acquire()
-    Interface2().control("stop")
-    lock.release()
+    return bus.submit('control', 'stop')
 
 
-# Check if the clean button has been pressed
-# Sleep whenever it is pressed because it is very sensitive
-def clean_state():
+# Stop the wheels but stay in the OI, the robot only answers the button reads there
+# The wheel commands still queued are dropped
+def halt():
+    bus.cancel(DRIVE)
+    return bus.submit('drive_direct', 0, 0)
+
+
+# Read the buttons packet for the button thread
+# It waits behind the behavior's own reads so it never slows the control loop down
+def read_buttons():
+    return bus.submit('sensor', BUTTONS_PACKET_ID, priority=BACKGROUND).result()
+
+
+# Set by the button thread whenever clean changes, the stopped main loop waits for it
+clean_changed = threading.Event()
+
+
+# Called by the button thread for every clean button event
+# A press toggles clean once, no matter how long the button is held
+def clean_state(event):
     global clean
-    lock.acquire()
-    if Interface2().button('clean'):
+    if event.kind == PRESS:
         clean = not clean
-    time.sleep(SLEEP_EXTENDED)
-    print("CLEAN: " + str(clean))
-    lock.release()
+        log.info("CLEAN: %s", clean)
+        clean_changed.set()
 
 
 # Control the individual speed of the wheels
 def drive_direct(lspeed, rspeed):
-    lock.acquire()
-    Interface2().drive_direct(lspeed, rspeed)
-    lock.release()
+    bus.submit('drive_direct', lspeed, rspeed)
 
 
+# Both bumpers come from the same packet, read it once
 def bumpers():
-    lock.acquire()
-    l_bumper = Interface2().bump_wheels('left')
-    r_bumper = Interface2().bump_wheels('right')
-    lock.release()
-    return l_bumper, r_bumper
+    bumps = bus.submit('query', BUMPERS_PACKET_ID).result()
+    return bumps.bumper('left'), bumps.bumper('right')
 
 
 def song():
-    lock.acquire()
-    Interface2().song()
-    lock.release()
+    bus.submit('song')
 
 
 def play_song():
-    lock.acquire()
-    Interface2().play_song()
-    lock.release()
+    return bus.submit('play_song')
 
 
-# Get the values for all the right light bump requests
-def light():
-    lock.acquire()
-    light_right = Interface2().light_bump(LIGHT_RIGHT)
-    while (light_right > 1000):
-        light_right = 300
-    lock.release()
-    return light_right
+# Read all six light bumpers with a single request
+def lights():
+    return bus.submit('query', *LIGHT_PACKETS).result().values
 
 
 def omni_value():
-    lock.acquire()
-    omni_v = Interface2().ir_omni()
-    lock.release()
-    return omni_v
+    return bus.submit('ir_omni').result()
 
 
 def dock_red_value():
-    lock.acquire()
-    dock_red = Interface2().ir_right()
-    lock.release()
-    return dock_red
+    return bus.submit('ir_right').result()
 
 
 def dock_green_value():
-    lock.acquire()
-    dock_green = Interface2().ir_left()
-    lock.release()
-    return dock_green
+    return bus.submit('ir_left').result()
+
+
+# Read the red and green dock beacons with a single request
+def dock_values():
+    beacons = bus.submit('query', INFRARED_RIGHT, INFRARED_LEFT).result()
+    return beacons[INFRARED_RIGHT], beacons[INFRARED_LEFT]
+
+
+# Everything a docking tick needs with a single request
+def dock_sensors():
+    return bus.submit('query', *DOCK_PACKETS).result()
 
 
 def charging_state_value():
     global charging_state_v
-    lock.acquire()
-    charging_state_v = Interface2().charging_state()
-    time.sleep(SLEEP_EXTENDED)
-    lock.release()
+    charging_state_v = bus.submit('charging_state').result()
 
 
 # Global Constants
@@ -111,162 +122,124 @@ r_bumper = False
 LSPEED = 50
 RSPEED = 50
 
-set_point = 300
-past_error = 0
-error = 0
-sampling_time = 0.25
-# original kp = 0.016, kd=0.002
-kp = 0.016
-kd = 0.002
-
-
-# PD Controller
-# Determines what to based on sensor readings
-def pd():
-    global error
-    global past_error
-    light_right = light()
-    '''
-    print('LIGHT_RIGHT: ' + str(light_right))
-    print("LIGHT_FRONT_R: " + str(light_front_right))
-    print("LIGHT_CENTER_R: " + str(light_center_right))
-    '''
-    print('LIGHT_RIGHT: ' + str(light_right))
-
-    # Update last error
-    past_error = error
-    error = set_point - light_right
-    print("LIGHT RIGHT: " + str(light_right))
-    print("ERROR: " + str(error))
-    # Proportional Controller
-    P = kp * error
-    # Derivative Controller
-    D = (kd * (error - past_error)) / sampling_time
-    # Controller output
-    u = P
-    print("U Value: " + str(u))
-    return int(u)
+# Wall following (WallFollower.py)
+# set_point is the gap to keep to the wall in mm and speed the forward speed in mm/s
+# The old PD on LIGHT_RIGHT alone needed 40 mm/s, set_point 300 and kp = 0.016, kd = 0.002
+set_point = 60
+speed = 200
+sampling_time = 0.05
+kp = 2.0
+ki = 0.5
+kd = 0.4
+follower = WallFollower(set_point, speed, kp, ki, kd)
+# Runs wall following every sampling_time seconds on fixed deadlines (Scheduler.py)
+loop = Scheduler(sampling_time)
+
+# Messages go through Log.py, ROOMBA_LOG=debug shows the wall following values of every
+# PID_LOG_EVERY-th tick
+PID_LOG_EVERY = 5
+log = Log.get('proj4v6')
+pid_log = log.every(PID_LOG_EVERY)
+
+# Docking (Docking.py) reads its sensors once per tick at the rate the Roomba updates them
+docking = DockingEngine()
+dock_loop = Scheduler(DOCK_PERIOD)
+
+
+# PID Controller
+# Estimates the gap and the angle to the wall from the six light bumpers and steers on them
+# dt is the real time since the last reading
+# Returns the right and left wheel speeds
+def pid(dt=None):
+    follower.gap = set_point
+    follower.speed = speed
+    follower.pid.kp, follower.pid.ki, follower.pid.kd = kp, ki, kd
+    follower.pid.limit = speed
+    right, left = follower.update(lights(), dt or sampling_time)
+    wall = follower.wall
+    pid_log.debug("GAP: %s ANGLE: %s FRONT: %s RIGHT: %s LEFT: %s", wall.distance, wall.angle, wall.front, right, left)
+    return right, left
 
 
 def hug_wall():
-    print("entered hug wall")
-    u = pd()
-
-    if u > 5:
-        LSPEED = 35
-        RSPEED = 25
-
-    elif 3.5 <= u <= 5:
-        LSPEED = 100 + u
-        RSPEED = 40 - u
-
-    else:
-        LSPEED = 40 + u
-        RSPEED = 40 - u
-
-    Interface2().drive_direct(RSPEED, LSPEED)
-    time.sleep(sampling_time)
+    tick('hug_wall')
+    log.debug("entered hug wall")
+    right, left = pid(loop.dt)
+    drive_direct(right, left)
+    loop.wait(sampling_time)
 
 
+# Drive onto the dock, one snapshot of the beams, bumpers and charging state per tick
+# Returns the docking stats: time to dock and steering reversals
 def dock():
-    print("Dock Detected.")
-    dock_red = dock_red_value()
-    dock_green = dock_green_value()
-    global LSPEED
-    global RSPEED
+    log.info("Dock Detected.")
     global charging_state_v
-
-    l_bumper, r_bumper = bumpers()
-
-    while charging_state_v <= 0 or (not l_bumper and r_bumper):
-        print("Entered charging loop")
-
-        dock_red = dock_red_value()
-        dock_green = dock_green_value()
-
-        print("CHARGING STATE: " + str(charging_state_v))
-        omni_v = omni_value()
-        print("OMNI: " + str(omni_v))
-
-        print("Dock Green\t:" + str(dock_green) + "\tDock Red:\t" + str(dock_green))
-
-        while dock_green - dock_red > 10:
-            print("in g > r")
-            Interface2().drive_direct(20, -20)
-            dock_red = dock_red_value()
-            dock_green = dock_green_value()
-            l_bumper, r_bumper = bumpers()
-            time.sleep(SLEEP_EXTENDED / 2)
-            if l_bumper and r_bumper:
-                stop()
-                charging_state = 1
-                break
-
-        while dock_red - dock_green > 10:
-            print("in r > g")
-            Interface2().drive_direct(-20, 20)
-            dock_red = dock_red_value()
-            dock_green = dock_green_value()
-            l_bumper, r_bumper = bumpers()
-            time.sleep(SLEEP_EXTENDED / 2)
-            if l_bumper and r_bumper:
-                stop()
-                charging_state = 1
-                break
-
-        while dock_red - dock_green < 10 or dock_red - dock_green < 10 or omni_v == 168:
-            print("in r = g")
-            Interface2().drive_direct(20, 20)
-            dock_red = dock_red_value()
-            dock_green = dock_green_value()
-            l_bumper, r_bumper = bumpers()
-            time.sleep(SLEEP_EXTENDED / 2)
-            if l_bumper and r_bumper:
-                stop()
-                charging_state = 1
-                break
-
-        l_bumper, r_bumper = bumpers()
-        print("Charging state:" + str(charging_state_v))
-
-    stop()
-    play_song()
-
-
-Interface2().control('start')
-Interface2().control('safe')
-Interface2().control('full')
-Interface2().song()
-
-clean = True
-charging_state_v = 0
-clean_thread = threading.Thread(target=clean_state)
-clean_thread.start()
-charging_thread = threading.Thread(target=charging_state_value)
-charging_thread.start()
-clean_thread.join()
-charging_thread.join()
-while True:
-
-    # Interface2().play_song()
-    if not isMOVING and clean:
-        isMOVING = True
-        omni_v = omni_value()
-        print("Entering loop")
-        while omni_v <= 0:
-            print("Looping")
-            hug_wall()
+    docking.start(time.monotonic())
+    # No reading at all if the engine is done before the first tick
+    snapshot = None
+    while docking.active():
+        tick('dock')
+        snapshot = dock_sensors()
+        right, left = docking.update(snapshot.values, snapshot.timestamp)
+        drive_direct(right, left)
+        dock_loop.wait()
+    tick()
+    drive_direct(0, 0)
+    # On the dock counts as charging even before the charging state says so
+    charging = snapshot[CHARGING_STATE] if snapshot is not None else 0
+    charging_state_v = charging or int(docking.state == DOCKED)
+    stats = docking.stats()
+    log.info("DOCKING: %s", stats)
+    if docking.state == DOCKED:
+        play_song()
+    return stats
+
+
+if __name__ == '__main__':
+    bus.submit('control', 'start')
+    bus.submit('control', 'safe')
+    bus.submit('control', 'full')
+    song()
+
+    clean = True
+    charging_state_v = 0
+    buttons = ButtonEvents(read_buttons)
+    buttons.subscribe(clean_state)
+    buttons.start()
+    charging_thread = threading.Thread(target=charging_state_value)
+    charging_thread.start()
+    charging_thread.join()
+    while True:
+
+        # Interface2().play_song()
+        if not isMOVING and clean:
+            isMOVING = True
             omni_v = omni_value()
-        print("Omni V Detected: " + str(omni_v))
-
-        dock()
-
-        if charging_state_v > 0:
-            stop()
-            play_song()
-            quit()
-
-    if isMOVING and not clean:
-        stop()
-    # u = pd()
-    # print("U value: " + str(u))
+            log.info("Entering loop")
+            while omni_v <= 0 and clean:
+                log.debug("Looping")
+                hug_wall()
+                omni_v = omni_value()
+
+            if clean:
+                log.info("Omni V Detected: %s", omni_v)
+                dock()
+
+                if charging_state_v > 0:
+                    stop()
+                    # The worker is a daemon thread, let it send the song before we quit
+                    play_song().result()
+                    bus.close()
+                    quit()
+            # Lost the dock or stopped by the clean button
+            isMOVING = False
+
+        if not clean:
+            # Stop once, then sleep until the clean button is pressed again
+            halt()
+            clean_changed.clear()
+            while not clean:
+                clean_changed.wait()
+                clean_changed.clear()
+        # right, left = pid()
+        # print("RIGHT: " + str(right) + " LEFT: " + str(left))